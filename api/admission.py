@@ -0,0 +1,137 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+# Lower is admitted first: live voice calls cannot wait, chat users can retry
+CHANNEL_PRIORITIES = {"voice": 0, "whatsapp": 1, "chat": 2}
+DEFAULT_CHANNEL = "chat"
+
+
+class AdmissionRejectedError(Exception):
+    """Raised when a turn is shed, retry_after is the number of seconds the caller should wait."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def channel_of(channel: str):
+    return channel if channel in CHANNEL_PRIORITIES else DEFAULT_CHANNEL
+
+
+class AdmissionController:
+    """Limits the number of turns running at once, queueing the others by channel priority.
+
+    Turns wait at most queue_timeout seconds for a slot. When the queue is full, a turn is shed, unless
+    a queued turn of a lower priority channel can be shed in its place. max_in_flight 0 disables the limit.
+    """
+
+    def __init__(self, max_in_flight: int = 32, max_queue: int = 100, queue_timeout: float = 10, retry_after: int = 5):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.in_flight = 0
+        # Heap of (priority, sequence, channel, future), first in first out within a priority
+        self.waiters = []
+        self.sequence = itertools.count()
+        self.admitted = {channel: 0 for channel in CHANNEL_PRIORITIES}
+        self.shed = {channel: 0 for channel in CHANNEL_PRIORITIES}
+        self.timeouts = 0
+
+    @asynccontextmanager
+    async def admit(self, channel: str = DEFAULT_CHANNEL):
+        await self.acquire(channel)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, channel: str = DEFAULT_CHANNEL):
+        """Wait for a slot, raises AdmissionRejectedError when the turn is shed. Call release() when done."""
+        channel = channel_of(channel)
+        if self.max_in_flight <= 0 or (self.in_flight < self.max_in_flight and len(self.waiters) == 0):
+            self.in_flight += 1
+            self.admitted[channel] += 1
+            return
+
+        priority = CHANNEL_PRIORITIES[channel]
+        if len(self.waiters) >= self.max_queue:
+            lowest = max(self.waiters) if self.waiters else None
+            if lowest is None or lowest[0] <= priority:
+                self._reject(channel, "queue full")
+            # Make room by shedding the most recent turn of the lowest priority channel
+            self.waiters.remove(lowest)
+            heapq.heapify(self.waiters)
+            self.shed[lowest[2]] += 1
+            lowest[3].set_exception(AdmissionRejectedError(f"Shed in favor of a {channel} turn", self.retry_after))
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self.sequence), channel, future)
+        heapq.heappush(self.waiters, entry)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not future.done():
+                self._forget(entry)
+                self.timeouts += 1
+                self._reject(channel, f"no slot within {self.queue_timeout}s")
+        except asyncio.CancelledError:
+            # The caller went away: give back the slot if it was handed over meanwhile
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release()
+            else:
+                self._forget(entry)
+            raise
+
+        # Raises if the turn was shed while queued
+        future.result()
+        self.admitted[channel] += 1
+
+    def release(self):
+        # Hand the slot over to the first queued turn, the in-flight count does not change
+        while self.waiters:
+            _, _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def _forget(self, entry):
+        if entry in self.waiters:
+            self.waiters.remove(entry)
+            heapq.heapify(self.waiters)
+        entry[3].cancel()
+
+    def _reject(self, channel: str, reason: str):
+        self.shed[channel] += 1
+        logger.warning(f"Shedding {channel} turn: {reason} ({self.in_flight} in flight, {len(self.waiters)} queued)")
+        raise AdmissionRejectedError(f"Too many turns in progress: {reason}", self.retry_after)
+
+    def stats(self):
+        queued = {channel: 0 for channel in CHANNEL_PRIORITIES}
+        for _, _, channel, _ in self.waiters:
+            queued[channel] += 1
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queue_depth": len(self.waiters),
+            "queued": queued,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "timeouts": self.timeouts,
+        }
+
+
+def create_admission_controller():
+    return AdmissionController(
+        max_in_flight=int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "32")),
+        max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "100")),
+        queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "10")),
+        retry_after=int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "5")),
+    )
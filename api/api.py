@@ -1,3 +1,6 @@
+from contextlib import asynccontextmanager
+import os
+import anyio
 from fastapi import FastAPI
 from dotenv import load_dotenv
 import logging
@@ -7,13 +10,39 @@ from fastapi.responses import JSONResponse
 from fastapi.middleware.gzip import GZipMiddleware
 from starlette_gzip_request import GZipRequestMiddleware
 from utils.log_utils import setup_logger
+from admission import AdmissionRejectedError
 
 load_dotenv(override=True)
 logging.basicConfig(level=logging.INFO)
 logging.getLogger("azure").setLevel(logging.WARNING)
 setup_logger()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup logic
+    # Size the threadpool running the remaining blocking work (media decoding and transcription)
+    anyio.to_thread.current_default_thread_limiter().total_tokens = int(os.getenv("API_THREADPOOL_SIZE", "40"))
+    await db.initialize()
+    await images.initialize()
+    await remote.start()
+    await turn_queue.initialize()
+    await turn_workers.start()
+    if archiver is not None:
+        await archiver.start()
+    
+    # Regular FastAPI execution
+    yield
+    
+    # Cleanup logic
+    if archiver is not None:
+        await archiver.close()
+    await turn_workers.close()
+    await turn_queue.close()
+    await remote.close()
+    await images.close()
+    await db.close()
+
+app = FastAPI(lifespan=lifespan)
 # Enable GZip compression for response
 app.add_middleware(GZipMiddleware, minimum_size=1000)
 app.add_middleware(GZipRequestMiddleware)
@@ -27,8 +56,19 @@ async def validation_exception_handler(request, exc):
         content={"detail": exc.errors()},
     )
 
-from routers.conversation import conversation_router
+@app.exception_handler(AdmissionRejectedError)
+async def admission_exception_handler(request, exc):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+from routers.conversation import archiver, conversation_router, db, images, remote, turn_queue, turn_workers
 app.include_router(conversation_router)
 
 from routers.integration import integration_router
-app.include_router(integration_router)
\ No newline at end of file
+app.include_router(integration_router)
+
+from routers.metrics import metrics_router
+app.include_router(metrics_router)
\ No newline at end of file
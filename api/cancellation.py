@@ -0,0 +1,76 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str):
+    # Rough estimate, about 4 characters per token for english text
+    return (len(text) + 3) // 4
+
+
+async def until_disconnected(request, marks):
+    """Pass the stream updates through until the client disconnects, then cancel the stream.
+
+    The stream is cancelled where it is waiting (e.g. on the team host), so its cleanup runs right away
+    instead of when the next update fails to be written. The updates then end quietly. Both transports drop
+    the call to the team host, but only the gRPC host stops the team then (see WatchedTeam), the REST host
+    drains the call and the team runs to the end.
+    """
+    task = asyncio.current_task()
+    disconnected = False
+
+    async def _watch():
+        nonlocal disconnected
+        # The request body has been read already, the next message is the disconnection
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+        disconnected = True
+        task.cancel()
+
+    watcher = asyncio.ensure_future(_watch())
+    try:
+        async for mark in marks:
+            yield mark
+    except asyncio.CancelledError:
+        if not disconnected:
+            raise
+        task.uncancel()
+        logger.info("Client disconnected, stream cancelled")
+    finally:
+        watcher.cancel()
+
+
+class CancellationStats:
+    """Counts the streamed turns cancelled by a client disconnection, and estimates the tokens they saved.
+
+    Tokens saved are estimated as the average tokens streamed by the completed turns, less the tokens
+    streamed before the cancellation.
+    """
+
+    def __init__(self):
+        self.completed = 0
+        self.completion_tokens = 0
+        self.cancelled = 0
+        self.tokens_saved = 0
+
+    def complete(self, completion_tokens: int):
+        self.completed += 1
+        self.completion_tokens += completion_tokens
+
+    def cancel(self, streamed_tokens: int):
+        self.cancelled += 1
+        saved = max(0, self.average_completion_tokens() - streamed_tokens)
+        self.tokens_saved += saved
+        return saved
+
+    def average_completion_tokens(self):
+        return self.completion_tokens // self.completed if self.completed else 0
+
+    def stats(self):
+        return {
+            "completed_turns": self.completed,
+            "cancelled_turns": self.cancelled,
+            "average_completion_tokens": self.average_completion_tokens(),
+            "estimated_tokens_saved": self.tokens_saved,
+        }
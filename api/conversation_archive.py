@@ -0,0 +1,282 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+import time
+
+from conversation_store import ConversationConflictError
+
+logger = logging.getLogger(__name__)
+
+# Agent of the telco team closing the conversations, and its marker (see telco-team/planner_agent.py)
+TERMINATING_AGENT = "Planner"
+TERMINATE_MARKER = re.compile(r"\bTERMINATE\b")
+
+
+def _encode(conversation_id: str, item: dict):
+    # JSON lines: a header line, then one line per message
+    lines = [json.dumps({
+        "conversation_id": conversation_id,
+        "variables": item.get("variables", {}),
+        "message_count": len(item["messages"]),
+        "archived_at": time.time(),
+    })]
+    lines += [json.dumps(message) for message in item["messages"]]
+    return gzip.compress(("\n".join(lines) + "\n").encode("utf-8"))
+
+
+def _decode(data: bytes):
+    lines = gzip.decompress(data).decode("utf-8").splitlines()
+    header = json.loads(lines[0])
+    return {
+        "id": header["conversation_id"],
+        "conversation_id": header["conversation_id"],
+        "messages": [json.loads(line) for line in lines[1:] if line],
+        "variables": header["variables"],
+    }
+
+
+class LocalArchive:
+    """Archives conversations as {conversation_id}.jsonl.gz files in a local folder, for local development and tests."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    async def initialize(self):
+        os.makedirs(self.path, exist_ok=True)
+
+    async def close(self):
+        pass
+
+    async def write(self, conversation_id: str, item: dict):
+        await asyncio.to_thread(self._write, conversation_id, _encode(conversation_id, item))
+
+    def _write(self, conversation_id: str, data: bytes):
+        path = os.path.join(self.path, f"{conversation_id}.jsonl.gz")
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    async def read(self, conversation_id: str):
+        return await asyncio.to_thread(self._read, conversation_id)
+
+    def _read(self, conversation_id: str):
+        try:
+            with open(os.path.join(self.path, f"{conversation_id}.jsonl.gz"), "rb") as f:
+                return _decode(f.read())
+        except FileNotFoundError:
+            return None
+
+
+class BlobArchive:
+    """Archives conversations as {conversation_id}.jsonl.gz blobs in an Azure Storage container."""
+
+    def __init__(self, account_url: str, container_name: str, credential):
+        from azure.storage.blob.aio import BlobServiceClient
+
+        self.client = BlobServiceClient(account_url, credential=credential)
+        self.container = self.client.get_container_client(container_name)
+        self.credential = credential
+
+    async def initialize(self):
+        from azure.core.exceptions import ResourceExistsError
+
+        try:
+            await self.container.create_container()
+        except ResourceExistsError:
+            pass
+
+    async def close(self):
+        await self.client.close()
+        if hasattr(self.credential, "close"):
+            await self.credential.close()
+
+    async def write(self, conversation_id: str, item: dict):
+        await self.container.upload_blob(f"{conversation_id}.jsonl.gz", _encode(conversation_id, item), overwrite=True)
+
+    async def read(self, conversation_id: str):
+        from azure.core.exceptions import ResourceNotFoundError
+
+        try:
+            download = await self.container.download_blob(f"{conversation_id}.jsonl.gz")
+        except ResourceNotFoundError:
+            return None
+        return _decode(await download.readall())
+
+
+class ArchivedConversationStore:
+    """Wraps the Cosmos DB conversation store with a cold archive.
+
+    Archived conversations are written to the archive, then replaced in the store by an archived header (their
+    messages get a ttl so Cosmos DB deletes them). Reading an archived conversation (or one whose items are
+    expiring) writes it back from the archive first, so callers never notice it was archived. The archive is only
+    read for those: a conversation missing from the store is new.
+    """
+
+    def __init__(self, store, archive, item_ttl: int = 86400):
+        self.store = store
+        self.archive = archive
+        self.item_ttl = item_ttl
+        self.archived = 0
+        self.restored = 0
+        self.archive_reads = 0
+
+    @property
+    def mode(self):
+        return self.store.mode
+
+    async def initialize(self):
+        await self.store.initialize()
+        await self.archive.initialize()
+
+    async def close(self):
+        await self.store.close()
+        await self.archive.close()
+
+    async def get_conversation(self, conversation_id, last_n: int = None):
+        item = await self.store.get_conversation(conversation_id, last_n=last_n)
+        if item is None or not _is_archived(item):
+            return item
+
+        self.archive_reads += 1
+        archived = await self.archive.read(conversation_id)
+        if archived is None:
+            # Expiring but not archived (interrupted archiving), keep what is still there
+            archived = await self.store.get_conversation(conversation_id)
+        logger.info(f"Restoring archived conversation {conversation_id}")
+        await self.store.restore_conversation(conversation_id, archived)
+        self.restored += 1
+        return await self.store.get_conversation(conversation_id, last_n=last_n)
+
+    async def save_conversation(self, conversation_id: str, conversation, history_count: int = 0, history: dict = None, if_match: bool = False):
+        return await self.store.save_conversation(conversation_id, conversation, history_count, history, if_match=if_match)
+
+    async def archive_conversation(self, conversation_id: str):
+        """Move a conversation to the archive, returns False if it is gone, already archived or changed meanwhile."""
+        item = await self.store.get_conversation(conversation_id)
+        if item is None or _is_archived(item):
+            return False
+        await self.archive.write(conversation_id, item)
+        try:
+            await self.store.expire_conversation(conversation_id, item, self.item_ttl)
+        except ConversationConflictError:
+            # A new turn came in, it stays hot; the archive is overwritten next time
+            return False
+        self.archived += 1
+        return True
+
+    async def find_inactive(self, cutoff: float, limit: int = 100):
+        return await self.store.find_inactive(cutoff, limit)
+
+    def stats(self):
+        return {
+            "archived": self.archived,
+            "restored": self.restored,
+            "archive_reads": self.archive_reads,
+        }
+
+
+def _is_archived(item: dict):
+    # Conversations archived before the archived headers only had a ttl
+    return item.get("archived", False) or "ttl" in item
+
+
+def _terminated(messages: list[dict]):
+    # The planner ends a conversation with a last message holding the TERMINATE marker; the word in another message
+    # (e.g. "I want to terminate my contract") does not end it
+    if len(messages) == 0:
+        return False
+    last = messages[-1]
+    return last.get("name") == TERMINATING_AGENT and isinstance(last.get("content"), str) and TERMINATE_MARKER.search(last["content"]) is not None
+
+
+class ConversationArchiver:
+    """Periodically moves the finished conversations to the archive.
+
+    A conversation is finished ended_grace seconds after a turn ending with TERMINATE (unless another turn came
+    in), or after inactivity seconds without any turn. At most batch_size conversations are archived per sweep.
+    """
+
+    def __init__(self, store: ArchivedConversationStore, inactivity: float = 7 * 86400, ended_grace: float = 3600,
+                 interval: float = 3600, batch_size: int = 100, on_archived=None):
+        self.store = store
+        self.inactivity = inactivity
+        self.ended_grace = ended_grace
+        self.interval = interval
+        self.batch_size = batch_size
+        self.on_archived = on_archived
+        # Conversation id -> time its last turn ended it
+        self.ended = {}
+        self.task = None
+        self.sweeps = 0
+        self.failures = 0
+
+    async def start(self):
+        self.task = asyncio.ensure_future(self._run())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    def note_turn(self, conversation_id: str, new_messages: list[dict]):
+        if _terminated(new_messages):
+            self.ended[conversation_id] = time.time()
+        else:
+            self.ended.pop(conversation_id, None)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Archiving sweep failed: {e}")
+
+    async def sweep(self):
+        now = time.time()
+        candidates = [c for c, ended_at in self.ended.items() if ended_at < now - self.ended_grace]
+        candidates += await self.store.find_inactive(now - self.inactivity, self.batch_size)
+
+        archived = 0
+        for conversation_id in list(dict.fromkeys(candidates))[:self.batch_size]:
+            try:
+                if await self.store.archive_conversation(conversation_id):
+                    archived += 1
+                    if self.on_archived is not None:
+                        self.on_archived(conversation_id)
+                self.ended.pop(conversation_id, None)
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Archiving conversation {conversation_id} failed: {e}")
+        self.sweeps += 1
+        logger.info(f"Archived {archived} of {len(candidates)} finished conversations")
+        return archived
+
+    def stats(self):
+        return {
+            **self.store.stats(),
+            "ended_pending": len(self.ended),
+            "sweeps": self.sweeps,
+            "failures": self.failures,
+        }
+
+
+def create_archive():
+    """Create the cold archive, ARCHIVE_TARGET selects none (default), local or blob."""
+    target = os.getenv("ARCHIVE_TARGET", "none")
+    if target == "none":
+        return None
+    if target == "local":
+        return LocalArchive(os.getenv("ARCHIVE_LOCAL_PATH", "archive"))
+    if target == "blob":
+        from azure.identity.aio import DefaultAzureCredential
+
+        return BlobArchive(
+            account_url=os.getenv("ARCHIVE_BLOB_ACCOUNT_URL"),
+            container_name=os.getenv("ARCHIVE_BLOB_CONTAINER", "conversations"),
+            credential=DefaultAzureCredential(),
+        )
+    raise ValueError(f"Invalid archive target: {target}")
@@ -0,0 +1,261 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from vanilla_aiagents.conversation import Conversation
+from conversation_store import APPEND_MODE, ConversationConflictError
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationCache:
+    """An LRU cache of conversations with a TTL, bounded by number of entries and approximate size in bytes."""
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 64 * 1024 * 1024, ttl: float = 300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    # Get a conversation, accept optionally tells whether the cached item can serve the lookup
+    def get(self, conversation_id: str, accept=None):
+        entry = self.entries.get(conversation_id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        item, size, expires_at = entry
+        if expires_at < time.monotonic():
+            self.expirations += 1
+            self.misses += 1
+            self.pop(conversation_id)
+            return None
+
+        if accept is not None and not accept(item):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(conversation_id)
+        return item
+
+    def put(self, conversation_id: str, item: dict):
+        self.pop(conversation_id)
+        size = len(json.dumps(item, default=str))
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+
+        self.entries[conversation_id] = (item, size, time.monotonic() + self.ttl)
+        self.size += size
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            _, (_, evicted_size, _) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def pop(self, conversation_id: str):
+        entry = self.entries.pop(conversation_id, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+def _copy(item: dict):
+    # Callers extend the messages list and variables in place, never hand out the cached objects
+    if item is None:
+        return None
+    return {**item, "messages": list(item.get("messages", [])), "variables": dict(item.get("variables", {}))}
+
+
+class CachedConversationStore:
+    """Wraps a conversation store with an in-process cache and optimistic concurrency.
+
+    Reads are served from the cache when the same worker handled the previous turn. Writes are always
+    conditional on the etag of the item the turn was built from, so a stale cache entry or a concurrent
+    writer on another replica is detected: the fresh history is reloaded, the new messages of the turn are
+    appended to it and the write is retried.
+
+    With write_behind, the cache is updated immediately and the write to the store happens in the
+    background; writes of the same conversation are chained so they are applied in order.
+    """
+
+    def __init__(self, store, cache: ConversationCache, history_window: int = 0, max_retries: int = 3, write_behind: bool = False):
+        self.store = store
+        self.cache = cache
+        self.history_window = history_window
+        self.max_retries = max_retries
+        self.write_behind = write_behind
+        self.pending = {}
+        self.conflicts = 0
+        self.write_errors = 0
+
+    @property
+    def mode(self):
+        return self.store.mode
+
+    async def initialize(self):
+        await self.store.initialize()
+
+    async def close(self):
+        await self.flush()
+        await self.store.close()
+
+    async def flush(self):
+        """Wait for all the background writes to complete."""
+        if self.pending:
+            await asyncio.gather(*self.pending.values(), return_exceptions=True)
+
+    async def get_conversation(self, conversation_id, last_n: int = None):
+        item = self.cache.get(conversation_id, accept=lambda i: self._covers(i, last_n))
+        if item is not None:
+            return _copy(self._window(item, last_n))
+
+        # A write still in flight is fresher than what the store holds
+        if conversation_id in self.pending:
+            await asyncio.gather(self.pending[conversation_id], return_exceptions=True)
+
+        item = await self.store.get_conversation(conversation_id, last_n=last_n)
+        if item is not None:
+            self.cache.put(conversation_id, _copy(item))
+        return _copy(item)
+
+    async def get_history(self, conversation_id, since: int = 0):
+        """Get the messages of a conversation from index since on, with its message_count and _etag.
+
+        In append mode only the header and the messages after since are read, not the whole history.
+        """
+        item = await self.get_conversation(conversation_id, last_n=1 if self.store.mode == APPEND_MODE else None)
+        if item is None:
+            return None
+        count = item.get("message_count", len(item["messages"]))
+        # The item holds the last messages of the history, up to count
+        first = count - len(item["messages"])
+        if since < first:
+            item = await self.get_conversation(conversation_id, last_n=count - since)
+            first = count - len(item["messages"])
+        return {**item, "messages": item["messages"][max(0, since - first):], "message_count": count}
+
+    async def save_conversation(self, conversation_id: str, conversation: Conversation, history_count: int = 0, history: dict = None):
+        if not self.write_behind:
+            return await self._write(conversation_id, conversation, history_count, history)
+
+        previous = self.pending.get(conversation_id)
+        self._cache_turn(conversation_id, history, conversation, history_count, history.get("_etag") if history else None)
+        task = asyncio.ensure_future(self._write_behind(conversation_id, conversation, history_count, history, previous))
+        self.pending[conversation_id] = task
+        task.add_done_callback(lambda t: self.pending.pop(conversation_id, None) if self.pending.get(conversation_id) is t else None)
+
+    async def _write_behind(self, conversation_id, conversation, history_count, history, previous):
+        if previous is not None:
+            # Build on top of the previous write of the same conversation, it holds the current etag
+            written = (await asyncio.gather(previous, return_exceptions=True))[0]
+            if isinstance(written, BaseException):
+                history = await self.store.get_conversation(conversation_id, last_n=self.history_window)
+                conversation, history_count = self._rebase(conversation, history_count, history)
+            else:
+                # The previous write may have been rebased on a concurrent one, rebase this turn on it too
+                history = {**(history or {}), **written}
+                conversation, history_count = self._rebase(conversation, history_count, history)
+        try:
+            # Only the latest turn of the conversation may refresh the cache, later turns are ahead of this write
+            task = asyncio.current_task()
+            return await self._write(conversation_id, conversation, history_count, history, update_cache=lambda: self.pending.get(conversation_id) is task)
+        except Exception as e:
+            self.write_errors += 1
+            self.cache.pop(conversation_id)
+            logger.error(f"Background write of conversation {conversation_id} failed: {e}")
+            raise
+
+    async def _write(self, conversation_id, conversation, history_count, history, update_cache=lambda: True):
+        attempt = 0
+        while True:
+            try:
+                written = await self.store.save_conversation(conversation_id, conversation, history_count, history, if_match=True)
+                break
+            except ConversationConflictError:
+                self.conflicts += 1
+                self.cache.pop(conversation_id)
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                logger.warning(f"Conversation {conversation_id} changed concurrently, retrying save ({attempt}/{self.max_retries})")
+                history = await self.store.get_conversation(conversation_id, last_n=self.history_window)
+                conversation, history_count = self._rebase(conversation, history_count, history)
+
+        if update_cache():
+            self._cache_turn(conversation_id, history, conversation, history_count, written.get("_etag"), written)
+        return {**written, "messages": conversation.messages}
+
+    def _rebase(self, conversation: Conversation, history_count: int, history: dict):
+        # Append the new messages of this turn on top of the fresh history
+        delta = conversation.messages[history_count:]
+        messages = list(history["messages"]) if history is not None else []
+        if len(messages) > 0 and len(delta) > 0 and delta[0].get("role") == "system":
+            # The workflow added a system prompt believing the conversation was new
+            delta = delta[1:]
+        return Conversation(messages=messages + delta, variables=conversation.variables), len(messages)
+
+    def _cache_turn(self, conversation_id, history, conversation, history_count, etag, written=None):
+        item = {**(history or {}), **(written or {})}
+        item.pop("messages", None)
+        item.update({
+            "id": conversation_id,
+            "conversation_id": conversation_id,
+            "variables": conversation.variables,
+            "_etag": etag,
+        })
+        messages = conversation.messages
+        if self.store.mode == APPEND_MODE:
+            item["type"] = "header"
+            item["message_count"] = (history or {}).get("message_count", history_count) + len(messages) - history_count
+            if self.history_window:
+                messages = messages[-self.history_window:]
+        item["messages"] = messages
+        self.cache.put(conversation_id, _copy(item))
+
+    def _covers(self, item, last_n):
+        # Append mode entries may hold only the tail of the history
+        if self.store.mode != APPEND_MODE or item.get("type") != "header":
+            return True
+        if len(item["messages"]) >= item.get("message_count", 0):
+            return True
+        return last_n is not None and 0 < last_n <= len(item["messages"])
+
+    def _window(self, item, last_n):
+        if self.store.mode == APPEND_MODE and item.get("type") == "header" and last_n:
+            return {**item, "messages": item["messages"][-last_n:]}
+        return item
+
+    def stats(self):
+        return {
+            **self.cache.stats(),
+            "conflicts": self.conflicts,
+            "pending_writes": len(self.pending),
+            "write_errors": self.write_errors,
+        }
+
+
+def create_conversation_cache():
+    return ConversationCache(
+        max_entries=int(os.getenv("CONVERSATION_CACHE_MAX_ENTRIES", "1000")),
+        max_bytes=int(os.getenv("CONVERSATION_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+        ttl=float(os.getenv("CONVERSATION_CACHE_TTL_SECONDS", "300")),
+    )
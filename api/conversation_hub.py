@@ -0,0 +1,48 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationHub:
+    """Tracks the WebSocket sessions open on each conversation, so messages can be pushed to them.
+
+    Sessions are tracked per API replica: a message is only pushed to the sessions connected to this replica.
+    """
+
+    def __init__(self):
+        self.sockets = {}
+        self.pushed = 0
+
+    def connect(self, conversation_id: str, websocket):
+        self.sockets.setdefault(conversation_id, set()).add(websocket)
+
+    def disconnect(self, conversation_id: str, websocket):
+        sockets = self.sockets.get(conversation_id)
+        if sockets is not None:
+            sockets.discard(websocket)
+            if len(sockets) == 0:
+                del self.sockets[conversation_id]
+
+    async def publish(self, conversation_id: str, mark: str, content, exclude=None):
+        """Send [mark, content] to the sessions of the conversation, returns the number of sessions reached."""
+        frame = json.dumps([mark, content]) + "\n"
+        delivered = 0
+        for websocket in list(self.sockets.get(conversation_id, [])):
+            if websocket is exclude:
+                continue
+            try:
+                await websocket.send_text(frame)
+                delivered += 1
+            except Exception as e:
+                logger.warning(f"Dropping session of conversation {conversation_id}: {e}")
+                self.disconnect(conversation_id, websocket)
+        self.pushed += delivered
+        return delivered
+
+    def stats(self):
+        return {
+            "conversations": len(self.sockets),
+            "sessions": sum([len(sockets) for sockets in self.sockets.values()]),
+            "pushed": self.pushed,
+        }
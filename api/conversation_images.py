@@ -0,0 +1,255 @@
+import asyncio
+import base64
+import hashlib
+import io
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Stored images are referenced in the image_url parts of the messages as image-ref:<sha256 of the bytes>
+IMAGE_REF_PREFIX = "image-ref:"
+# Replaces the images of the earlier messages in what is sent to the team
+IMAGE_PLACEHOLDER = {"type": "text", "text": "[An image was shared here earlier in the conversation]"}
+
+
+def downscale(data: bytes, max_size: int, quality: int):
+    """Fit the image in max_size x max_size pixels, recompressed as JPEG.
+
+    An image that fits keeps its format (a JPEG is recompressed if that makes it smaller), an image PIL cannot
+    decode is returned unchanged, like before downscaling.
+    """
+    from PIL import Image
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        original_format = image.format
+        resized = max(image.size) > max_size
+        if not resized and original_format != "JPEG":
+            return data
+        if resized:
+            image.thumbnail((max_size, max_size))
+        if image.mode not in ["RGB", "L"]:
+            image = image.convert("RGB")
+
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+    except Exception as e:
+        # Unsupported, truncated or too large to decode safely, the model may still read it
+        logger.warning(f"Could not downscale an image of {len(data)} bytes, keeping it as is: {e}")
+        return data
+    if not resized and output.tell() >= len(data):
+        return data
+    return output.getvalue()
+
+
+def _mime_type(data: bytes):
+    # Images that were not downscaled keep their format
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    if data.startswith(b"GIF8"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def _data_url(data: bytes):
+    # Same URL as WorkflowInput.add_image_bytes, with the type of the image
+    return f"data:{_mime_type(data)};base64,{base64.b64encode(data).decode('utf-8')}"
+
+
+def _image_ref(part: dict):
+    # The digest of a stored image part, None for any other part
+    if part.get("type") != "image_url":
+        return None
+    url = part.get("image_url", {}).get("url", "")
+    return url[len(IMAGE_REF_PREFIX):] if url.startswith(IMAGE_REF_PREFIX) else None
+
+
+def _has_refs(message: dict):
+    return isinstance(message.get("content"), list) and any([_image_ref(part) for part in message["content"]])
+
+
+class LocalImageStore:
+    """Stores images as {digest}.jpg files in a local folder, for local development and tests."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    async def initialize(self):
+        os.makedirs(self.path, exist_ok=True)
+
+    async def close(self):
+        pass
+
+    async def put(self, digest: str, data: bytes):
+        """Store the image, returns False if it was stored already."""
+        return await asyncio.to_thread(self._put, digest, data)
+
+    def _put(self, digest: str, data: bytes):
+        path = os.path.join(self.path, f"{digest}.jpg")
+        if os.path.exists(path):
+            return False
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        return True
+
+    async def get(self, digest: str):
+        return await asyncio.to_thread(self._get, digest)
+
+    def _get(self, digest: str):
+        try:
+            with open(os.path.join(self.path, f"{digest}.jpg"), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+class BlobImageStore:
+    """Stores images as {digest}.jpg blobs in an Azure Storage container."""
+
+    def __init__(self, account_url: str, container_name: str, credential):
+        from azure.storage.blob.aio import BlobServiceClient
+
+        self.client = BlobServiceClient(account_url, credential=credential)
+        self.container = self.client.get_container_client(container_name)
+        self.credential = credential
+
+    async def initialize(self):
+        from azure.core.exceptions import ResourceExistsError
+
+        try:
+            await self.container.create_container()
+        except ResourceExistsError:
+            pass
+
+    async def close(self):
+        await self.client.close()
+        if hasattr(self.credential, "close"):
+            await self.credential.close()
+
+    async def put(self, digest: str, data: bytes):
+        from azure.core.exceptions import ResourceExistsError
+        from azure.storage.blob import ContentSettings
+
+        try:
+            await self.container.upload_blob(f"{digest}.jpg", data, overwrite=False, content_settings=ContentSettings(content_type=_mime_type(data)))
+            return True
+        except ResourceExistsError:
+            # Content addressed, the same image is already there
+            return False
+
+    async def get(self, digest: str):
+        from azure.core.exceptions import ResourceNotFoundError
+
+        try:
+            download = await self.container.download_blob(f"{digest}.jpg")
+        except ResourceNotFoundError:
+            return None
+        return await download.readall()
+
+
+class ImagePipeline:
+    """Downscales the uploaded images and, with a store, keeps them out of the conversation.
+
+    Stored images are referenced in the messages by their digest. Only the images of the new messages of a turn
+    are resolved to bytes when the turn is sent to the team, the ones of earlier messages are replaced by a
+    short text, so they are not sent to the team and the model again on every turn.
+    """
+
+    def __init__(self, store=None, max_size: int = 1024, quality: int = 85):
+        self.store = store
+        self.max_size = max_size
+        self.quality = quality
+        self.images = 0
+        self.deduplicated = 0
+        self.bytes_received = 0
+        self.bytes_kept = 0
+        self.resolved = 0
+        self.omitted = 0
+
+    async def initialize(self):
+        if self.store is not None:
+            await self.store.initialize()
+
+    async def close(self):
+        if self.store is not None:
+            await self.store.close()
+
+    async def add(self, data: bytes):
+        """Process an uploaded image, returns the URL of its image_url part."""
+        self.images += 1
+        self.bytes_received += len(data)
+        if self.max_size > 0:
+            # Decoding and encoding are CPU bound, keep them off the event loop
+            data = await asyncio.to_thread(downscale, data, self.max_size, self.quality)
+        self.bytes_kept += len(data)
+        if self.store is None:
+            return _data_url(data)
+
+        digest = hashlib.sha256(data).hexdigest()
+        if not await self.store.put(digest, data):
+            self.deduplicated += 1
+        return f"{IMAGE_REF_PREFIX}{digest}"
+
+    async def resolve(self, messages: list[dict], new_count: int):
+        """Messages to send to the team: the images of the last new_count messages as bytes, the others omitted."""
+        if self.store is None:
+            return messages
+
+        first_new = len(messages) - new_count
+        resolved = []
+        for i, message in enumerate(messages):
+            if not _has_refs(message):
+                resolved.append(message)
+                continue
+            content = []
+            for part in message["content"]:
+                digest = _image_ref(part)
+                data = await self.store.get(digest) if digest is not None and i >= first_new else None
+                if digest is None:
+                    content.append(part)
+                elif data is None:
+                    self.omitted += 1
+                    content.append(IMAGE_PLACEHOLDER)
+                else:
+                    self.resolved += 1
+                    content.append({**part, "image_url": {**part["image_url"], "url": _data_url(data)}})
+            resolved.append({**message, "content": content})
+        return resolved
+
+    def stats(self):
+        return {
+            "images": self.images,
+            "deduplicated": self.deduplicated,
+            "bytes_received": self.bytes_received,
+            "bytes_kept": self.bytes_kept,
+            "resolved": self.resolved,
+            "omitted": self.omitted,
+        }
+
+
+def create_image_pipeline():
+    """Create the image pipeline, IMAGE_STORE selects none (default, images stay in the messages), local or blob."""
+    target = os.getenv("IMAGE_STORE", "none")
+    if target == "none":
+        store = None
+    elif target == "local":
+        store = LocalImageStore(os.getenv("IMAGE_LOCAL_PATH", "images"))
+    elif target == "blob":
+        from azure.identity.aio import DefaultAzureCredential
+
+        store = BlobImageStore(
+            account_url=os.getenv("IMAGE_BLOB_ACCOUNT_URL"),
+            container_name=os.getenv("IMAGE_BLOB_CONTAINER", "images"),
+            credential=DefaultAzureCredential(),
+        )
+    else:
+        raise ValueError(f"Invalid image store: {target}")
+    return ImagePipeline(
+        store,
+        max_size=int(os.getenv("IMAGE_MAX_SIZE", "1024")),
+        quality=int(os.getenv("IMAGE_JPEG_QUALITY", "85")),
+    )
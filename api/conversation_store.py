@@ -1,44 +1,431 @@
-from azure.cosmos import CosmosClient, PartitionKey, exceptions
+import base64
+import gzip
+import json
+import os
+from abc import ABC, abstractmethod
+from azure.core import MatchConditions
+from azure.cosmos import PartitionKey, exceptions
+from azure.cosmos import aio
 from vanilla_aiagents.conversation import Conversation
 
-class ConversationStore:
-    def __init__(self, url, key, database_name, container_name):
-        self.client = CosmosClient(url, credential=key)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Storage modes
+# - document: one item per conversation, holding the whole history (rewritten on every turn)
+# - append: one small header item (variables, turn counter) plus one item per message,
+#   all in the same /conversation_id partition, so each turn only writes its delta
+DOCUMENT_MODE = "document"
+APPEND_MODE = "append"
+
+# Storage encodings of the messages
+# - none: plain JSON
+# - gzip, zstd: compressed JSON, base64 encoded in an envelope carrying the encoding and its version.
+#   Items are decoded by their envelope, so plain and encoded items of any encoding can be read side by side.
+NO_ENCODING = "none"
+GZIP_ENCODING = "gzip"
+ZSTD_ENCODING = "zstd"
+ENCODINGS = [NO_ENCODING, GZIP_ENCODING, ZSTD_ENCODING]
+ENCODING_VERSION = 1
+
+# Transactional batches are limited to 100 operations in Cosmos DB
+MAX_BATCH_OPERATIONS = 100
+
+CONVERSATION_QUERY = "SELECT * FROM c WHERE c.conversation_id = @conversation_id"
+TAIL_QUERY = "SELECT TOP @last_n * FROM c WHERE c.conversation_id = @conversation_id AND c.type = 'message' ORDER BY c.index DESC"
+# Conversations (documents or headers) not written since @cutoff and not archived yet, across partitions
+INACTIVE_QUERY = (
+    "SELECT TOP @limit c.conversation_id FROM c WHERE (NOT IS_DEFINED(c.type) OR c.type = 'header') "
+    "AND NOT IS_DEFINED(c.ttl) AND NOT IS_DEFINED(c.archived) AND c._ts < @cutoff"
+)
+
+
+class ConversationConflictError(Exception):
+    """Raised by a conditional save when the stored conversation changed since it was read."""
+    pass
+
+
+def _message_id(index: int):
+    # Messages live in the conversation partition, so the index is enough to make them unique
+    return f"message-{index:08d}"
+
+
+def _check_encoding(encoding: str):
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Invalid storage encoding: {encoding}")
+    if encoding == ZSTD_ENCODING and zstandard is None:
+        raise ValueError("The zstd storage encoding needs the zstandard package")
+    return encoding
+
+
+def _compress(data: bytes, encoding: str):
+    if encoding == ZSTD_ENCODING:
+        return zstandard.ZstdCompressor().compress(data)
+    return gzip.compress(data)
+
+
+def _decompress(data: bytes, encoding: str):
+    if encoding == ZSTD_ENCODING:
+        if zstandard is None:
+            raise ValueError("Reading zstd encoded messages needs the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if encoding == GZIP_ENCODING:
+        return gzip.decompress(data)
+    raise ValueError(f"Invalid storage encoding: {encoding}")
+
+
+def _encode(value, encoding: str):
+    """Encode messages (a list or a single message) for storage, small values that would not shrink stay plain."""
+    if encoding == NO_ENCODING:
+        return value
+    raw = json.dumps(value, separators=(",", ":")).encode("utf-8")
+    data = base64.b64encode(_compress(raw, encoding)).decode("ascii")
+    if len(data) >= len(raw):
+        return value
+    return {"_encoding": encoding, "_version": ENCODING_VERSION, "data": data}
+
+
+def _decode(value):
+    """Decode messages written by _encode, plain values are returned as they are."""
+    if not isinstance(value, dict) or "_encoding" not in value:
+        return value
+    if value.get("_version") != ENCODING_VERSION:
+        raise ValueError(f"Unsupported storage encoding version: {value.get('_version')}")
+    return json.loads(_decompress(base64.b64decode(value["data"]), value["_encoding"]))
+
+
+def _decoded(item: dict):
+    # Conversations written in document mode hold their (possibly encoded) messages in the item
+    if item is not None and "messages" in item:
+        item["messages"] = _decode(item["messages"])
+    return item
+
+
+def _document_item(conversation_id: str, conversation: Conversation, encoding: str = NO_ENCODING):
+    return {
+        "id": conversation_id,
+        "conversation_id": conversation_id,
+        "messages": _encode(conversation.messages, encoding),
+        "variables": conversation.variables,
+    }
+
+
+def _tail_parameters(conversation_id: str, last_n: int):
+    return [
+        {"name": "@conversation_id", "value": conversation_id},
+        {"name": "@last_n", "value": last_n},
+    ]
+
+
+def _is_document(item: dict):
+    return item.get("type") != "header"
+
+
+def _assemble_conversation(items: list[dict]):
+    """Rebuild a conversation from the header and message items of its partition."""
+    header = None
+    messages = []
+    for item in items:
+        if item.get("type") == "message":
+            messages.append(item)
+        else:
+            header = item
+
+    if header is None:
+        return None
+
+    # Conversations written in document mode still hold their whole history in the header
+    if _is_document(header):
+        return _decoded(header)
+
+    messages.sort(key=lambda m: m["index"])
+    header["messages"] = [_decode(m["message"]) for m in messages]
+    return header
+
+
+def _append_batches(conversation_id: str, header: dict, messages: list[dict], variables: dict, encoding: str = NO_ENCODING):
+    """Build the transactional batches appending messages to a conversation.
+
+    The last batch always holds the header write, conditional on the header etag, so a concurrent
+    writer fails the whole batch instead of clobbering the conversation.
+    """
+    start = 0
+    turn = 0
+    if header is not None:
+        if _is_document(header):
+            # Migrate a conversation written in document mode: its history is written as messages too
+            messages = header["messages"] + messages
+        else:
+            start = header.get("message_count", 0)
+        turn = header.get("turn", 0)
+
+    message_items = [{
+            "id": _message_id(start + i),
+            "conversation_id": conversation_id,
+            "type": "message",
+            "index": start + i,
+            "turn": turn + 1,
+            "message": _encode(message, encoding),
+        } for i, message in enumerate(messages)]
+
+    new_header = {
+        "id": conversation_id,
+        "conversation_id": conversation_id,
+        "type": "header",
+        "variables": variables,
+        "turn": turn + 1,
+        "message_count": start + len(messages),
+    }
+
+    batches = []
+    # Messages that do not fit in the header batch are written ahead of it (only happens on migration)
+    overflow = len(message_items) - (MAX_BATCH_OPERATIONS - 1)
+    if overflow > 0:
+        for i in range(0, overflow, MAX_BATCH_OPERATIONS):
+            chunk = message_items[i:min(i + MAX_BATCH_OPERATIONS, overflow)]
+            batches.append([("upsert", (item,)) for item in chunk])
+        message_items = message_items[overflow:]
+
+    operations = [("create", (item,)) for item in message_items]
+    if header is None:
+        operations.append(("create", (new_header,)))
+    else:
+        operations.append(("replace", (conversation_id, new_header), {"if_match_etag": header["_etag"]}))
+    batches.append(operations)
+
+    return batches, new_header
+
+
+def _restore_batches(conversation_id: str, item: dict, encoding: str = NO_ENCODING):
+    """Build the batches writing back a whole conversation in append mode, overwriting its expiring items."""
+    batches, new_header = _append_batches(conversation_id, None, item["messages"], item["variables"], encoding)
+    return [[("upsert", operation[1]) for operation in batch] for batch in batches], new_header
+
+
+def archived_header(conversation_id: str, item: dict):
+    """The item left in place of an archived conversation: a header without messages, flagged archived.
+
+    It never expires, so reading a conversation tells whether it is in the archive, without reading the archive.
+    """
+    return {
+        "id": conversation_id,
+        "conversation_id": conversation_id,
+        "type": "header",
+        "archived": True,
+        "variables": item.get("variables", {}),
+        "turn": item.get("turn", 0),
+        "message_count": 0,
+    }
+
+
+def _expire_batches(conversation_id: str, header: dict, ttl: int):
+    """Build the batches archiving an appended conversation: the header is replaced by its archived header and
+    the message items get a time to live.
+
+    The header goes first, conditional on its etag, so the conversation counts as archived from the first batch on.
+    """
+    expire = [{"op": "add", "path": "/ttl", "value": ttl}]
+    operations = [("replace", (conversation_id, archived_header(conversation_id, header)), {"if_match_etag": header["_etag"]})]
+    operations += [("patch", (_message_id(i), expire)) for i in range(header.get("message_count", 0))]
+    return [operations[i:i + MAX_BATCH_OPERATIONS] for i in range(0, len(operations), MAX_BATCH_OPERATIONS)]
+
+
+def _batch_etag(results):
+    # The header write is always the last operation of the batch
+    last = results[-1]
+    return last.get("eTag") or last.get("resourceBody", {}).get("_etag")
+
+
+def _document_write(container, conversation_id: str, conversation: Conversation, history: dict, if_match: bool, encoding: str = NO_ENCODING):
+    """Pick the container write for a document mode save."""
+    item = _document_item(conversation_id, conversation, encoding)
+    if not if_match:
+        return container.upsert_item, (item,), {}
+    if history is None:
+        return container.create_item, (item,), {}
+    return container.replace_item, (conversation_id, item), {"etag": history["_etag"], "match_condition": MatchConditions.IfNotModified}
+
+
+class ConversationStore(ABC):
+    """The interface of the conversation stores: Cosmos DB (AsyncConversationStore), in memory and SQLite
+    (see local_conversation_store.py).
+
+    Call initialize() on application startup and close() on shutdown.
+    """
+
+    # Storage mode, DOCUMENT_MODE or APPEND_MODE
+    mode: str
+
+    @abstractmethod
+    async def initialize(self):
+        pass
+
+    @abstractmethod
+    async def close(self):
+        pass
+
+    # Save the conversation, history_count is the number of messages already persisted.
+    # With if_match, history is the item returned by get_conversation (None for a new conversation) and the
+    # write fails with ConversationConflictError if the stored conversation changed in the meantime.
+    # Returns the written item (the header in append mode), with its new _etag.
+    @abstractmethod
+    async def save_conversation(self, conversation_id: str, conversation: Conversation, history_count: int = 0, history: dict = None, if_match: bool = False):
+        pass
+
+    # Get the conversation, None if it does not exist. last_n limits the messages to the most recent ones
+    # (append mode only, in document mode the whole history is read anyway since it is rewritten on save)
+    @abstractmethod
+    async def get_conversation(self, conversation_id, last_n: int = None):
+        pass
+
+    # Ids of the conversations not written since cutoff (a Unix timestamp), and not archived yet
+    @abstractmethod
+    async def find_inactive(self, cutoff: float, limit: int = 100):
+        pass
+
+    # Replace an archived conversation by its archived header (see archived_header), its messages are deleted
+    # (after ttl seconds where the store supports it). item is the whole conversation as returned by
+    # get_conversation. Fails with ConversationConflictError if it changed since it was read.
+    @abstractmethod
+    async def expire_conversation(self, conversation_id: str, item: dict, ttl: int):
+        pass
+
+    # Write back a whole conversation ({"messages", "variables"}), replacing the archived header
+    @abstractmethod
+    async def restore_conversation(self, conversation_id: str, item: dict):
+        pass
+
+
+class AsyncConversationStore(ConversationStore):
+    """Keeps the conversations in Cosmos DB, with the asynchronous client.
+
+    The client is shared by all requests: call initialize() on application startup and close() on shutdown.
+    """
+    def __init__(self, url, key, database_name, container_name, mode=None, encoding=None):
+        self.client = aio.CosmosClient(url, credential=key)
+        self.key = key
         self.database_name = database_name
         self.container_name = container_name
+        self.mode = mode or os.getenv("CONVERSATION_STORAGE_MODE", DOCUMENT_MODE)
+        self.encoding = _check_encoding(encoding or os.getenv("CONVERSATION_STORAGE_ENCODING", NO_ENCODING))
         self.db = None
         self.container = None
-        self.initialize_database()
-        self.initialize_container()
 
-    def initialize_database(self):
-        try:
-            self.db = self.client.create_database_if_not_exists(id=self.database_name)
-        except exceptions.CosmosResourceExistsError:
-            self.db = self.client.get_database_client(database=self.database_name)
+    async def initialize(self):
+        self.db = await self.client.create_database_if_not_exists(id=self.database_name)
+        self.container = await self.db.create_container_if_not_exists(
+            id=self.container_name,
+            partition_key=PartitionKey(path="/conversation_id"),
+            offer_throughput=400,
+            # Items never expire unless they set a ttl, the messages of archived conversations do
+            default_ttl=-1
+        )
 
-    def initialize_container(self):
+    async def close(self):
+        await self.client.close()
+        if hasattr(self.key, "close"):
+            await self.key.close()
+
+    async def save_conversation(self, conversation_id: str, conversation: Conversation, history_count: int = 0, history: dict = None, if_match: bool = False):
         try:
-            self.container = self.db.create_container_if_not_exists(
-                id=self.container_name,
-                partition_key=PartitionKey(path="/conversation_id"),
-                offer_throughput=400
+            if self.mode == APPEND_MODE:
+                header = history if if_match else await self._read_header(conversation_id)
+                batches, new_header = _append_batches(conversation_id, header, conversation.messages[history_count:], conversation.variables, self.encoding)
+                for batch in batches:
+                    results = await self.container.execute_item_batch(batch_operations=batch, partition_key=conversation_id)
+                new_header["_etag"] = _batch_etag(results)
+                return new_header
+
+            write, args, kwargs = _document_write(self.container, conversation_id, conversation, history, if_match, self.encoding)
+            return await write(*args, **kwargs)
+        except (exceptions.CosmosAccessConditionFailedError, exceptions.CosmosResourceExistsError, exceptions.CosmosBatchOperationError) as e:
+            raise ConversationConflictError(f"Conversation {conversation_id} was modified concurrently") from e
+
+    async def get_conversation(self, conversation_id, last_n: int = None):
+        if self.mode == APPEND_MODE:
+            if last_n:
+                return await self._read_appended_tail(conversation_id, last_n)
+            items = self.container.query_items(
+                query=CONVERSATION_QUERY,
+                parameters=[{"name": "@conversation_id", "value": conversation_id}],
+                partition_key=conversation_id
             )
-        except exceptions.CosmosResourceExistsError:
-            self.container = self.db.get_container_client(container=self.container_name)
-            
-    # Save all in the conversation
-    def save_conversation(self, conversation_id: str, conversation: Conversation):
-        self.container.upsert_item({
-                "id": conversation_id,
-                "conversation_id": conversation_id,
-                "messages": conversation.messages,
-                "variables": conversation.variables,
-            })
-        
-    def get_conversation(self, conversation_id):
+            return _assemble_conversation([item async for item in items])
+
+        return await self._read_header(conversation_id)
+
+    async def find_inactive(self, cutoff: float, limit: int = 100):
+        items = self.container.query_items(
+            query=INACTIVE_QUERY,
+            parameters=[{"name": "@cutoff", "value": int(cutoff)}, {"name": "@limit", "value": limit}],
+        )
+        return [item["conversation_id"] async for item in items]
+
+    # Cosmos DB deletes the message items after ttl seconds
+    async def expire_conversation(self, conversation_id: str, item: dict, ttl: int):
         try:
-            item = self.container.read_item(item=conversation_id, partition_key=conversation_id)
-            return item
+            if self.mode == APPEND_MODE and not _is_document(item):
+                for batch in _expire_batches(conversation_id, item, ttl):
+                    await self.container.execute_item_batch(batch_operations=batch, partition_key=conversation_id)
+                return
+            await self.container.replace_item(item=conversation_id, body=archived_header(conversation_id, item),
+                                              etag=item["_etag"], match_condition=MatchConditions.IfNotModified)
+        except (exceptions.CosmosAccessConditionFailedError, exceptions.CosmosBatchOperationError) as e:
+            raise ConversationConflictError(f"Conversation {conversation_id} was modified concurrently") from e
+
+    async def restore_conversation(self, conversation_id: str, item: dict):
+        if self.mode == APPEND_MODE:
+            batches, _ = _restore_batches(conversation_id, item, self.encoding)
+            for batch in batches:
+                await self.container.execute_item_batch(batch_operations=batch, partition_key=conversation_id)
+            return
+        await self.container.upsert_item(_document_item(conversation_id, Conversation(messages=item["messages"], variables=item["variables"]), self.encoding))
+
+    async def _read_header(self, conversation_id):
+        try:
+            return _decoded(await self.container.read_item(item=conversation_id, partition_key=conversation_id))
         except exceptions.CosmosResourceNotFoundError:
-            return None
\ No newline at end of file
+            return None
+
+    async def _read_appended_tail(self, conversation_id, last_n: int):
+        header = await self._read_header(conversation_id)
+        if header is None or _is_document(header):
+            return header
+
+        items = self.container.query_items(
+            query=TAIL_QUERY,
+            parameters=_tail_parameters(conversation_id, last_n),
+            partition_key=conversation_id
+        )
+        header["messages"] = [_decode(m["message"]) async for m in items][::-1]
+        return header
+
+
+def create_conversation_store():
+    """Create the conversation store, CONVERSATION_STORE selects cosmos (default), memory or sqlite.
+
+    The memory and sqlite stores (see local_conversation_store.py) let the API run without an Azure account,
+    e.g. for offline benchmarks or single node deployments.
+    """
+    kind = os.getenv("CONVERSATION_STORE", "cosmos")
+    if kind == "memory":
+        from local_conversation_store import InMemoryConversationStore
+
+        return InMemoryConversationStore()
+    if kind == "sqlite":
+        from local_conversation_store import SQLiteConversationStore
+
+        return SQLiteConversationStore(os.getenv("CONVERSATION_STORE_SQLITE_PATH", "conversations.db"))
+    if kind != "cosmos":
+        raise ValueError(f"Invalid conversation store: {kind}")
+
+    from azure.identity.aio import DefaultAzureCredential
+
+    return AsyncConversationStore(
+        url=os.getenv("COSMOSDB_ENDPOINT"),
+        key=DefaultAzureCredential(),
+        database_name=os.getenv("COSMOSDB_DATABASE"),
+        container_name=os.getenv("COSMOSDB_CONTAINER")
+    )
@@ -0,0 +1,142 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+
+class _IdempotentCall:
+    def __init__(self):
+        self.marks = []
+        self.done = False
+        self.value = None
+        self.error = None
+        self.expires_at = None
+        self.changed = asyncio.Condition()
+
+    async def publish(self, mark):
+        async with self.changed:
+            self.marks.append(mark)
+            self.changed.notify_all()
+
+    async def _finish(self, value=None, error=None):
+        async with self.changed:
+            self.done = True
+            self.value = value
+            self.error = error
+            self.changed.notify_all()
+
+    async def result(self):
+        """Wait for the outcome of the call, raises the error of a failed call."""
+        async with self.changed:
+            await self.changed.wait_for(lambda: self.done)
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    async def follow(self):
+        """Replay and follow the stream updates of the call, raises the error of a failed call."""
+        index = 0
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: self.done or index < len(self.marks))
+                marks, done = self.marks[index:], self.done
+            for mark in marks:
+                yield mark
+            index += len(marks)
+            if done and index >= len(self.marks):
+                break
+        if self.error is not None:
+            raise self.error
+
+
+class IdempotencyStore:
+    """Remembers the outcome of the calls carrying an idempotency key, so a replayed call does not run again.
+
+    A replay of a completed call gets the stored result (or stream updates) for ttl seconds, a replay of an
+    in-flight call waits for its outcome. Failed calls are forgotten, so they can be retried. At most
+    max_entries completed calls are kept, the oldest are forgotten first.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.calls = OrderedDict()
+        self.replays = 0
+        self.attached = 0
+        self.failures = 0
+
+    def begin(self, key: str):
+        """Returns the call of the key and whether the caller owns it, and must complete or fail it."""
+        call = self.calls.get(key)
+        if call is not None and call.done and call.expires_at < time.monotonic():
+            del self.calls[key]
+            call = None
+        if call is not None:
+            if call.done:
+                self.replays += 1
+            else:
+                self.attached += 1
+            return call, False
+
+        call = self.calls[key] = _IdempotentCall()
+        return call, True
+
+    async def complete(self, key: str, call: _IdempotentCall, value=None):
+        call.expires_at = time.monotonic() + self.ttl
+        await call._finish(value=value)
+        self.calls.move_to_end(key)
+        finished = [k for k, c in self.calls.items() if c.done]
+        for k in finished[:max(0, len(finished) - self.max_entries)]:
+            del self.calls[k]
+
+    async def fail(self, key: str, call: _IdempotentCall, error: BaseException):
+        self.failures += 1
+        if self.calls.get(key) is call:
+            del self.calls[key]
+        await call._finish(error=error if isinstance(error, Exception) else Exception("Call cancelled"))
+
+    async def run(self, key: str, function):
+        """Run the async function once per key, function is only called when key is None or new."""
+        if key is None:
+            return await function()
+        call, owner = self.begin(key)
+        if not owner:
+            return await call.result()
+        try:
+            value = await function()
+        except BaseException as e:
+            await self.fail(key, call, e)
+            raise
+        await self.complete(key, call, value)
+        return value
+
+    async def record(self, key: str, call: _IdempotentCall, marks, value=None):
+        """Pass the stream updates through, recording them in the call owned by the caller, completed with value."""
+        if call is None:
+            async for mark in marks:
+                yield mark
+            return
+        try:
+            async for mark in marks:
+                await call.publish(mark)
+                yield mark
+        except BaseException as e:
+            await self.fail(key, call, e)
+            raise
+        await self.complete(key, call, value)
+
+    def stats(self):
+        return {
+            "entries": len(self.calls),
+            "in_flight": len([c for c in self.calls.values() if not c.done]),
+            "replays": self.replays,
+            "attached": self.attached,
+            "failures": self.failures,
+        }
+
+
+def create_idempotency_store():
+    return IdempotencyStore(
+        max_entries=int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "1000")),
+        ttl=float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "3600")),
+    )
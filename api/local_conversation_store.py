@@ -0,0 +1,245 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from vanilla_aiagents.conversation import Conversation
+from conversation_store import APPEND_MODE, ConversationConflictError, ConversationStore, archived_header
+
+# Local implementations of ConversationStore, with the same semantics as the append mode of AsyncConversationStore: a header (variables,
+# turn, message_count, _etag, _ts) plus the messages, get_conversation(last_n) reads the tail of the history and
+# conditional saves (if_match) fail with ConversationConflictError when the conversation changed since it was read.
+# Archived conversations are replaced by their archived header right away, the archive holds their messages.
+
+
+def _new_header(conversation_id: str, variables: dict, turn: int, message_count: int):
+    return {
+        "id": conversation_id,
+        "conversation_id": conversation_id,
+        "type": "header",
+        "variables": variables,
+        "turn": turn,
+        "message_count": message_count,
+        "_etag": uuid.uuid4().hex,
+        "_ts": int(time.time()),
+    }
+
+
+def _check_etag(conversation_id: str, header: dict, history: dict, if_match: bool):
+    if not if_match:
+        return
+    if (header is None) != (history is None) or (header is not None and header["_etag"] != history.get("_etag")):
+        raise ConversationConflictError(f"Conversation {conversation_id} was modified concurrently")
+
+
+def _expired(header: dict):
+    return "ttl" in header and header["_ts"] + header["ttl"] < time.time()
+
+
+class InMemoryConversationStore(ConversationStore):
+    """Keeps the conversations in memory, for tests, offline benchmarks and single node deployments that can lose them."""
+
+    def __init__(self):
+        self.mode = APPEND_MODE
+        self.headers = {}
+        # Conversation id -> messages, serialized like a real store so callers never share them
+        self.messages = {}
+
+    async def initialize(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def save_conversation(self, conversation_id: str, conversation: Conversation, history_count: int = 0, history: dict = None, if_match: bool = False):
+        header = self._header(conversation_id)
+        _check_etag(conversation_id, header, history, if_match)
+        messages = self.messages.setdefault(conversation_id, [])
+        if header is None:
+            messages.clear()
+        messages.extend([json.dumps(m) for m in conversation.messages[history_count:]])
+        new_header = _new_header(conversation_id, json.loads(json.dumps(conversation.variables)),
+                                 header["turn"] + 1 if header else 1, len(messages))
+        self.headers[conversation_id] = new_header
+        return dict(new_header)
+
+    async def get_conversation(self, conversation_id, last_n: int = None):
+        header = self._header(conversation_id)
+        if header is None:
+            return None
+        messages = self.messages[conversation_id]
+        return {**header, "variables": json.loads(json.dumps(header["variables"])),
+                "messages": [json.loads(m) for m in (messages[-last_n:] if last_n else messages)]}
+
+    def _header(self, conversation_id: str):
+        header = self.headers.get(conversation_id)
+        if header is not None and _expired(header):
+            del self.headers[conversation_id]
+            del self.messages[conversation_id]
+            return None
+        return header
+
+    async def find_inactive(self, cutoff: float, limit: int = 100):
+        inactive = [cid for cid in list(self.headers) if self._header(cid) is not None and "ttl" not in self.headers[cid]
+                    and not self.headers[cid].get("archived") and self.headers[cid]["_ts"] < cutoff]
+        return inactive[:limit]
+
+    async def expire_conversation(self, conversation_id: str, item: dict, ttl: int):
+        header = self._header(conversation_id)
+        _check_etag(conversation_id, header, item, True)
+        self.messages[conversation_id] = []
+        self.headers[conversation_id] = {**archived_header(conversation_id, header), "_etag": uuid.uuid4().hex, "_ts": int(time.time())}
+
+    async def restore_conversation(self, conversation_id: str, item: dict):
+        self.messages[conversation_id] = [json.dumps(m) for m in item["messages"]]
+        self.headers[conversation_id] = _new_header(conversation_id, item["variables"], 1, len(item["messages"]))
+
+
+class SQLiteConversationStore(ConversationStore):
+    """Keeps the conversations in a SQLite database in WAL mode, for single node deployments and local development.
+
+    Each turn appends its messages and rewrites the header row in a single transaction.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mode = APPEND_MODE
+        self.connection = None
+        self.lock = threading.Lock()
+
+    async def initialize(self):
+        await asyncio.to_thread(self._initialize)
+
+    def _initialize(self):
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            # Durable enough with WAL, a power loss may only lose the last turns
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS conversations (conversation_id TEXT PRIMARY KEY, variables TEXT, turn INTEGER, "
+                "message_count INTEGER, etag TEXT, ts INTEGER, ttl INTEGER, archived INTEGER)"
+            )
+            # Databases created before archived headers
+            if "archived" not in [row["name"] for row in self.connection.execute("PRAGMA table_info(conversations)")]:
+                self.connection.execute("ALTER TABLE conversations ADD COLUMN archived INTEGER")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS conversations_ts ON conversations (ts)")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS messages (conversation_id TEXT, idx INTEGER, message TEXT, "
+                "PRIMARY KEY (conversation_id, idx)) WITHOUT ROWID"
+            )
+
+    async def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+    async def save_conversation(self, conversation_id: str, conversation: Conversation, history_count: int = 0, history: dict = None, if_match: bool = False):
+        return await asyncio.to_thread(self._save, conversation_id, conversation.messages[history_count:], conversation.variables, history, if_match)
+
+    def _save(self, conversation_id: str, messages: list[dict], variables: dict, history: dict, if_match: bool):
+        with self.lock, self._transaction():
+            header = self._header(conversation_id)
+            _check_etag(conversation_id, header, history, if_match)
+            if header is None:
+                self.connection.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+            start = header["message_count"] if header else 0
+            self.connection.executemany(
+                "INSERT INTO messages VALUES (?, ?, ?)",
+                [(conversation_id, start + i, json.dumps(m)) for i, m in enumerate(messages)],
+            )
+            new_header = _new_header(conversation_id, variables, header["turn"] + 1 if header else 1, start + len(messages))
+            self._write_header(new_header)
+        return new_header
+
+    async def get_conversation(self, conversation_id, last_n: int = None):
+        return await asyncio.to_thread(self._get, conversation_id, last_n)
+
+    def _get(self, conversation_id: str, last_n: int):
+        with self.lock, self._transaction(write=False):
+            header = self._header(conversation_id)
+            if header is None:
+                return None
+            first = max(0, header["message_count"] - last_n) if last_n else 0
+            rows = self.connection.execute(
+                "SELECT message FROM messages WHERE conversation_id = ? AND idx >= ? ORDER BY idx", (conversation_id, first)
+            ).fetchall()
+        return {**header, "messages": [json.loads(row["message"]) for row in rows]}
+
+    def _header(self, conversation_id: str):
+        row = self.connection.execute("SELECT * FROM conversations WHERE conversation_id = ?", (conversation_id,)).fetchone()
+        if row is None:
+            return None
+        header = _new_header(conversation_id, json.loads(row["variables"]), row["turn"], row["message_count"])
+        header.update({"_etag": row["etag"], "_ts": row["ts"]})
+        if row["archived"]:
+            header["archived"] = True
+        if row["ttl"] is not None:
+            header["ttl"] = row["ttl"]
+            if _expired(header):
+                self._delete(conversation_id)
+                return None
+        return header
+
+    def _write_header(self, header: dict):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO conversations VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (header["conversation_id"], json.dumps(header["variables"]), header["turn"], header["message_count"],
+             header["_etag"], header["_ts"], header.get("ttl"), 1 if header.get("archived") else None),
+        )
+
+    def _delete(self, conversation_id: str):
+        self.connection.execute("DELETE FROM conversations WHERE conversation_id = ?", (conversation_id,))
+        self.connection.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+
+    @contextmanager
+    def _transaction(self, write: bool = True):
+        # Writes take the database lock upfront, so the etag check and the write see the same state,
+        # other processes sharing the database keep reading meanwhile (WAL)
+        self.connection.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        try:
+            yield
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    async def find_inactive(self, cutoff: float, limit: int = 100):
+        return await asyncio.to_thread(self._find_inactive, cutoff, limit)
+
+    def _find_inactive(self, cutoff: float, limit: int):
+        with self.lock, self._transaction():
+            expired = self.connection.execute(
+                "SELECT conversation_id FROM conversations WHERE ttl IS NOT NULL AND ts + ttl < ?", (time.time(),)
+            ).fetchall()
+            for row in expired:
+                self._delete(row["conversation_id"])
+            rows = self.connection.execute(
+                "SELECT conversation_id FROM conversations WHERE ttl IS NULL AND archived IS NULL AND ts < ? LIMIT ?", (int(cutoff), limit)
+            ).fetchall()
+        return [row["conversation_id"] for row in rows]
+
+    async def expire_conversation(self, conversation_id: str, item: dict, ttl: int):
+        await asyncio.to_thread(self._expire, conversation_id, item, ttl)
+
+    def _expire(self, conversation_id: str, item: dict, ttl: int):
+        with self.lock, self._transaction():
+            header = self._header(conversation_id)
+            _check_etag(conversation_id, header, item, True)
+            self.connection.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+            self._write_header({**archived_header(conversation_id, header), "_etag": uuid.uuid4().hex, "_ts": int(time.time())})
+
+    async def restore_conversation(self, conversation_id: str, item: dict):
+        await asyncio.to_thread(self._restore, conversation_id, item)
+
+    def _restore(self, conversation_id: str, item: dict):
+        with self.lock, self._transaction():
+            self._delete(conversation_id)
+            self.connection.executemany(
+                "INSERT INTO messages VALUES (?, ?, ?)",
+                [(conversation_id, i, json.dumps(m)) for i, m in enumerate(item["messages"])],
+            )
+            self._write_header(_new_header(conversation_id, item["variables"], 1, len(item["messages"])))
@@ -1,18 +1,32 @@
+import asyncio
 import base64
+import hashlib
 import json
 import os
-from typing import Optional
-from fastapi import APIRouter
+from contextlib import asynccontextmanager
+from typing import Literal, Optional
+from fastapi import APIRouter, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, ValidationError
 import logging
-from azure.identity import DefaultAzureCredential
 
-from vanilla_aiagents.remote.remote import RemoteAskable, RESTConnection
-from vanilla_aiagents.workflow import Workflow, WorkflowInput
-from vanilla_aiagents.conversation import Conversation
-from conversation_store import ConversationStore
-from utils.voice_utils import whisper_client
+from vanilla_aiagents.workflow import WorkflowInput
+from vanilla_aiagents.conversation import AllMessagesStrategy, Conversation, ConversationMetrics, LastNMessagesStrategy
+from conversation_store import create_conversation_store
+from conversation_cache import CachedConversationStore, create_conversation_cache
+from conversation_archive import ArchivedConversationStore, ConversationArchiver, create_archive
+from team_client import AsyncRemoteAskable, AsyncWorkflow, TeamHostPool, create_team_transport
+from turn_scheduler import TurnScheduler
+from cancellation import CancellationStats, estimate_tokens, until_disconnected
+from admission import DEFAULT_CHANNEL, AdmissionRejectedError, channel_of, create_admission_controller
+from idempotency import create_idempotency_store
+from conversation_hub import ConversationHub
+from conversation_images import create_image_pipeline
+from stream_frames import NDJSON, SSE, STREAM_HEADERS, FrameStats, frames, stream_max_bytes, stream_window
+from turn_queue import TERMINAL_STATUSES, TurnWorkerPool, create_turn_queue, deserialize_message, new_turn, turn_view
+from utils.metrics import register_metrics
+from utils.voice_utils import get_whisper_client
 
 conversation_router = APIRouter(prefix="/conversation")
 
@@ -26,22 +40,89 @@ class Message(BaseModel):
     content: str
 
 
-# A helper class that store and retrieve messages by conversation from an Azure Cosmos DB
-key = DefaultAzureCredential()
-db = ConversationStore(
-    url=os.getenv("COSMOSDB_ENDPOINT"),
-    key=key,
-    database_name=os.getenv("COSMOSDB_DATABASE"),
-    container_name=os.getenv("COSMOSDB_CONTAINER")
+# Number of most recent messages loaded and sent to the team on each turn, 0 means the whole history.
+# Defaults to the largest LastNMessagesStrategy window used by the telco-team agents.
+history_window = int(os.getenv("CONVERSATION_HISTORY_WINDOW", "10"))
+
+# Stores and retrieves messages by conversation, in Azure Cosmos DB unless CONVERSATION_STORE selects a local store
+# The underlying client is shared by all requests, its lifecycle is managed by the app lifespan
+store = create_conversation_store()
+# With ARCHIVE_TARGET, finished conversations move to a cold archive and are restored when requested again
+archive = create_archive()
+if archive is not None:
+    store = ArchivedConversationStore(store, archive, item_ttl=int(os.getenv("ARCHIVE_ITEM_TTL_SECONDS", "86400")))
+db = CachedConversationStore(
+    store,
+    create_conversation_cache(),
+    history_window=history_window,
+    write_behind=os.getenv("CONVERSATION_CACHE_WRITE_BEHIND", "false").lower() == "true"
 )
+register_metrics("conversation_cache", db.stats)
+archiver = None
+if archive is not None:
+    archiver = ConversationArchiver(
+        store,
+        inactivity=float(os.getenv("ARCHIVE_INACTIVITY_SECONDS", str(7 * 86400))),
+        ended_grace=float(os.getenv("ARCHIVE_ENDED_GRACE_SECONDS", "3600")),
+        interval=float(os.getenv("ARCHIVE_SWEEP_INTERVAL_SECONDS", "3600")),
+        batch_size=int(os.getenv("ARCHIVE_BATCH_SIZE", "100")),
+        on_archived=db.cache.pop,
+    )
+    register_metrics("archive", archiver.stats)
+
+# Serializes the turns of each conversation, merging messages sent while a turn is in flight
+turns = TurnScheduler()
+register_metrics("turn_scheduler", turns.stats)
+
+# Outcome of the requests carrying an Idempotency-Key header, so redeliveries and retries do not run turns twice
+idempotency = create_idempotency_store()
+register_metrics("idempotency", idempotency.stats)
+
+# Streamed updates are coalesced in frames, the first ones are never held back
+frame_window = stream_window()
+frame_max_bytes = stream_max_bytes()
+frame_stats = FrameStats()
+register_metrics("stream_frames", frame_stats.stats)
+
+# Streamed turns are cancelled when their client disconnects, stopping the team host early
+cancellations = CancellationStats()
+register_metrics("cancellations", cancellations.stats)
+
+# WebSocket sessions of the conversations, new messages are pushed to them
+hub = ConversationHub()
+register_metrics("websockets", hub.stats)
+
+# Limits the team runs in flight, callers tell their channel (voice, whatsapp, chat) with the X-Channel header
+admission = create_admission_controller()
+register_metrics("admission", admission.stats)
 
 
 # Get all messages by conversation
 @conversation_router.get("/{conversation_id}")
-def get_messages(conversation_id: str):
-    """Get all messages for a conversation."""
-    conv = db.get_conversation(conversation_id) or []
-    return conv.get("messages", [])
+async def get_messages(conversation_id: str, response: Response, since: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1),
+                       if_none_match: Optional[str] = Header(None)):
+    """Get the messages of a conversation, from index since on and at most limit of them.
+    
+    The ETag header holds the version of the conversation: send it back in If-None-Match to get a 304 when
+    nothing changed. X-Message-Count holds the number of messages of the conversation.
+    """
+    history = await db.get_history(conversation_id, since)
+    if history is None:
+        return []
+    
+    etag = _conversation_etag(history)
+    headers = {"ETag": etag, "X-Message-Count": str(history["message_count"]), "Cache-Control": "no-cache"}
+    if if_none_match is not None and etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    
+    response.headers.update(headers)
+    messages = history["messages"]
+    return messages[:limit] if limit is not None else messages
+
+def _conversation_etag(history: dict):
+    # The store etag may lag behind with write-behind, the message count always moves with a turn
+    version = f"{history['message_count']}-{history.get('_etag') or ''}"
+    return f'"{hashlib.md5(version.encode()).hexdigest()}"'
 
 
 class MediaRequest(BaseModel):
@@ -54,82 +135,409 @@ class MessageRequest(BaseModel):
     media: Optional[list[MediaRequest]] = None
 
 
-remote_connection = RESTConnection(url=os.getenv("TEAM_REMOTE_URL"))
-# remote_connection = GRPCConnection(url=os.getenv("TEAM_REMOTE_URL"))
-remote = RemoteAskable(id="telco-team", connection=remote_connection)
+# Uploaded images are downscaled, with IMAGE_STORE they are stored aside and referenced in the messages
+images = create_image_pipeline()
+register_metrics("images", images.stats)
+
+# Pooled async connection to the team host, started and closed by the app lifespan
+# TEAM_REMOTE_URL may list several team host replicas, separated by commas
+remote_connection = create_team_transport(url=os.getenv("TEAM_REMOTE_URL"))
+if isinstance(remote_connection, TeamHostPool):
+    register_metrics("team_hosts", remote_connection.stats)
+# With TEAM_SESSIONS, the team host keeps the recent conversations and only the new messages are sent
+team_sessions = os.getenv("TEAM_SESSIONS", "false").lower() == "true"
+remote = AsyncRemoteAskable(
+    id="telco-team-session" if team_sessions else "telco-team",
+    transport=remote_connection,
+    reading_strategy=LastNMessagesStrategy(history_window) if history_window > 0 else AllMessagesStrategy(),
+    sessions=team_sessions,
+    images=images
+)
+if team_sessions:
+    register_metrics("team_sessions", remote.stats)
 
 
 @conversation_router.post("/{conversation_id}")
-def send_message(conversation_id: str, request: MessageRequest):
+async def send_message(conversation_id: str, request: MessageRequest, x_channel: str = Header(DEFAULT_CHANNEL), idempotency_key: Optional[str] = Header(None)):
     """Send a message to an existing conversation."""
     
     # start_trace(collection=f"chat-{conversation_id}")
     
-    conversation = Conversation(messages=[], variables={})
-    history = db.get_conversation(conversation_id)
+    async def _send():
+        message = await _preprocess_request(request)
+        
+        # Messages arriving while a turn of the same conversation is running are merged in a single follow-up turn
+        return await turns.submit(conversation_id, message, lambda m, channel: _run_turn(conversation_id, m, channel), channel=x_channel)
+    
+    # A replayed key gets the new messages of the first request, without running the turn again
+    return await idempotency.run(_idempotency_scope(conversation_id, idempotency_key), _send)
+
+async def _load_conversation(conversation_id: str):
+    # Fresh metrics, the Conversation defaults are shared by all instances
+    conversation = Conversation(messages=[], variables={}, metrics=ConversationMetrics(total_tokens=0, prompt_tokens=0, completion_tokens=0), log=[])
+    history = await db.get_conversation(conversation_id, last_n=history_window)
     if history is not None:
-        conversation.messages = history["messages"]
+        conversation.messages = list(history["messages"])
         conversation.variables = history["variables"]
-    message = _preprocess_request(request)
+    return conversation, history
+
+async def _run_turn(conversation_id: str, message, channel: str = DEFAULT_CHANNEL):
+    conversation, history = await _load_conversation(conversation_id)
     
     history_count = len(conversation.messages)
         
-    workflow = Workflow(askable=remote, conversation=conversation)
+    workflow = AsyncWorkflow(askable=remote, conversation=conversation)
     
-    result = workflow.run(message)
+    # A shed turn fails all the requests merged in it with a 429
+    async with admission.admit(channel):
+        result = await workflow.run_async(message, conversation_id=conversation_id)
     
     if "error" in result:
         raise Exception("Error in workflow")
     
-    db.save_conversation(conversation_id, workflow.conversation)
+    await db.save_conversation(conversation_id, workflow.conversation, history_count, history)
     
     # delta = len(workflow.conversation.messages) - history_count
     
     new_messages = workflow.conversation.messages[history_count:]
+    _note_turn(conversation_id, new_messages)
+    await _push_messages(conversation_id, new_messages)
     
     return new_messages
 
 @conversation_router.post("/{conversation_id}/stream")
-def send_message_stream(conversation_id: str, request: MessageRequest):
+async def send_message_stream(conversation_id: str, request: MessageRequest, http_request: Request, x_channel: str = Header(DEFAULT_CHANNEL), idempotency_key: Optional[str] = Header(None),
+                              format: Literal["ndjson", "sse"] = NDJSON):
     
-    conversation = Conversation(messages=[], variables={})
-    history = db.get_conversation(conversation_id)
-    if history is not None:
-        conversation.messages = history["messages"]
-        conversation.variables = history["variables"]
-    message = _preprocess_request(request)
+    key = _idempotency_scope(conversation_id, idempotency_key)
+    call, owner = idempotency.begin(key) if key is not None else (None, True)
+    if not owner:
+        # Replay the updates of the first request, following them if it is still running
+        return _stream_response(_replay(call), format)
     
-    logging.info(f"Starting conversation {conversation_id}")
+    try:
+        message = await _preprocess_request(request)
         
-    workflow = Workflow(askable=remote, conversation=conversation)
+        # Admit the turn before the response starts, so it can still be shed with a 429
+        await admission.acquire(x_channel)
+    except BaseException as e:
+        if call is not None:
+            await idempotency.fail(key, call, e)
+        raise
+    
+    # A client going away cancels the turn, its partial conversation is saved
+    turn = _AdmittedTurn(key, call)
+    return _stream_response(until_disconnected(http_request, _admitted_stream(conversation_id, message, turn)), format, on_close=turn.abandon)
+
+class _AdmittedTurn:
+    """The admission slot and idempotent call of a streamed turn, handed over to its stream.
+    
+    Once started, the stream releases the slot and finishes the call. A stream that never starts (the client
+    went away before the first update was pulled) does not run at all, abandon() then does it instead.
+    """
     
-    def _stream():
-        for mark, content in workflow.run_stream(message):
-            json_string = json.dumps([mark, content])
-            logging.info(json_string)                   
-            yield json_string + "\n" # NEW LINE DELIMITED JSON
+    def __init__(self, key: str, call):
+        self.key = key
+        self.call = call
+        self.started = False
+    
+    async def abandon(self):
+        if self.started:
+            return
+        self.started = True
+        admission.release()
+        if self.call is not None:
+            await idempotency.fail(self.key, self.call, Exception("Turn abandoned before it started"))
+
+async def _admitted_stream(conversation_id: str, message, turn: _AdmittedTurn, origin=None):
+    """Stream a turn the caller got an admission slot for, the slot is released when the stream ends."""
+    if turn.started:
+        return
+    turn.started = True
+    key, call = turn.key, turn.call
+    async with _released(admission):
+        new_messages = []
+        turn = _stream_turn(conversation_id, message, new_messages=new_messages, partial=True, origin=origin)
+        # The new messages are the result of the call, for a replay on POST /{conversation_id}
+        async for mark in idempotency.record(key, call, turn, value=new_messages):
+            yield mark
+
+async def _replay(call):
+    """Replay the updates of a call, or the responses of a turn first sent to POST /{conversation_id}."""
+    streamed = False
+    async for mark in call.follow():
+        streamed = True
+        yield mark
+    if not streamed:
+        for message in call.value or []:
+            if message["role"] == "assistant":
+                yield ["response", [message]]
+        yield ["result", None]
+
+def _stream_response(marks, format: str = NDJSON, on_close=None):
+    # Updates are batched in frames, see STREAM_FRAME_WINDOW_MS and STREAM_FRAME_MAX_BYTES
+    return _ClosingStreamingResponse(
+        frames(marks, format=format, window=frame_window, max_bytes=frame_max_bytes, stats=frame_stats),
+        media_type="text/event-stream" if format == SSE else "application/x-ndjson",
+        headers=STREAM_HEADERS,
+        on_close=on_close,
+    )
+
+class _ClosingStreamingResponse(StreamingResponse):
+    """Calls on_close once the response is over, however it ended.
+    
+    Unlike a background task, which is skipped when the client disconnects, on_close also runs when the
+    response is cancelled or fails to be sent.
+    """
+    
+    def __init__(self, *args, on_close=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_close = on_close
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.on_close is not None:
+                await asyncio.shield(self.on_close())
+
+def _idempotency_scope(conversation_id: str, idempotency_key: str, queued: bool = False):
+    # Keys are chosen by the callers (Service Bus message id, ACS event id...), scope them to the conversation.
+    # The message, stream and WebSocket routes share the scope, so a turn retried on another route (e.g. the
+    # voice app falling back to HTTP) does not run again. Queued turns return a turn id, they have their own.
+    if not idempotency_key:
+        return None
+    return f"{conversation_id}/turns/{idempotency_key}" if queued else f"{conversation_id}/{idempotency_key}"
+
+async def _stream_turn(conversation_id: str, message, new_messages: list = None, partial: bool = False, origin=None):
+    """Run a streamed turn, yielding its updates. The new messages of the turn are appended to new_messages.
+    
+    With partial, a cancelled turn saves the new message and the answers completed before the cancellation.
+    The new messages are pushed to the WebSocket sessions of the conversation, except origin.
+    """
+    # Streamed turns are not merged, but still wait for the in-flight turn of the conversation
+    async with turns.exclusive(conversation_id):
+        conversation, history = await _load_conversation(conversation_id)
+        
+        history_count = len(conversation.messages)
+        
+        logging.info(f"Starting conversation {conversation_id}")
+            
+        workflow = AsyncWorkflow(askable=remote, conversation=conversation)
+        
+        updates = 0
+        agent = None
+        streamed = ""
+        answers = []
+        try:
+            async for mark, content in workflow.run_stream_async(message, conversation_id=conversation_id):
+                updates += 1
+                if mark == "start":
+                    agent = content
+                elif mark == "delta" and content.get("content"):
+                    streamed += content["content"]
+                elif mark == "response" and content[0].get("content"):
+                    answers.append({"content": content[0]["content"], "name": agent, "role": "assistant"})
+                yield [mark, content]
+        except (asyncio.CancelledError, GeneratorExit):
+            if partial:
+                saved = cancellations.cancel(estimate_tokens(streamed))
+                logging.info(f"Turn of conversation {conversation_id} cancelled after {updates} updates, about {saved} tokens saved")
+                # The interrupted answer is dropped, the conversation only holds whole messages
+                conversation.messages = conversation.messages + answers
+                conversation.messages = [{"content": m["content"], "name": m["name"] if "name" in m else None, "role": m["role"]} for m in conversation.messages]
+                await asyncio.shield(db.save_conversation(conversation_id, conversation, history_count, history))
+            raise
+        
+        # Updates are no longer logged one by one, the tokens of a turn flooded the logs
+        logging.info(f"Streamed {updates} updates of conversation {conversation_id}")
+        # Counted from the stream, the metrics of the host conversation are not reset between asks
+        cancellations.complete(estimate_tokens(streamed))
             
         # Clean converation messages and keep only content, name and role fields
         conversation.messages = [{"content": m["content"], "name": m["name"] if "name" in m else None, "role": m["role"]} for m in conversation.messages]
-        db.save_conversation(conversation_id, workflow.conversation)
+        await db.save_conversation(conversation_id, workflow.conversation, history_count, history)
+        _note_turn(conversation_id, conversation.messages[history_count:])
+        await _push_messages(conversation_id, conversation.messages[history_count:], exclude=origin)
+        if new_messages is not None:
+            new_messages.extend(conversation.messages[history_count:])
+
+@conversation_router.websocket("/{conversation_id}/ws")
+async def conversation_socket(websocket: WebSocket, conversation_id: str, channel: str = DEFAULT_CHANNEL):
+    """A session on a conversation: the client sends messages as JSON objects ({"message", "media", "id"}), the
+    updates of their turns come back as frames of [mark, content] lines, like /stream, ending with a "result" mark.
+    
+    Messages sent while a turn is running are run next, in order. Messages added to the conversation by other
+    clients, or pushed with /push, come as ["message", message] frames. Closing the socket cancels the running turn.
+    """
+    await websocket.accept()
+    hub.connect(conversation_id, websocket)
+    pending = asyncio.Queue()
+    
+    async def _serve():
+        while True:
+            await _socket_turn(websocket, conversation_id, await pending.get(), channel)
+    
+    serving = asyncio.ensure_future(_serve())
+    try:
+        while True:
+            pending.put_nowait(await websocket.receive_json())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.disconnect(conversation_id, websocket)
+        serving.cancel()
+        await asyncio.gather(serving, return_exceptions=True)
+
+async def _socket_turn(websocket: WebSocket, conversation_id: str, data: dict, channel: str):
+    try:
+        request = MessageRequest(**data)
+    except (TypeError, ValidationError) as e:
+        await websocket.send_text(json.dumps(["error", {"status": 422, "detail": str(e)}]) + "\n")
+        return
+    
+    key = _idempotency_scope(conversation_id, data.get("id"))
+    call, owner = idempotency.begin(key) if key is not None else (None, True)
+    turn = None
+    try:
+        if owner:
+            try:
+                message = await _preprocess_request(request)
+                await admission.acquire(channel)
+            except BaseException as e:
+                if call is not None:
+                    await idempotency.fail(key, call, e)
+                raise
+            turn = _AdmittedTurn(key, call)
+            marks = _admitted_stream(conversation_id, message, turn, origin=websocket)
+        else:
+            marks = _replay(call)
+        async for frame in frames(marks, window=frame_window, max_bytes=frame_max_bytes, stats=frame_stats):
+            await websocket.send_text(frame)
+    except AdmissionRejectedError as e:
+        await websocket.send_text(json.dumps(["error", {"status": 429, "detail": str(e), "retry_after": e.retry_after}]) + "\n")
+    except Exception as e:
+        # The session survives a failed turn
+        logging.error(f"Turn of conversation {conversation_id} failed: {e}")
+        await websocket.send_text(json.dumps(["error", {"status": 500, "detail": str(e)}]) + "\n")
+    finally:
+        # The session closed before the stream started
+        if turn is not None:
+            await asyncio.shield(turn.abandon())
+
+class PushRequest(BaseModel):
+    content: str
+    name: Optional[str] = None
+    role: str = "assistant"
+
+@conversation_router.post("/{conversation_id}/push")
+async def push_message(conversation_id: str, request: PushRequest):
+    """Add a message to a conversation (e.g. a notification from a back office) and push it to its WebSocket sessions."""
+    message = {"content": request.content, "name": request.name, "role": request.role}
+    async with turns.exclusive(conversation_id):
+        conversation, history = await _load_conversation(conversation_id)
+        history_count = len(conversation.messages)
+        conversation.messages.append(message)
+        await db.save_conversation(conversation_id, conversation, history_count, history)
+    return {"delivered": await hub.publish(conversation_id, "message", message)}
+
+def _note_turn(conversation_id: str, new_messages: list):
+    # Conversations ended with TERMINATE are archived after a grace period
+    if archiver is not None:
+        archiver.note_turn(conversation_id, new_messages)
+
+async def _push_messages(conversation_id: str, messages: list, exclude=None):
+    for message in messages:
+        if message["role"] == "system":
+            continue
+        await hub.publish(conversation_id, "message", message, exclude=exclude)
+
+@conversation_router.post("/{conversation_id}/turns", status_code=202)
+async def enqueue_message(conversation_id: str, request: MessageRequest, response: Response, x_channel: str = Header(DEFAULT_CHANNEL), idempotency_key: Optional[str] = Header(None)):
+    """Queue a message for a turn run in the background, the result is fetched or streamed from the returned location."""
+    async def _enqueue():
+        message = await _preprocess_request(request)
+        turn = new_turn(conversation_id, message, channel_of(x_channel))
+        await turn_queue.put(turn)
+        return turn["turn_id"]
     
-    return StreamingResponse(_stream(), media_type="text/event-stream")
+    # A replayed key gets the turn queued by the first request
+    turn_id = await idempotency.run(_idempotency_scope(conversation_id, idempotency_key, queued=True), _enqueue)
+    turn = await turn_queue.fetch(turn_id)
+    if turn is None:
+        raise HTTPException(status_code=404, detail="Turn not found")
+    response.headers["Location"] = f"{conversation_router.prefix}/{conversation_id}/turns/{turn_id}"
+    return turn_view(turn)
 
-def _preprocess_request(input_message: MessageRequest):
+@conversation_router.get("/{conversation_id}/turns/{turn_id}")
+async def get_turn(conversation_id: str, turn_id: str, stream: bool = False, format: Literal["ndjson", "sse"] = NDJSON):
+    """Get the status and new messages of a queued turn, or stream its updates until it completes."""
+    turn = await turn_queue.fetch(turn_id)
+    if turn is None or turn["conversation_id"] != conversation_id:
+        raise HTTPException(status_code=404, detail="Turn not found")
+    if not stream:
+        return turn_view(turn)
+    
+    async def _follow(turn):
+        while turn["status"] not in TERMINAL_STATUSES:
+            if turn_workers.is_live(turn_id):
+                async for mark in turn_workers.follow(turn_id):
+                    yield mark
+            else:
+                # Still queued, or running in another replica
+                await asyncio.sleep(turn_poll_interval)
+            turn = await turn_queue.fetch(turn_id)
+        yield ["turn", turn_view(turn)]
+    
+    return _stream_response(_follow(turn), format)
+
+async def _run_queued_turn(turn: dict, publish):
+    new_messages = []
+    async with admission.admit(turn["channel"]):
+        async for mark in _stream_turn(turn["conversation_id"], deserialize_message(turn["message"]), new_messages):
+            await publish(mark)
+    return new_messages
+
+# Queue and workers of the turns run in the background, started and closed by the app lifespan
+turn_queue = create_turn_queue()
+turn_workers = TurnWorkerPool(
+    turn_queue,
+    _run_queued_turn,
+    workers=int(os.getenv("TURN_WORKERS", "8")),
+    retry_delay=admission.retry_after,
+    retryable=AdmissionRejectedError,
+)
+turn_poll_interval = 0.5
+register_metrics("turn_workers", turn_workers.stats)
+
+@asynccontextmanager
+async def _released(controller):
+    try:
+        yield
+    finally:
+        controller.release()
+
+async def _preprocess_request(input_message: MessageRequest):
     if input_message.media is None:
         return input_message.message
     else:
-        new_input = WorkflowInput(input_message.message)
-        for m in input_message.media:
-            if "audio" in m.mimeType:
-                transcription = whisper_client.audio.transcriptions.create(
-                    model="whisper",
-                    file=input_message.media.data
-                )
-                new_input.text = transcription.text
-            elif "image" in m.mimeType:
-                m.data
-                image_bytes = base64.b64decode(m.data)
-                new_input.add_image_bytes(image_bytes)
-        
-        return new_input
\ No newline at end of file
+        # Decoding and transcription are blocking, keep them off the event loop
+        new_input, image_bytes = await run_in_threadpool(_preprocess_media, input_message)
+        for data in image_bytes:
+            new_input.images.append(await images.add(data))
+        return new_input
+
+def _preprocess_media(input_message: MessageRequest):
+    new_input = WorkflowInput(input_message.message, images=[])
+    image_bytes = []
+    for m in input_message.media:
+        if "audio" in m.mimeType:
+            transcription = get_whisper_client().audio.transcriptions.create(
+                model="whisper",
+                file=input_message.media.data
+            )
+            new_input.text = transcription.text
+        elif "image" in m.mimeType:
+            image_bytes.append(base64.b64decode(m.data))
+    
+    return new_input, image_bytes
\ No newline at end of file
@@ -1,4 +1,5 @@
 import os
+from functools import cache
 from fastapi import APIRouter
 from pydantic import BaseModel
 from azure.communication.email import EmailClient
@@ -9,7 +10,11 @@ integration_router = APIRouter(prefix="/integration")
 # To use Azure Active Directory Authentication (DefaultAzureCredential) make sure to have AZURE_CLIENT_ID as env variables.
 endpoint = os.environ.get("ACS_ENDPOINT")
 sender_address = os.environ.get("ACS_SENDER_ADDRESS")
-email_client = EmailClient(endpoint, DefaultAzureCredential())
+
+# Created on the first email, so the API starts without Azure Communication Services settings
+@cache
+def get_email_client():
+    return EmailClient(endpoint, DefaultAzureCredential())
 
 class EmailRequest(BaseModel):
     content: str
@@ -21,7 +26,7 @@ def send_email(request: EmailRequest):
     try:
         # Send an email
         # See https://learn.microsoft.com/en-us/python/api/overview/azure/communication-email-readme?view=azure-python
-        poller = email_client.begin_send(message={
+        poller = get_email_client().begin_send(message={
             "content": {
                 "subject": request.subject,
                 "plainText": request.content
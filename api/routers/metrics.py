@@ -0,0 +1,10 @@
+from fastapi import APIRouter
+from utils.metrics import collect_metrics
+
+metrics_router = APIRouter(prefix="/metrics")
+
+
+@metrics_router.get("")
+async def get_metrics():
+    """Get the in-process metrics of this API replica."""
+    return collect_metrics()
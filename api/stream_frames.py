@@ -0,0 +1,138 @@
+import asyncio
+import json
+import os
+
+# Stream formats: newline delimited JSON [mark, content] lines, or Server-Sent Events with the mark as event name
+NDJSON = "ndjson"
+SSE = "sse"
+FORMATS = [NDJSON, SSE]
+
+# Headers of streamed responses: nothing between the API and the client should hold frames back.
+# The explicit Content-Encoding also keeps the GZip middleware away, it buffers small chunks.
+STREAM_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Content-Encoding": "identity",
+    "X-Accel-Buffering": "no",
+}
+
+
+def encode(mark: str, content, format: str = NDJSON):
+    if format == SSE:
+        return f"event: {mark}\ndata: {json.dumps(content)}\n\n"
+    return json.dumps([mark, content]) + "\n"
+
+
+def _is_text_delta(mark: str, content):
+    return mark == "delta" and isinstance(content, dict) and not content.get("tool_calls") and isinstance(content.get("content"), str)
+
+
+class FrameStats:
+    def __init__(self):
+        self.responses = 0
+        self.marks = 0
+        self.frames = 0
+        self.bytes = 0
+
+    def stats(self):
+        return {
+            "responses": self.responses,
+            "marks": self.marks,
+            "frames": self.frames,
+            "marks_per_frame": self.marks / self.frames if self.frames else 0.0,
+            "bytes": self.bytes,
+        }
+
+
+async def frames(marks, format: str = NDJSON, window: float = 0.05, max_bytes: int = 4096, stats: FrameStats = None):
+    """Encode the [mark, content] updates of a stream into frames, the chunks written to the response.
+
+    The updates up to the first delta are sent as soon as they are available. The following ones are batched for up to window
+    seconds or max_bytes, consecutive text deltas being merged into one. window 0 sends every update on its own.
+    """
+    stats = stats or FrameStats()
+    stats.responses += 1
+    if window <= 0:
+        async for mark, content in marks:
+            frame = encode(mark, content, format)
+            stats.marks += 1
+            stats.frames += 1
+            stats.bytes += len(frame)
+            yield frame
+        return
+
+    # Read the updates in the background, so a batch is flushed at the end of its window even if the stream stalls
+    queue = asyncio.Queue()
+    done = object()
+
+    async def _read():
+        try:
+            async for mark in marks:
+                queue.put_nowait(mark)
+        except BaseException as e:
+            queue.put_nowait(e)
+            raise
+        else:
+            queue.put_nowait(done)
+
+    reader = asyncio.ensure_future(_read())
+    # A pending get survives a window timeout, cancelling it could lose an update
+    getter = None
+
+    async def _next(timeout=None):
+        nonlocal getter
+        if getter is None:
+            getter = asyncio.ensure_future(queue.get())
+        ready, _ = await asyncio.wait([getter], timeout=timeout)
+        if not ready:
+            return None
+        item, getter = getter.result(), None
+        return item
+
+    try:
+        first = True
+        finished = False
+        while not finished:
+            item = await _next()
+            batch = []
+            size = 0
+            deadline = asyncio.get_running_loop().time() + window
+            while item is not None:
+                if item is done:
+                    finished = True
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                mark, content = item
+                stats.marks += 1
+                if batch and _is_text_delta(mark, content) and _is_text_delta(*batch[-1]):
+                    previous = batch[-1][1]
+                    batch[-1] = ["delta", {**previous, "content": previous["content"] + content["content"]}]
+                else:
+                    batch.append([mark, content])
+                size += len(content["content"]) if _is_text_delta(mark, content) else 64
+                # The first update goes out immediately, later ones wait for their window or size
+                timeout = deadline - asyncio.get_running_loop().time()
+                if first or size >= max_bytes or timeout <= 0:
+                    break
+                item = await _next(timeout)
+
+            # Keep sending immediately until the first token is out
+            first = first and not any([mark == "delta" for mark, _ in batch])
+            if batch:
+                frame = "".join([encode(mark, content, format) for mark, content in batch])
+                stats.frames += 1
+                stats.bytes += len(frame)
+                yield frame
+    finally:
+        for task in [reader, getter]:
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(reader, return_exceptions=True)
+
+
+def stream_window():
+    return float(os.getenv("STREAM_FRAME_WINDOW_MS", "50")) / 1000
+
+
+def stream_max_bytes():
+    return int(os.getenv("STREAM_FRAME_MAX_BYTES", "4096"))
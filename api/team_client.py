@@ -0,0 +1,594 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import statistics
+import time
+from typing import Union
+
+import aiohttp
+import grpc
+from vanilla_aiagents.remote import remote_pb2
+from vanilla_aiagents.remote.remote_pb2_grpc import RemoteServiceStub
+from vanilla_aiagents.conversation import AllMessagesStrategy, Conversation, ConversationReadingStrategy, LastNMessagesStrategy
+from vanilla_aiagents.workflow import Workflow, WorkflowInput
+
+logger = logging.getLogger(__name__)
+
+# Status codes returned by the ingress when the request did not reach a team host replica
+RETRYABLE_STATUSES = [502, 503, 504]
+
+# Variables and result of the session protocol of the team host, see telco-team/session_team.py
+SESSION_ID = "_session_id"
+SESSION_VERSION = "_session_version"
+SESSION_WINDOW = "_session_window"
+SESSION_MISS = "session-miss"
+
+
+class TeamHostUnavailableError(Exception):
+    """Raised by a transport when the team host could not be reached, the request was not processed."""
+    pass
+
+
+class RESTTeamTransport:
+    """An asynchronous, connection-pooled counterpart of vanilla_aiagents RESTConnection.
+
+    Connections to the team host are kept alive and reused across turns. Failures are retried only
+    when the request is known not to have been processed (connection failures, ingress errors),
+    or when the operation is idempotent (describe).
+    """
+
+    def __init__(self, url: str, max_connections: int = 100, connect_timeout: float = 5, read_timeout: float = 120, max_retries: int = 2, keepalive_timeout: float = 60):
+        self.url = url
+        self.max_connections = max_connections
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.keepalive_timeout = keepalive_timeout
+        self.session = None
+
+    async def start(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=self.keepalive_timeout),
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.connect_timeout, sock_read=self.read_timeout),
+        )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def send(self, target_id: str, operation: str, payload: dict, conversation_id: str = None) -> dict:
+        """Send a payload to the remote askable, returns the deserialized JSON response."""
+        async with await self._post(target_id, operation, payload) as response:
+            return await response.json()
+
+    async def stream(self, target_id: str, operation: str, payload: dict, conversation_id: str = None):
+        """Send a payload to the remote askable and stream the [mark, content] updates of the response."""
+        async with await self._post(target_id, operation, payload, stream=True) as response:
+            finished = False
+            try:
+                async for line in response.content:
+                    line = line.strip()
+                    if line:
+                        mark, content = json.loads(line)
+                        yield [mark, content]
+                        if mark == "result":
+                            finished = True
+                            break
+            finally:
+                if not finished:
+                    # Cancelled or abandoned stream: drop the connection, so the team host sees the client is gone
+                    response.close()
+
+    async def _post(self, target_id: str, operation: str, payload: dict, stream: bool = False):
+        headers = {"Content-Encoding": "gzip", "Content-Type": "application/json"}
+        data = gzip.compress(json.dumps(payload).encode("utf-8"))
+        url = f"{self.url}/{target_id}/{operation}" + ("?stream=true" if stream else "")
+        idempotent = operation == "describe"
+
+        attempt = 0
+        while True:
+            try:
+                response = await self.session.post(url, data=data, headers=headers)
+                if response.status in RETRYABLE_STATUSES and attempt < self.max_retries:
+                    response.release()
+                    raise aiohttp.ClientResponseError(response.request_info, response.history, status=response.status)
+                response.raise_for_status()
+                return response
+            except (aiohttp.ClientConnectorError, aiohttp.ClientResponseError, aiohttp.ServerDisconnectedError, asyncio.TimeoutError) as e:
+                unavailable = isinstance(e, aiohttp.ClientConnectorError) \
+                    or (isinstance(e, aiohttp.ClientResponseError) and e.status in RETRYABLE_STATUSES)
+                if not (unavailable or idempotent) or attempt >= self.max_retries:
+                    if unavailable:
+                        raise TeamHostUnavailableError(f"Team host {self.url} is unavailable: {e}") from e
+                    raise
+                attempt += 1
+                logger.warning(f"Request to {url} failed ({e}), retrying ({attempt}/{self.max_retries})")
+                await asyncio.sleep(0.1 * 2 ** attempt)
+
+
+def _message_text(content):
+    # gRPC messages only carry string content, keep the text parts of multimodal content
+    if isinstance(content, list):
+        return "\n".join([part.get("text", "") for part in content if part.get("type") == "text"])
+    return content or ""
+
+
+class GRPCTeamTransport:
+    """An asynchronous counterpart of vanilla_aiagents GRPCConnection, on a shared grpc.aio channel.
+
+    All the calls are multiplexed on a single HTTP/2 connection. The gRPC messages only carry role, name
+    and string content, so images of multimodal messages are not sent to the team host with this transport.
+    """
+
+    def __init__(self, url: str, connect_timeout: float = 5, read_timeout: float = 120, max_retries: int = 2, keepalive_timeout: float = 60):
+        # URL must be in the format host:port
+        self.url = url.replace("http://", "")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.keepalive_timeout = keepalive_timeout
+        self.channel = None
+        self.stub = None
+
+    async def start(self):
+        self.channel = grpc.aio.insecure_channel(
+            self.url,
+            compression=grpc.Compression.Gzip,
+            options=[
+                ("grpc.keepalive_time_ms", int(self.keepalive_timeout * 1000)),
+                ("grpc.keepalive_permit_without_calls", 1),
+            ],
+        )
+        self.stub = RemoteServiceStub(self.channel)
+
+    async def close(self):
+        if self.channel is not None:
+            await self.channel.close()
+
+    async def send(self, target_id: str, operation: str, payload: dict, conversation_id: str = None) -> dict:
+        """Send a payload to the remote askable, returns the response in the same shape as the REST host."""
+        if operation == "describe":
+            response = await self._call(lambda: self.stub.Describe(remote_pb2.DescribeRequest(agent_id=target_id), timeout=self.read_timeout), idempotent=True)
+            return {"id": response.id, "description": response.description}
+        if operation != "ask":
+            raise Exception(f"Operation not supported: {operation}")
+
+        response = await self._call(lambda: self.stub.Ask(self._conversation_request(target_id, payload), timeout=self.read_timeout))
+        return {
+            "conversation": {
+                "messages": [{"role": m.role, "content": m.content, "name": m.name} for m in response.conversation.messages],
+                "variables": dict(response.conversation.variables),
+                "metrics": {
+                    "completion_tokens": response.conversation.metrics.completion_tokens,
+                    "total_tokens": response.conversation.metrics.total_tokens,
+                    "prompt_tokens": response.conversation.metrics.prompt_tokens,
+                },
+            },
+            "result": response.result,
+        }
+
+    async def stream(self, target_id: str, operation: str, payload: dict, conversation_id: str = None):
+        """Send a payload to the remote askable and stream the [mark, content] updates of the response."""
+        request = self._conversation_request(target_id, payload)
+        await self._call(self._wait_ready)
+        call = self.stub.AskStream(request, timeout=self.read_timeout)
+        try:
+            async for response in call:
+                mark = response.mark
+                content = json.loads(response.content)
+                yield [mark, content]
+                if mark == "result":
+                    break
+        finally:
+            call.cancel()
+
+    def _conversation_request(self, target_id: str, payload: dict):
+        return remote_pb2.ConversationRequest(
+            agent_id=target_id,
+            messages=[
+                remote_pb2.Message(role=m["role"], content=_message_text(m.get("content")), name=m.get("name") or "")
+                for m in payload["messages"]
+            ],
+            variables={k: str(v) for k, v in payload["variables"].items()},
+        )
+
+    async def _wait_ready(self):
+        await asyncio.wait_for(self.channel.channel_ready(), timeout=self.connect_timeout)
+
+    async def _call(self, call, idempotent: bool = False):
+        attempt = 0
+        while True:
+            try:
+                await self._wait_ready()
+                return await call()
+            except (grpc.aio.AioRpcError, asyncio.TimeoutError) as e:
+                unavailable = isinstance(e, asyncio.TimeoutError) or e.code() == grpc.StatusCode.UNAVAILABLE
+                if not (unavailable or idempotent) or attempt >= self.max_retries:
+                    if unavailable:
+                        raise TeamHostUnavailableError(f"Team host {self.url} is unavailable: {e}") from e
+                    raise
+                attempt += 1
+                logger.warning(f"gRPC call to {self.url} failed ({e}), retrying ({attempt}/{self.max_retries})")
+                await asyncio.sleep(0.1 * 2 ** attempt)
+
+
+class _TeamHost:
+    def __init__(self, url: str, transport):
+        self.url = url
+        self.transport = transport
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0
+        # Exponentially weighted moving average of the turn latency, in seconds
+        self.latency = None
+        self.requests = 0
+        self.errors = 0
+        self.ejections = 0
+
+    @property
+    def available(self):
+        return self.ejected_until <= time.monotonic()
+
+    def affinity(self, key: str):
+        # Rendezvous hashing: stable across API replicas and only remaps the keys of a removed host
+        return hashlib.md5(f"{key}|{self.url}".encode("utf-8")).digest()
+
+
+class TeamHostPool:
+    """Balances turns across several team host replicas, with the same interface as a single transport.
+
+    Turns go to the host with the least outstanding requests. Turns of the same conversation stick to
+    the same host (rendezvous hashing) unless it is busier than the least loaded one by more than
+    max_imbalance requests. Hosts failing repeatedly, failing health checks or much slower than the rest of
+    the pool are ejected for ejection_time seconds; if every host is ejected, all of them are used again.
+    A turn that could not reach its host (TeamHostUnavailableError) is sent to the next one.
+    """
+
+    def __init__(self, hosts: list, health_check_interval: float = 10, health_check_timeout: float = 5, failure_threshold: int = 3,
+                 ejection_time: float = 30, slow_factor: float = 3, max_imbalance: int = 2):
+        self.hosts = [_TeamHost(url, transport) for url, transport in hosts]
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        self.failure_threshold = failure_threshold
+        self.ejection_time = ejection_time
+        self.slow_factor = slow_factor
+        self.max_imbalance = max_imbalance
+        self.health_check_target = None
+        self.health_check_task = None
+        self.affine_turns = 0
+        self.rebalanced_turns = 0
+        self.failovers = 0
+
+    async def start(self):
+        await asyncio.gather(*[host.transport.start() for host in self.hosts])
+        if self.health_check_interval > 0:
+            self.health_check_task = asyncio.ensure_future(self._health_checks())
+
+    async def close(self):
+        if self.health_check_task is not None:
+            self.health_check_task.cancel()
+            await asyncio.gather(self.health_check_task, return_exceptions=True)
+        await asyncio.gather(*[host.transport.close() for host in self.hosts], return_exceptions=True)
+
+    async def send(self, target_id: str, operation: str, payload: dict, conversation_id: str = None) -> dict:
+        if operation == "describe":
+            # Remember which askable to probe in the health checks
+            self.health_check_target = target_id
+        tried = []
+        while True:
+            host = self._pick(conversation_id, tried)
+            host.outstanding += 1
+            start = time.monotonic()
+            try:
+                response = await host.transport.send(target_id, operation, payload, conversation_id=conversation_id)
+            except TeamHostUnavailableError as e:
+                self._failed(host, e)
+                tried.append(host)
+                if len(tried) >= len(self.hosts):
+                    raise
+                self.failovers += 1
+                continue
+            except Exception as e:
+                self._failed(host, e)
+                raise
+            finally:
+                host.outstanding -= 1
+            self._succeeded(host, time.monotonic() - start, operation)
+            return response
+
+    async def stream(self, target_id: str, operation: str, payload: dict, conversation_id: str = None):
+        tried = []
+        while True:
+            host = self._pick(conversation_id, tried)
+            host.outstanding += 1
+            start = time.monotonic()
+            try:
+                async for mark, content in host.transport.stream(target_id, operation, payload, conversation_id=conversation_id):
+                    yield [mark, content]
+            except TeamHostUnavailableError as e:
+                # Raised before the first update, nothing was streamed from this host
+                self._failed(host, e)
+                tried.append(host)
+                if len(tried) >= len(self.hosts):
+                    raise
+                self.failovers += 1
+                continue
+            except Exception as e:
+                self._failed(host, e)
+                raise
+            finally:
+                host.outstanding -= 1
+            self._succeeded(host, time.monotonic() - start, operation)
+            return
+
+    def _pick(self, conversation_id: str = None, tried: list = None):
+        tried = tried or []
+        candidates = [host for host in self.hosts if host.available and host not in tried] \
+            or [host for host in self.hosts if host not in tried]
+        least_loaded = min(candidates, key=lambda h: (h.outstanding, h.latency or 0))
+        if conversation_id is None:
+            return least_loaded
+
+        preferred = max(candidates, key=lambda h: h.affinity(conversation_id))
+        if preferred.outstanding - least_loaded.outstanding <= self.max_imbalance:
+            self.affine_turns += 1
+            return preferred
+        self.rebalanced_turns += 1
+        return least_loaded
+
+    def _succeeded(self, host: _TeamHost, latency: float, operation: str):
+        host.requests += 1
+        host.consecutive_failures = 0
+        if operation == "describe":
+            return
+        host.latency = latency if host.latency is None else 0.8 * host.latency + 0.2 * latency
+        self._eject_if_slow(host)
+
+    def _failed(self, host: _TeamHost, error: Exception):
+        host.requests += 1
+        host.errors += 1
+        host.consecutive_failures += 1
+        if host.consecutive_failures >= self.failure_threshold:
+            self._eject(host, f"{host.consecutive_failures} consecutive failures ({error})")
+
+    def _eject_if_slow(self, host: _TeamHost):
+        if self.slow_factor <= 0:
+            return
+        others = [h.latency for h in self.hosts if h is not host and h.available and h.latency is not None]
+        if len(others) > 0 and host.latency > self.slow_factor * statistics.median(others):
+            self._eject(host, f"latency {host.latency:.2f}s, {self.slow_factor}x slower than the pool")
+
+    def _eject(self, host: _TeamHost, reason: str):
+        # Never eject the last available host, a slow host is better than none
+        if not any(h.available for h in self.hosts if h is not host):
+            return
+        if not host.available:
+            # Still failing, keep it out of the pool
+            host.ejected_until = time.monotonic() + self.ejection_time
+            return
+        host.ejected_until = time.monotonic() + self.ejection_time
+        host.ejections += 1
+        # Give the host a fresh start when it comes back
+        host.latency = None
+        logger.warning(f"Ejecting team host {host.url} for {self.ejection_time}s: {reason}")
+
+    async def _health_checks(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            if self.health_check_target is None:
+                continue
+            await asyncio.gather(*[self._health_check(host) for host in self.hosts])
+
+    async def _health_check(self, host: _TeamHost):
+        try:
+            await asyncio.wait_for(host.transport.send(self.health_check_target, "describe", {}), timeout=self.health_check_timeout)
+        except Exception as e:
+            self._eject(host, f"health check failed ({e})")
+        else:
+            if not host.available:
+                logger.info(f"Team host {host.url} passed its health check, adding it back to the pool")
+                host.ejected_until = 0
+                host.consecutive_failures = 0
+
+    def stats(self):
+        return {
+            "affine_turns": self.affine_turns,
+            "rebalanced_turns": self.rebalanced_turns,
+            "failovers": self.failovers,
+            "hosts": [{
+                "url": host.url,
+                "available": host.available,
+                "outstanding": host.outstanding,
+                "requests": host.requests,
+                "errors": host.errors,
+                "ejections": host.ejections,
+                "latency": host.latency,
+            } for host in self.hosts],
+        }
+
+
+class AsyncRemoteAskable:
+    """An asynchronous counterpart of vanilla_aiagents RemoteAskable, speaking the same protocol.
+
+    With sessions, the remote askable is a SessionTeam (see telco-team/session_team.py): when the host
+    holds the previous turn of the conversation, only the new messages are sent, otherwise the whole
+    conversation is sent again.
+
+    With images (an ImagePipeline, see conversation_images.py), the stored images referenced by the new messages
+    of the turn are sent as bytes, the ones of earlier messages are left out.
+    """
+
+    def __init__(self, id: str, transport, reading_strategy: ConversationReadingStrategy = AllMessagesStrategy(), sessions: bool = False, images=None):
+        self.id = id
+        self.transport = transport
+        self.reading_strategy = reading_strategy
+        self.sessions = sessions
+        self.images = images
+        self.description = ""
+        self.delta_requests = 0
+        self.full_requests = 0
+        self.session_misses = 0
+        self.messages_saved = 0
+
+    async def start(self):
+        await self.transport.start()
+        try:
+            response = await self.transport.send(self.id, "describe", {})
+            self.description = response["description"]
+        except Exception as e:
+            # The team host may start after the API, the description is not needed to run turns
+            logger.warning(f"Could not describe remote askable {self.id}: {e}")
+
+    async def close(self):
+        await self.transport.close()
+
+    async def ask(self, conversation: Conversation, conversation_id: str = None, history_count: int = None):
+        for source_messages, payload in self._requests(conversation, conversation_id, history_count):
+            payload = await self._with_images(payload, conversation, history_count)
+            response = await self.transport.send(self.id, "ask", payload, conversation_id=conversation_id)
+            if not self._missed(response):
+                break
+        return self._merge(conversation, source_messages, response)
+
+    async def ask_stream(self, conversation: Conversation, conversation_id: str = None, history_count: int = None):
+        """Stream the [mark, content] updates of the remote askable, the last one being ["result", result]."""
+        for source_messages, payload in self._requests(conversation, conversation_id, history_count):
+            payload = await self._with_images(payload, conversation, history_count)
+            response = None
+            async for mark, content in self.transport.stream(self.id, "ask", payload, conversation_id=conversation_id):
+                if mark == "result":
+                    response = content
+                elif self.sessions and mark in ["start", "end"] and content == self.id:
+                    # Marks of a session miss, nothing ran on the host
+                    continue
+                else:
+                    yield [mark, content]
+
+            if response is None:
+                raise Exception(f"Remote askable {self.id} stream ended without a result")
+            if not self._missed(response):
+                break
+        yield ["result", self._merge(conversation, source_messages, response)]
+
+    def _requests(self, conversation: Conversation, conversation_id: str, history_count: int):
+        # The (source messages, payload) to send in order, until one is not a session miss
+        source_messages = self.reading_strategy.get_messages(conversation)
+        if not self.sessions or conversation_id is None:
+            return [(source_messages, {"messages": source_messages, "variables": conversation.variables})]
+
+        variables = {k: v for k, v in conversation.variables.items() if k != SESSION_VERSION}
+        variables[SESSION_ID] = conversation_id
+        variables[SESSION_WINDOW] = str(self.reading_strategy.n if isinstance(self.reading_strategy, LastNMessagesStrategy) else 0)
+        full = (source_messages, {"messages": source_messages, "variables": variables})
+
+        version = conversation.variables.get(SESSION_VERSION)
+        if version is None or history_count is None:
+            self.full_requests += 1
+            return [full]
+
+        delta = self.reading_strategy.exclude_system_messages(conversation.messages[history_count:])
+        self.delta_requests += 1
+        self.messages_saved += len(source_messages) - len(delta)
+        return [(delta, {"messages": delta, "variables": {**variables, SESSION_VERSION: version}}), full]
+
+    async def _with_images(self, payload: dict, conversation: Conversation, history_count: int):
+        if self.images is None:
+            return payload
+        messages = payload["messages"]
+        new_count = len(messages)
+        if history_count is not None:
+            # The images are in the user messages of the turn: count from the first of them in the payload, the
+            # system messages the workflow inserts are not always sent (e.g. in a delta)
+            users = len([m for m in conversation.messages[history_count:] if m["role"] == "user"])
+            positions = [i for i, m in enumerate(messages) if m["role"] == "user"]
+            new_count = len(messages) - positions[-users] if 0 < users <= len(positions) else 0
+        return {**payload, "messages": await self.images.resolve(messages, new_count)}
+
+    def _missed(self, response: dict):
+        if self.sessions and response["result"] == SESSION_MISS:
+            self.session_misses += 1
+            self.full_requests += 1
+            return True
+        return False
+
+    def _merge(self, conversation: Conversation, source_messages: list[dict], response: dict):
+        conv = response["conversation"]
+
+        # Original metrics are not part of the payload, so we need to sum them
+        conversation.metrics.completion_tokens += conv["metrics"]["completion_tokens"]
+        conversation.metrics.prompt_tokens += conv["metrics"]["prompt_tokens"]
+        conversation.metrics.total_tokens += conv["metrics"]["total_tokens"]
+        # Update the conversation with the new messages
+        conversation.messages += conv["messages"][len(source_messages):]
+        # Update the conversation variables
+        conversation.variables = conv["variables"]
+
+        return response["result"]
+
+    def stats(self):
+        return {
+            "delta_requests": self.delta_requests,
+            "full_requests": self.full_requests,
+            "session_misses": self.session_misses,
+            "messages_saved": self.messages_saved,
+        }
+
+
+class AsyncWorkflow(Workflow):
+    """A workflow running an AsyncRemoteAskable on the event loop, without a thread per turn or stream.
+
+    The conversation_id lets the transport route the turns of a conversation to the same team host.
+    """
+
+    async def run_async(self, workflow_input: Union[str, WorkflowInput], conversation_id: str = None):
+        history_count = len(self.conversation.messages)
+        self._handle_workflow_input(workflow_input)
+        return await self.askable.ask(self.conversation, conversation_id=conversation_id, history_count=history_count)
+
+    async def run_stream_async(self, workflow_input: Union[str, WorkflowInput], conversation_id: str = None):
+        history_count = len(self.conversation.messages)
+        self._handle_workflow_input(workflow_input)
+        async for mark, content in self.askable.ask_stream(self.conversation, conversation_id=conversation_id, history_count=history_count):
+            yield [mark, content]
+
+
+def create_team_transport(url: str, transport: str = None):
+    """Create the transport to the team host, TEAM_REMOTE_TRANSPORT selects rest (default) or grpc.
+
+    url may be a comma separated list of team host replicas, turns are then balanced across them.
+    """
+    urls = [u.strip() for u in url.split(",") if u.strip()]
+    if len(urls) > 1:
+        return TeamHostPool(
+            [(u, create_team_transport(u, transport)) for u in urls],
+            health_check_interval=float(os.getenv("TEAM_HEALTH_CHECK_INTERVAL_SECONDS", "10")),
+            health_check_timeout=float(os.getenv("TEAM_HEALTH_CHECK_TIMEOUT_SECONDS", "5")),
+            failure_threshold=int(os.getenv("TEAM_EJECTION_FAILURES", "3")),
+            ejection_time=float(os.getenv("TEAM_EJECTION_SECONDS", "30")),
+            slow_factor=float(os.getenv("TEAM_SLOW_HOST_FACTOR", "3")),
+            max_imbalance=int(os.getenv("TEAM_AFFINITY_MAX_IMBALANCE", "2")),
+        )
+
+    transport = transport or os.getenv("TEAM_REMOTE_TRANSPORT", "rest")
+    if transport == "grpc":
+        return GRPCTeamTransport(
+            url=url,
+            connect_timeout=float(os.getenv("TEAM_CONNECT_TIMEOUT_SECONDS", "5")),
+            read_timeout=float(os.getenv("TEAM_READ_TIMEOUT_SECONDS", "120")),
+            max_retries=int(os.getenv("TEAM_MAX_RETRIES", "2")),
+            keepalive_timeout=float(os.getenv("TEAM_KEEPALIVE_TIMEOUT_SECONDS", "60")),
+        )
+    if transport != "rest":
+        raise ValueError(f"Invalid team transport: {transport}")
+
+    return RESTTeamTransport(
+        url=url,
+        max_connections=int(os.getenv("TEAM_MAX_CONNECTIONS", "100")),
+        connect_timeout=float(os.getenv("TEAM_CONNECT_TIMEOUT_SECONDS", "5")),
+        read_timeout=float(os.getenv("TEAM_READ_TIMEOUT_SECONDS", "120")),
+        max_retries=int(os.getenv("TEAM_MAX_RETRIES", "2")),
+        keepalive_timeout=float(os.getenv("TEAM_KEEPALIVE_TIMEOUT_SECONDS", "60")),
+    )
@@ -0,0 +1,354 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from vanilla_aiagents.workflow import WorkflowInput
+
+logger = logging.getLogger(__name__)
+
+# Turn statuses
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+TERMINAL_STATUSES = [COMPLETED, FAILED]
+
+
+def serialize_message(message):
+    if isinstance(message, WorkflowInput):
+        return {"text": message.text, "images": message.images}
+    return {"text": message, "images": []}
+
+
+def deserialize_message(data: dict):
+    if len(data["images"]) == 0:
+        return data["text"]
+    return WorkflowInput(data["text"], images=list(data["images"]))
+
+
+def new_turn(conversation_id: str, message, channel: str):
+    now = time.time()
+    return {
+        "turn_id": uuid.uuid4().hex,
+        "conversation_id": conversation_id,
+        "channel": channel,
+        "status": QUEUED,
+        "message": serialize_message(message),
+        "messages": None,
+        "error": None,
+        # A postponed turn is not run before this time
+        "not_before": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def turn_view(turn: dict):
+    """The turn as returned to clients, without the (possibly large) input message and the lease of its worker."""
+    return {k: v for k, v in turn.items() if k not in ["message", "owner", "lease_until"]}
+
+
+class InProcessTurnQueue:
+    """Keeps the turns in memory: queued turns are lost when the API restarts.
+
+    At most max_turns turns are kept, the oldest finished ones are forgotten first.
+    """
+
+    def __init__(self, max_turns: int = 10000):
+        self.max_turns = max_turns
+        self.turns = OrderedDict()
+        self.queue = asyncio.Queue()
+
+    async def initialize(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def put(self, turn: dict):
+        self.turns[turn["turn_id"]] = dict(turn)
+        self.queue.put_nowait(turn["turn_id"])
+        if len(self.turns) > self.max_turns:
+            finished = [turn_id for turn_id, t in self.turns.items() if t["status"] in TERMINAL_STATUSES]
+            for turn_id in finished[:len(self.turns) - self.max_turns]:
+                del self.turns[turn_id]
+
+    async def get(self):
+        """Wait for the next queued turn and mark it running."""
+        while True:
+            turn = self.turns.get(await self.queue.get())
+            if turn is not None and turn["status"] == QUEUED:
+                turn.update({"status": RUNNING, "updated_at": time.time()})
+                return dict(turn)
+
+    async def requeue(self, turn_id: str, delay: float = 0):
+        """Queue a turn again, to run after delay seconds."""
+        await self.update(turn_id, status=QUEUED, not_before=time.time() + delay if delay > 0 else None)
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self.queue.put_nowait, turn_id)
+        else:
+            self.queue.put_nowait(turn_id)
+
+    async def update(self, turn_id: str, **fields):
+        turn = self.turns.get(turn_id)
+        if turn is not None:
+            turn.update(fields, updated_at=time.time())
+
+    async def fetch(self, turn_id: str):
+        turn = self.turns.get(turn_id)
+        return dict(turn) if turn is not None else None
+
+
+class SQLiteTurnQueue:
+    """Keeps the turns in a SQLite database: queued turns survive a restart of the API.
+
+    Several processes can share the database. A process holds a lease on the turns it runs, renewed every
+    lease / 3 seconds: the turns whose lease expired, because their process stopped, are queued again.
+    Finished turns are deleted after retention seconds.
+    """
+
+    def __init__(self, path: str, retention: float = 3600, poll_interval: float = 1, lease: float = 60):
+        self.path = path
+        self.retention = retention
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.owner = uuid.uuid4().hex
+        self.connection = None
+        self.lock = threading.Lock()
+        self.available = None
+        self.heartbeat = None
+
+    async def initialize(self):
+        self.available = asyncio.Event()
+        await asyncio.to_thread(self._initialize)
+        self.heartbeat = asyncio.ensure_future(self._renew_leases())
+
+    def _initialize(self):
+        self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS turns (turn_id TEXT PRIMARY KEY, conversation_id TEXT, channel TEXT, status TEXT, "
+                "message TEXT, messages TEXT, error TEXT, not_before REAL, owner TEXT, lease_until REAL, created_at REAL, updated_at REAL)"
+            )
+            # Databases created before leases
+            columns = [row["name"] for row in self.connection.execute("PRAGMA table_info(turns)")]
+            for column in ["not_before REAL", "owner TEXT", "lease_until REAL"]:
+                if column.split()[0] not in columns:
+                    self.connection.execute(f"ALTER TABLE turns ADD COLUMN {column}")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS turns_status ON turns (status, created_at)")
+
+    async def close(self):
+        if self.heartbeat is not None:
+            self.heartbeat.cancel()
+        if self.connection is not None:
+            self.connection.close()
+
+    async def _renew_leases(self):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await asyncio.to_thread(
+                    self._execute, "UPDATE turns SET lease_until = ? WHERE status = ? AND owner = ?",
+                    (time.time() + self.lease, RUNNING, self.owner),
+                )
+            except Exception as e:
+                logger.warning(f"Could not renew the leases of the running turns: {e}")
+
+    async def put(self, turn: dict):
+        await asyncio.to_thread(self._put, turn)
+        self.available.set()
+
+    def _put(self, turn: dict):
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO turns (turn_id, conversation_id, channel, status, message, messages, error, not_before, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (turn["turn_id"], turn["conversation_id"], turn["channel"], turn["status"], json.dumps(turn["message"]),
+                 json.dumps(turn["messages"]), turn["error"], turn["not_before"], turn["created_at"], turn["updated_at"]),
+            )
+            self.connection.execute(
+                "DELETE FROM turns WHERE status IN (?, ?) AND updated_at < ?",
+                (*TERMINAL_STATUSES, time.time() - self.retention),
+            )
+
+    async def get(self):
+        """Wait for the next queued turn and mark it running."""
+        while True:
+            self.available.clear()
+            turn = await asyncio.to_thread(self._claim)
+            if turn is not None:
+                return turn
+            # Turns may also be queued by another process sharing the database, poll for them
+            try:
+                await asyncio.wait_for(self.available.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _claim(self):
+        now = time.time()
+        with self.lock:
+            # Turns of a process that stopped while running them
+            self.connection.execute(
+                "UPDATE turns SET status = ?, owner = NULL, lease_until = NULL WHERE status = ? AND (lease_until IS NULL OR lease_until < ?)",
+                (QUEUED, RUNNING, now),
+            )
+            row = self.connection.execute(
+                "UPDATE turns SET status = ?, owner = ?, lease_until = ?, updated_at = ? WHERE turn_id = "
+                "(SELECT turn_id FROM turns WHERE status = ? AND (not_before IS NULL OR not_before <= ?) "
+                "ORDER BY created_at LIMIT 1) RETURNING *",
+                (RUNNING, self.owner, now + self.lease, now, QUEUED, now),
+            ).fetchone()
+        return self._turn(row)
+
+    async def requeue(self, turn_id: str, delay: float = 0):
+        """Queue a turn again, to run after delay seconds."""
+        await self.update(turn_id, status=QUEUED, owner=None, lease_until=None, not_before=time.time() + delay if delay > 0 else None)
+        self.available.set()
+
+    async def update(self, turn_id: str, **fields):
+        fields["updated_at"] = time.time()
+        if "messages" in fields:
+            fields["messages"] = json.dumps(fields["messages"])
+        assignments = ", ".join([f"{name} = ?" for name in fields])
+        await asyncio.to_thread(self._execute, f"UPDATE turns SET {assignments} WHERE turn_id = ?", (*fields.values(), turn_id))
+
+    def _execute(self, query: str, parameters: tuple):
+        with self.lock:
+            self.connection.execute(query, parameters)
+
+    async def fetch(self, turn_id: str):
+        return await asyncio.to_thread(self._fetch, turn_id)
+
+    def _fetch(self, turn_id: str):
+        with self.lock:
+            row = self.connection.execute("SELECT * FROM turns WHERE turn_id = ?", (turn_id,)).fetchone()
+        return self._turn(row)
+
+    def _turn(self, row):
+        if row is None:
+            return None
+        turn = dict(row)
+        turn["message"] = json.loads(turn["message"])
+        turn["messages"] = json.loads(turn["messages"])
+        return turn
+
+
+class _LiveTurn:
+    def __init__(self):
+        self.marks = []
+        self.done = False
+        self.changed = asyncio.Condition()
+
+    async def publish(self, mark):
+        async with self.changed:
+            self.marks.append(mark)
+            self.changed.notify_all()
+
+    async def finish(self):
+        async with self.changed:
+            self.done = True
+            self.changed.notify_all()
+
+
+class TurnWorkerPool:
+    """Runs the queued turns with a fixed number of workers.
+
+    run_turn(turn, publish) runs a turn, awaiting publish(mark) for each of its stream updates, and returns
+    its new messages. The updates of the turns running in this process can be followed with follow().
+    """
+
+    def __init__(self, queue, run_turn, workers: int = 8, retry_delay: float = 5, retryable=()):
+        self.queue = queue
+        self.run_turn = run_turn
+        self.workers = workers
+        self.retry_delay = retry_delay
+        self.retryable = retryable
+        self.tasks = []
+        self.live = {}
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+
+    async def start(self):
+        self.tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def is_live(self, turn_id: str):
+        return turn_id in self.live
+
+    async def follow(self, turn_id: str):
+        """Replay and follow the stream updates of a turn running in this process."""
+        live = self.live.get(turn_id)
+        if live is None:
+            return
+        index = 0
+        while True:
+            async with live.changed:
+                await live.changed.wait_for(lambda: live.done or index < len(live.marks))
+                marks, done = live.marks[index:], live.done
+            for mark in marks:
+                yield mark
+            index += len(marks)
+            if done and index >= len(live.marks):
+                return
+
+    async def _work(self):
+        while True:
+            turn = await self.queue.get()
+            turn_id = turn["turn_id"]
+            live = self.live[turn_id] = _LiveTurn()
+            try:
+                messages = await self.run_turn(turn, live.publish)
+            except asyncio.CancelledError:
+                await self.queue.requeue(turn_id)
+                raise
+            except self.retryable as e:
+                # Not the fault of the turn (e.g. shed by admission control), try again later
+                self.retried += 1
+                logger.warning(f"Turn {turn_id} of conversation {turn['conversation_id']} postponed: {e}")
+                await self.queue.requeue(turn_id, delay=self.retry_delay)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Turn {turn_id} of conversation {turn['conversation_id']} failed: {e}")
+                await self.queue.update(turn_id, status=FAILED, error=str(e))
+            else:
+                self.completed += 1
+                await self.queue.update(turn_id, status=COMPLETED, messages=messages)
+            finally:
+                await live.finish()
+                self.live.pop(turn_id, None)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "running": len(self.live),
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+        }
+
+
+def create_turn_queue():
+    """Create the queue of asynchronous turns, TURN_QUEUE selects memory (default) or sqlite."""
+    kind = os.getenv("TURN_QUEUE", "memory")
+    if kind == "sqlite":
+        return SQLiteTurnQueue(
+            path=os.getenv("TURN_QUEUE_SQLITE_PATH", "turns.db"),
+            retention=float(os.getenv("TURN_RETENTION_SECONDS", "3600")),
+            lease=float(os.getenv("TURN_LEASE_SECONDS", "60")),
+        )
+    if kind != "memory":
+        raise ValueError(f"Invalid turn queue: {kind}")
+    return InProcessTurnQueue()
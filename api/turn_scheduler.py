@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from vanilla_aiagents.workflow import WorkflowInput
+from admission import CHANNEL_PRIORITIES, DEFAULT_CHANNEL, channel_of
+
+logger = logging.getLogger(__name__)
+
+
+def merge_messages(messages: list):
+    """Merge several user inputs in a single workflow input, preserving their order."""
+    if len(messages) == 1:
+        return messages[0]
+
+    texts = [m.text if isinstance(m, WorkflowInput) else m for m in messages]
+    images = [image for m in messages if isinstance(m, WorkflowInput) for image in m.images]
+    text = "\n".join([t for t in texts if t])
+    if len(images) == 0:
+        return text
+    return WorkflowInput(text, images=images)
+
+
+class _ConversationTurns:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = []
+        self.draining = False
+        self.users = 0
+
+
+class TurnScheduler:
+    """Runs the turns of each conversation one at a time.
+
+    Messages submitted while a turn of the same conversation is in flight are queued and merged in a
+    single follow-up turn, so a burst of N messages costs at most two workflow executions and every
+    caller receives the new messages of the turn that processed its message. A merged turn runs on the
+    highest priority channel of its messages.
+    """
+
+    def __init__(self):
+        self.conversations = {}
+        self.turns = 0
+        self.messages = 0
+
+    async def submit(self, conversation_id: str, message, run_turn, channel: str = DEFAULT_CHANNEL):
+        """Submit a message, run_turn(message, channel) is an async function running a turn with the (merged) message."""
+        future = asyncio.get_running_loop().create_future()
+        state = self.conversations.setdefault(conversation_id, _ConversationTurns())
+        state.pending.append((message, channel_of(channel), future))
+        self.messages += 1
+        if not state.draining:
+            state.draining = True
+            state.users += 1
+            asyncio.ensure_future(self._drain(conversation_id, state, run_turn))
+
+        return await future
+
+    @asynccontextmanager
+    async def exclusive(self, conversation_id: str):
+        """Run a turn of a conversation without merging it, typically a streamed one."""
+        state = self.conversations.setdefault(conversation_id, _ConversationTurns())
+        state.users += 1
+        try:
+            async with state.lock:
+                self.turns += 1
+                self.messages += 1
+                yield
+        finally:
+            self._release(conversation_id, state)
+
+    async def _drain(self, conversation_id: str, state: _ConversationTurns, run_turn):
+        try:
+            while len(state.pending) > 0:
+                async with state.lock:
+                    batch, state.pending = state.pending, []
+                    if len(batch) > 1:
+                        logger.info(f"Merging {len(batch)} messages in a single turn of conversation {conversation_id}")
+                    self.turns += 1
+                    channel = min([channel for _, channel, _ in batch], key=lambda c: CHANNEL_PRIORITIES[c])
+                    try:
+                        result = await run_turn(merge_messages([message for message, _, _ in batch]), channel)
+                    except Exception as e:
+                        for _, _, future in batch:
+                            if not future.done():
+                                future.set_exception(e)
+                    else:
+                        for _, _, future in batch:
+                            if not future.done():
+                                future.set_result(result)
+        finally:
+            state.draining = False
+            self._release(conversation_id, state)
+
+    def _release(self, conversation_id: str, state: _ConversationTurns):
+        state.users -= 1
+        if state.users <= 0 and not state.draining and self.conversations.get(conversation_id) is state:
+            del self.conversations[conversation_id]
+
+    def stats(self):
+        return {
+            "active_conversations": len(self.conversations),
+            "turns": self.turns,
+            "messages": self.messages,
+            "merged_messages": self.messages - self.turns,
+        }
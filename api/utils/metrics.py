@@ -0,0 +1,11 @@
+# A minimal registry of in-process metrics, exposed by the /metrics route
+_providers = {}
+
+
+def register_metrics(name: str, provider):
+    """Register a callable returning a dictionary of metrics under the given name."""
+    _providers[name] = provider
+
+
+def collect_metrics():
+    return {name: provider() for name, provider in _providers.items()}
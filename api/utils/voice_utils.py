@@ -1,16 +1,21 @@
 import os
+from functools import cache
 from azure.identity import DefaultAzureCredential, get_bearer_token_provider
 from openai import AzureOpenAI
 
-api_key = os.getenv("AZURE_OPENAI_WHISPER_API_KEY")
 
-token_provider = get_bearer_token_provider(
-    DefaultAzureCredential(), "https://cognitiveservices.azure.com/.default"
-) if api_key is None or api_key == "" else None
+# Created on the first transcription, so the API starts without Azure OpenAI settings (e.g. offline benchmarks)
+@cache
+def get_whisper_client():
+    api_key = os.getenv("AZURE_OPENAI_WHISPER_API_KEY")
 
-whisper_client = AzureOpenAI(
-    api_key=api_key,  
-    api_version=os.getenv("AZURE_OPENAI_WHISPER_VERSION"),
-    azure_endpoint = os.getenv("AZURE_OPENAI_WHISPER_ENDPOINT"),
-    azure_ad_token_provider=token_provider
-)
\ No newline at end of file
+    token_provider = get_bearer_token_provider(
+        DefaultAzureCredential(), "https://cognitiveservices.azure.com/.default"
+    ) if api_key is None or api_key == "" else None
+
+    return AzureOpenAI(
+        api_key=api_key,
+        api_version=os.getenv("AZURE_OPENAI_WHISPER_VERSION"),
+        azure_endpoint = os.getenv("AZURE_OPENAI_WHISPER_ENDPOINT"),
+        azure_ad_token_provider=token_provider
+    )
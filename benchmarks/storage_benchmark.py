@@ -0,0 +1,209 @@
+"""Compare the storage encodings of the conversation messages.
+
+Builds realistic telco support conversations (user questions, tool calls, knowledge base results and answers)
+and reports, for each storage mode and encoding, the bytes written per turn, the bytes stored per conversation
+and the time spent encoding and decoding. With --cosmos, the turns are also saved to the Cosmos DB container
+of the .env file (COSMOSDB_ENDPOINT, COSMOSDB_DATABASE, COSMOSDB_CONTAINER), reporting RU and latency per turn.
+
+    python benchmarks/storage_benchmark.py --conversations 20 --turns 12
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+
+BENCHMARK_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(BENCHMARK_DIR, "..", "api"))
+
+from vanilla_aiagents.conversation import Conversation  # noqa: E402
+import conversation_store  # noqa: E402
+from conversation_store import (  # noqa: E402
+    APPEND_MODE, DOCUMENT_MODE, GZIP_ENCODING, NO_ENCODING, ZSTD_ENCODING,
+    _append_batches, _decode, _document_item,
+)
+
+QUESTIONS = [
+    "Hi, my internet at home keeps dropping every evening, can you help?",
+    "What is the difference between the INET_HOME and INET_BUNDLE plans?",
+    "I was charged twice on my last invoice, customer id 12345.",
+    "Can I keep my number if I move to a mobile plan with more data?",
+    "How do I activate roaming before travelling to Spain next week?",
+    "The router light is blinking orange, what does it mean?",
+]
+
+KNOWLEDGE = (
+    "Customers on the {plan} plan get {speed} Mbps download and unlimited calls. Roaming in the EU is included "
+    "at no extra cost up to {data} GB per month, then charged per MB. Invoices are issued on the first day of "
+    "the month and duplicate charges are refunded within 5 business days after the billing team confirms them. "
+    "A blinking orange light on the router means the line is synchronizing: wait 5 minutes, then restart it. "
+)
+
+
+def build_turn(rng: random.Random, turn: int):
+    """The messages a turn adds: the user message, a tool call, its knowledge base result and the answer."""
+    plan = rng.choice(["INET_MOBILE", "INET_HOME", "INET_BUNDLE"])
+    call_id = f"call_{uuid.UUID(int=rng.getrandbits(128)).hex[:24]}"
+    chunks = [{
+        "title": f"{plan.lower()}-faq-{rng.randint(1, 40)}.md",
+        "chunk_id": f"{uuid.UUID(int=rng.getrandbits(128)).hex}_pages_{i}",
+        "chunk": KNOWLEDGE.format(plan=plan, speed=rng.choice([100, 300, 1000]), data=rng.choice([5, 15, 30])) * 2,
+    } for i in range(3)]
+    return [
+        {"role": "user", "name": "user", "content": rng.choice(QUESTIONS)},
+        {"role": "assistant", "name": "Router", "content": None, "tool_calls": [{
+            "id": call_id, "type": "function",
+            "function": {"name": "query_knowledge_base", "arguments": json.dumps({"query": f"{plan} question {turn}"})},
+        }]},
+        {"role": "tool", "tool_call_id": call_id, "name": "query_knowledge_base", "content": json.dumps(chunks)},
+        {"role": "assistant", "name": "TechnicalSupport", "content": (
+            f"Thanks for reaching out. On the {plan} plan, {chunks[0]['chunk'][:400]} "
+            "Is there anything else I can help you with?"
+        )},
+    ]
+
+
+def build_conversations(count: int, turns: int, seed: int):
+    rng = random.Random(seed)
+    return [[build_turn(rng, t) for t in range(turns)] for _ in range(count)]
+
+
+def item_size(item: dict):
+    # Cosmos DB bills and stores the JSON of the items
+    return len(json.dumps(item, separators=(",", ":")).encode("utf-8"))
+
+
+def measure_offline(conversations: list, mode: str, encoding: str):
+    written = []
+    stored = []
+    encode_time = 0
+    decode_time = 0
+    turns = 0
+    for conversation_turns in conversations:
+        cid = str(uuid.uuid4())
+        messages = []
+        header = None
+        items = {}
+        for new_messages in conversation_turns:
+            messages += new_messages
+            start = time.perf_counter()
+            if mode == APPEND_MODE:
+                batches, header = _append_batches(cid, header, new_messages, {}, encoding)
+                header["_etag"] = "etag"
+                turn_items = [operation[1][-1] for batch in batches for operation in batch]
+            else:
+                turn_items = [_document_item(cid, Conversation(messages=messages, variables={}), encoding)]
+            encode_time += time.perf_counter() - start
+            written.append(sum([item_size(item) for item in turn_items]))
+            items.update({item["id"]: item for item in turn_items})
+            turns += 1
+
+        start = time.perf_counter()
+        for item in items.values():
+            _decode(item["message"] if mode == APPEND_MODE and "message" in item else item.get("messages"))
+        decode_time += time.perf_counter() - start
+        stored.append(sum([item_size(item) for item in items.values()]))
+
+    return {
+        "bytes_per_turn": statistics.mean(written),
+        "bytes_per_conversation": statistics.mean(stored),
+        "encode_ms_per_turn": encode_time / turns * 1000,
+        "decode_ms_per_conversation": decode_time / len(conversations) * 1000,
+    }
+
+
+async def measure_cosmos(conversations: list, mode: str, encoding: str):
+    from azure.identity.aio import DefaultAzureCredential
+
+    store = conversation_store.AsyncConversationStore(
+        url=os.getenv("COSMOSDB_ENDPOINT"),
+        key=DefaultAzureCredential(),
+        database_name=os.getenv("COSMOSDB_DATABASE"),
+        container_name=os.getenv("COSMOSDB_CONTAINER"),
+        mode=mode,
+        encoding=encoding,
+    )
+    await store.initialize()
+
+    def _charge():
+        return float(store.container.client_connection.last_response_headers.get("x-ms-request-charge", 0))
+
+    write_charges = []
+    write_latencies = []
+    read_charges = []
+    read_latencies = []
+    try:
+        for conversation_turns in conversations:
+            cid = f"benchmark-{uuid.uuid4()}"
+            messages = []
+            history = None
+            for new_messages in conversation_turns:
+                history_count = len(messages)
+                messages += new_messages
+                start = time.perf_counter()
+                # A turn is a single write (or transactional batch), its charge is that of the last response
+                history = await store.save_conversation(cid, Conversation(messages=messages, variables={}), history_count, history, if_match=True)
+                write_latencies.append(time.perf_counter() - start)
+                write_charges.append(_charge())
+
+            start = time.perf_counter()
+            await store.get_conversation(cid)
+            read_latencies.append(time.perf_counter() - start)
+            read_charges.append(_charge())
+    finally:
+        await store.close()
+
+    return {
+        "write_ru_per_turn": statistics.mean(write_charges),
+        "write_ms_p50": statistics.median(write_latencies) * 1000,
+        "read_ru": statistics.mean(read_charges),
+        "read_ms_p50": statistics.median(read_latencies) * 1000,
+    }
+
+
+def encodings():
+    available = [NO_ENCODING, GZIP_ENCODING]
+    if conversation_store.zstandard is not None:
+        available.append(ZSTD_ENCODING)
+    return available
+
+
+async def main(args):
+    conversations = build_conversations(args.conversations, args.turns, args.seed)
+    print(f"{args.conversations} conversations of {args.turns} turns ({len(conversations[0][0])} messages per turn)\n")
+    if conversation_store.zstandard is None:
+        print("zstandard is not installed, skipping the zstd encoding\n")
+
+    print("| mode | encoding | bytes written per turn | bytes stored per conversation | encode ms per turn | decode ms per conversation |")
+    print("| --- | --- | --- | --- | --- | --- |")
+    for mode in [DOCUMENT_MODE, APPEND_MODE]:
+        for encoding in encodings():
+            r = measure_offline(conversations, mode, encoding)
+            print(f"| {mode} | {encoding} | {r['bytes_per_turn']:.0f} | {r['bytes_per_conversation']:.0f} | {r['encode_ms_per_turn']:.3f} | {r['decode_ms_per_conversation']:.3f} |")
+
+    if not args.cosmos:
+        return
+
+    print("\n| mode | encoding | write RU per turn | write p50 ms | read RU | read p50 ms |")
+    print("| --- | --- | --- | --- | --- | --- |")
+    for mode in [DOCUMENT_MODE, APPEND_MODE]:
+        for encoding in encodings():
+            r = await measure_cosmos(conversations, mode, encoding)
+            print(f"| {mode} | {encoding} | {r['write_ru_per_turn']:.2f} | {r['write_ms_p50']:.1f} | {r['read_ru']:.2f} | {r['read_ms_p50']:.1f} |")
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Benchmark the storage encodings of the conversation messages.")
+    parser.add_argument("--conversations", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=12, help="Turns per conversation.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cosmos", action="store_true", help="Also save the conversations to the Cosmos DB container of the .env file.")
+    args = parser.parse_args()
+    load_dotenv(override=True)
+    asyncio.run(main(args))
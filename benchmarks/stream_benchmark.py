@@ -0,0 +1,159 @@
+"""Compare streaming every update on its own with coalesced frames.
+
+Starts an API serving a simulated streamed turn behind the same GZip middleware as the API, once the
+way it used to be streamed (a JSON line and an INFO log per update) and once through stream_frames.
+Reports the time to first byte, the turn duration, the frames received and the server CPU per turn.
+
+    python benchmarks/stream_benchmark.py --turns 50 --concurrency 10 --tokens 300
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(BENCHMARK_DIR, "..", "api"))
+
+from stream_frames import STREAM_HEADERS, FrameStats, frames  # noqa: E402
+
+
+def create_app(tokens: int, token_delay: float, window: float, max_bytes: int):
+    from fastapi import FastAPI
+    from fastapi.middleware.gzip import GZipMiddleware
+    from fastapi.responses import StreamingResponse
+
+    app = FastAPI()
+    app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+    async def _turn():
+        # Same marks as a team streamed by the team host, tokens arriving every token_delay seconds
+        yield ["start", "telco-team"]
+        yield ["start", "Agent"]
+        text = ""
+        for i in range(tokens):
+            await asyncio.sleep(token_delay)
+            token = f" token{i}"
+            text += token
+            yield ["delta", {"content": token, "tool_calls": None}]
+        yield ["response", [{"role": "assistant", "name": "Agent", "content": text}, None]]
+        yield ["end", "Agent"]
+        yield ["end", "telco-team"]
+
+    async def _legacy():
+        async for mark, content in _turn():
+            json_string = json.dumps([mark, content])
+            logging.info(json_string)
+            yield json_string + "\n"
+
+    @app.post("/legacy")
+    async def legacy():
+        return StreamingResponse(_legacy(), media_type="text/event-stream")
+
+    @app.post("/coalesced")
+    async def coalesced(format: str = "ndjson"):
+        return StreamingResponse(frames(_turn(), format=format, window=window, max_bytes=max_bytes, stats=FrameStats()),
+                                 media_type="application/x-ndjson", headers=STREAM_HEADERS)
+
+    @app.get("/cpu")
+    async def cpu():
+        return time.process_time()
+
+    return app
+
+
+def serve(args):
+    import uvicorn
+
+    # The API logs at INFO, keep it so the per-update logs cost what they cost there
+    logging.basicConfig(level=logging.INFO, stream=open(os.devnull, "w"))
+    app = create_app(args.tokens, args.token_delay, args.window / 1000, args.max_bytes)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+async def run_turn(session, url: str):
+    start = time.perf_counter()
+    first_byte = None
+    chunks = 0
+    async with session.post(url, headers={"Accept-Encoding": "gzip"}) as response:
+        async for _ in response.content.iter_any():
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            chunks += 1
+    return time.perf_counter() - start, first_byte, chunks
+
+
+async def run_route(session, base_url: str, route: str, turns: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _bounded():
+        async with semaphore:
+            return await run_turn(session, f"{base_url}/{route}")
+
+    async with session.get(f"{base_url}/cpu") as response:
+        cpu_start = await response.json()
+    results = await asyncio.gather(*[_bounded() for _ in range(turns)])
+    async with session.get(f"{base_url}/cpu") as response:
+        cpu_end = await response.json()
+
+    return {
+        "ttfb_p50": statistics.median([r[1] for r in results]),
+        "duration_p50": statistics.median([r[0] for r in results]),
+        "chunks": statistics.mean([r[2] for r in results]),
+        "cpu_per_turn": (cpu_end - cpu_start) / turns,
+    }
+
+
+async def wait_ready(session, base_url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with session.get(f"{base_url}/cpu") as response:
+                return await response.json()
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+async def main(args):
+    import aiohttp
+
+    server = subprocess.Popen([sys.executable, __file__, "--serve", "--port", str(args.port), "--tokens", str(args.tokens),
+                               "--token-delay", str(args.token_delay), "--window", str(args.window), "--max-bytes", str(args.max_bytes)])
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        async with aiohttp.ClientSession(auto_decompress=True) as session:
+            await wait_ready(session, base_url)
+            print(f"{args.tokens} tokens per turn, a token every {args.token_delay * 1000:.1f} ms, {args.window} ms window\n")
+            print("| route | concurrency | TTFB p50 ms | turn p50 ms | chunks per turn | server CPU ms per turn |")
+            print("| --- | --- | --- | --- | --- | --- |")
+            for route in ["legacy", "coalesced"]:
+                # Warm up before measuring
+                await run_route(session, base_url, route, args.concurrency, args.concurrency)
+                r = await run_route(session, base_url, route, args.turns, args.concurrency)
+                print(f"| {route} | {args.concurrency} | {r['ttfb_p50'] * 1000:.1f} | {r['duration_p50'] * 1000:.1f} | {r['chunks']:.0f} | {r['cpu_per_turn'] * 1000:.2f} |")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark coalesced stream frames against one frame per update.")
+    parser.add_argument("--turns", type=int, default=50, help="Turns per route.")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--tokens", type=int, default=300, help="Tokens streamed per turn.")
+    parser.add_argument("--token-delay", type=float, default=0.002, help="Seconds between tokens.")
+    parser.add_argument("--window", type=float, default=50, help="Coalescing window in milliseconds.")
+    parser.add_argument("--max-bytes", type=int, default=4096)
+    parser.add_argument("--port", type=int, default=7200)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args)
+    else:
+        asyncio.run(main(args))
@@ -0,0 +1,41 @@
+import os
+import time
+
+from vanilla_aiagents.askable import Askable
+
+# Simulated agent work, so the benchmark measures the transport rather than the model
+TOKENS = int(os.getenv("BENCHMARK_TOKENS", "50"))
+TOKEN_DELAY = float(os.getenv("BENCHMARK_TOKEN_DELAY_SECONDS", "0.005"))
+
+
+class StubTeam(Askable):
+    """Stands in for the telco team: streams a fixed answer with the same marks as a real team."""
+
+    def __init__(self):
+        super().__init__("telco-team", "Benchmark stub of the telco team")
+
+    def ask(self, conversation, stream=False):
+        if stream:
+            conversation.update(["start", self.id])
+            conversation.update(["start", "Agent"])
+
+        text = ""
+        for i in range(TOKENS):
+            time.sleep(TOKEN_DELAY)
+            token = f" token{i}"
+            text += token
+            if stream:
+                conversation.update(["delta", {"content": token, "tool_calls": None}])
+
+        message = {"role": "assistant", "name": "Agent", "content": text}
+        if stream:
+            conversation.update(["response", [message, None]])
+            conversation.update(["end", "Agent"])
+            conversation.update(["end", self.id])
+        conversation.messages.append(message)
+        conversation.metrics.completion_tokens += TOKENS
+        conversation.metrics.total_tokens += TOKENS
+        return "done"
+
+
+team = StubTeam()
@@ -0,0 +1,126 @@
+"""Compare the REST and gRPC transports between the API and the team host.
+
+Starts a REST and a gRPC host serving the stub team of this folder, then runs turns through the API
+team client at several concurrency levels and reports latency, time to first token and throughput.
+
+    python benchmarks/transport_benchmark.py --turns 200 --concurrency 1 10 100
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(BENCHMARK_DIR, "..", "api"))
+
+from vanilla_aiagents.conversation import Conversation  # noqa: E402
+from team_client import AsyncRemoteAskable, create_team_transport  # noqa: E402
+
+HISTORY = [
+    {"role": "system", "content": "You are a helpful assistant.", "name": "system"},
+    *[
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"Message {i} of the conversation history. " * 10, "name": "user" if i % 2 == 0 else "Agent"}
+        for i in range(10)
+    ],
+]
+
+
+def start_host(type: str, port: int):
+    return subprocess.Popen(
+        [sys.executable, "-m", "vanilla_aiagents.remote.run_host", "--type", type, "--source-dir", BENCHMARK_DIR, "--port", str(port), "--log-level", "WARNING"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_ready(askable: AsyncRemoteAskable, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return await askable.transport.send(askable.id, "describe", {})
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.5)
+
+
+async def run_turn(askable: AsyncRemoteAskable, stream: bool):
+    conversation = Conversation(messages=list(HISTORY), variables={"customer_id": "benchmark"})
+    conversation.messages.append({"role": "user", "content": "How much is my bill?", "name": "user"})
+    start = time.perf_counter()
+    first_token = None
+    if stream:
+        async for mark, _ in askable.ask_stream(conversation):
+            if mark == "delta" and first_token is None:
+                first_token = time.perf_counter() - start
+    else:
+        await askable.ask(conversation)
+    return time.perf_counter() - start, first_token
+
+
+async def run_level(askable: AsyncRemoteAskable, turns: int, concurrency: int, stream: bool):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _bounded():
+        async with semaphore:
+            return await run_turn(askable, stream)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[_bounded() for _ in range(turns)])
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted([r[0] for r in results])
+    first_tokens = sorted([r[1] for r in results if r[1] is not None])
+    return {
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "ttft_p50": statistics.median(first_tokens) if first_tokens else None,
+        "throughput": turns / elapsed,
+    }
+
+
+def _ms(value):
+    return "-" if value is None else f"{value * 1000:.1f}"
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark the REST and gRPC team transports.")
+    parser.add_argument("--turns", type=int, default=200, help="Turns per transport and concurrency level.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 100], help="Concurrency levels.")
+    parser.add_argument("--rest-port", type=int, default=7100)
+    parser.add_argument("--grpc-port", type=int, default=7101)
+    args = parser.parse_args()
+
+    hosts = [start_host("rest", args.rest_port), start_host("grpc", args.grpc_port)]
+    askables = {
+        "rest": AsyncRemoteAskable("telco-team", create_team_transport(f"http://localhost:{args.rest_port}", "rest")),
+        "grpc": AsyncRemoteAskable("telco-team", create_team_transport(f"localhost:{args.grpc_port}", "grpc")),
+    }
+    try:
+        for askable in askables.values():
+            await askable.transport.start()
+            await wait_ready(askable)
+
+        print("| transport | mode | concurrency | p50 ms | p95 ms | TTFT p50 ms | turns/s |")
+        print("| --- | --- | --- | --- | --- | --- | --- |")
+        for concurrency in args.concurrency:
+            for stream in [False, True]:
+                for name, askable in askables.items():
+                    # Warm up the connections before measuring
+                    await run_level(askable, min(concurrency, args.turns), concurrency, stream)
+                    r = await run_level(askable, args.turns, concurrency, stream)
+                    mode = "stream" if stream else "ask"
+                    print(f"| {name} | {mode} | {concurrency} | {_ms(r['p50'])} | {_ms(r['p95'])} | {_ms(r['ttft_p50'])} | {r['throughput']:.1f} |")
+    finally:
+        for askable in askables.values():
+            await askable.close()
+        for host in hosts:
+            host.terminate()
+            host.wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -43,8 +43,11 @@ import aiohttp
 API_BASE_URL = os.getenv("API_BASE_URL")
 api_client_session = aiohttp.ClientSession()
 
-async def ask(input_message, conversation_id):
-    async with api_client_session.post(f"{API_BASE_URL}/conversation/{conversation_id}", json={"message": input_message}) as response:
+async def ask(input_message, conversation_id, idempotency_key=None):
+    headers = {"X-Channel": "whatsapp"}
+    if idempotency_key is not None:
+        headers["Idempotency-Key"] = idempotency_key
+    async with api_client_session.post(f"{API_BASE_URL}/conversation/{conversation_id}", json={"message": input_message}, headers=headers) as response:
         response.raise_for_status()
         new_messages = await response.json()
         return new_messages
@@ -86,7 +89,8 @@ async def process_whatsapp_message(sbmessage: func.ServiceBusMessage):
             # TBD handle media directly in the API layer
             
     
-    new_messages = await ask(content, from_number)
+    # Redeliveries of the same Service Bus message get the answer of the first delivery
+    new_messages = await ask(content, from_number, idempotency_key=sbmessage.message_id)
     
     logger.info(f"New messages: {new_messages}")
     
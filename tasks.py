@@ -1,3 +1,4 @@
+import os
 from invoke import task
 
 @task
@@ -9,5 +10,20 @@ def start_api(c, port=3000):
     c.run(f"cd api && python -m uvicorn api:app --reload --host 0.0.0.0 --port {port}")
 
 @task
-def start_host(c, port=7000):
-    c.run(f"cd telco-team && python -m vanilla_aiagents.remote.run_host --source-dir . --host 0.0.0.0 --port {port}")
+def start_host(c, port=7000, type="rest"):
+    # Only the gRPC host stops reading the updates of a cancelled call, the team can watch for it there.
+    # The REST host drains a cancelled call, the team runs to the end.
+    env = {"TEAM_STREAM_WATCHDOG": os.getenv("TEAM_STREAM_WATCHDOG", "true")} if type == "grpc" else {}
+    c.run(f"cd telco-team && python -m vanilla_aiagents.remote.run_host --type {type} --source-dir . --host 0.0.0.0 --port {port}", env=env)
+
+@task
+def benchmark_transport(c, turns=200):
+    c.run(f"python benchmarks/transport_benchmark.py --turns {turns}")
+
+@task
+def benchmark_stream(c, turns=50, concurrency=10):
+    c.run(f"python benchmarks/stream_benchmark.py --turns {turns} --concurrency {concurrency}")
+
+@task
+def benchmark_storage(c, conversations=20, turns=12, cosmos=False):
+    c.run(f"python benchmarks/storage_benchmark.py --conversations {conversations} --turns {turns}" + (" --cosmos" if cosmos else ""))
@@ -1,5 +1,19 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
 from azure.cosmos import CosmosClient, PartitionKey, exceptions
 
+from counters import Counters
+
+logger = logging.getLogger(__name__)
+
+
+def _customer_status(item, service_sku):
+    return item.get("services")[service_sku] or None
+
+
 class ConfigurationStore:
     def __init__(self, url, key, database_name, container_name):
         self.client = CosmosClient(url, credential=key)
@@ -7,17 +21,190 @@ class ConfigurationStore:
         self.container_name = container_name
         self.db = self.client.get_database_client(database=self.database_name)
         self.container = self.db.get_container_client(container=self.container_name)
-        
+
     def get_service_status(self, service_sku):
         try:
             item = self.container.read_item(item=service_sku, partition_key="service")
             return item.get("status") or None
         except exceptions.CosmosResourceNotFoundError:
             return None
-        
+
     def get_customer_status(self, service_sku, customer_code):
+        item = self.get_customer(customer_code)
+        return _customer_status(item, service_sku) if item is not None else None
+
+    def get_customer(self, customer_code):
         try:
-            item = self.container.read_item(item=customer_code, partition_key="customer")
-            return item.get("services")[service_sku] or None if item is not None else "No data available"
+            return self.container.read_item(item=customer_code, partition_key="customer")
         except exceptions.CosmosResourceNotFoundError:
             return None
+
+    def get_service_statuses(self):
+        """The status of every service, by SKU."""
+        items = self.container.query_items("SELECT c.id, c.status FROM c", partition_key="service")
+        return {item["id"]: item.get("status") or None for item in items}
+
+    def read_changes(self, continuation=None):
+        """The items changed since continuation (since now when None), and the continuation of the next read."""
+        kwargs = {"continuation": continuation} if continuation is not None else {"start_time": "Now"}
+        pages = self.container.query_items_change_feed(**kwargs).by_page()
+        items = [item for page in pages for item in page]
+        return items, pages.continuation_token
+
+
+class CachedConfigurationStore:
+    """Serves the configuration from memory, reading through to the store.
+
+    The service statuses are preloaded and kept up to date from the change feed of the container, or by polling
+    it when the change feed is not available (e.g. a local stand-in of Cosmos DB). Customer documents are kept in
+    an LRU of max_customers entries, and kept up to date from the change feed too. Entries the refresher keeps up
+    to date do not expire while it is healthy, i.e. it succeeded within the last ttl seconds. The others (all of
+    them without refresh, customers when polling, any entry once the refresher fails) are read again after ttl
+    seconds, should a change have been missed.
+    """
+
+    def __init__(self, store: ConfigurationStore, ttl: float = 60, max_customers: int = 1000, refresh: str = "change_feed", refresh_interval: float = 5, log_every: int = 100):
+        self.store = store
+        self.ttl = ttl
+        self.max_customers = max_customers
+        self.refresh = refresh
+        self.refresh_interval = refresh_interval
+        # SKU -> (status, expires_at)
+        self.services = {}
+        # Customer code -> (document or None when not found, expires_at)
+        self.customers = OrderedDict()
+        self.change_feed = False
+        # Time of the last successful refresh, None without refresh
+        self.refreshed_at = None
+        self.counters = Counters("Configuration cache", self.stats, log_every)
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Preload the service statuses and start refreshing them in a background thread."""
+        continuation = None
+        use_change_feed = self.refresh == "change_feed"
+        if use_change_feed:
+            try:
+                # Read before the preload, so no change made in between is missed
+                _, continuation = self.store.read_changes()
+            except Exception as e:
+                logger.warning(f"Change feed of the configuration not available, polling instead: {e}")
+                use_change_feed = False
+        preloaded = False
+        try:
+            self._load_services()
+            preloaded = True
+        except Exception as e:
+            # Tool calls read through until the next refresh
+            logger.warning(f"Could not preload the service statuses: {e}")
+        if self.refresh != "none" and self.refresh_interval > 0:
+            self.change_feed = use_change_feed
+            if use_change_feed or preloaded:
+                self.refreshed_at = time.time()
+            threading.Thread(target=self._refresh, args=(continuation, use_change_feed), name="configuration-cache", daemon=True).start()
+        return self
+
+    def get_service_status(self, service_sku):
+        with self.lock:
+            entry = self.services.get(service_sku)
+        if entry is not None and (entry[1] >= time.time() or self._maintained()):
+            self.counters.record(hits=1)
+            return entry[0]
+        status = self.store.get_service_status(service_sku)
+        with self.lock:
+            self.services[service_sku] = (status, time.time() + self.ttl)
+        self.counters.record(misses=1)
+        return status
+
+    def get_customer_status(self, service_sku, customer_code):
+        item = self.get_customer(customer_code)
+        return _customer_status(item, service_sku) if item is not None else None
+
+    def get_customer(self, customer_code):
+        with self.lock:
+            entry = self.customers.get(customer_code)
+            if entry is not None and (entry[1] >= time.time() or self._maintained(customers=True)):
+                self.customers.move_to_end(customer_code)
+                item = entry[0]
+            else:
+                entry = None
+        if entry is not None:
+            self.counters.record(hits=1)
+            return item
+        item = self.store.get_customer(customer_code)
+        self._put_customer(customer_code, item)
+        self.counters.record(misses=1)
+        return item
+
+    def _put_customer(self, customer_code, item):
+        with self.lock:
+            self.customers.pop(customer_code, None)
+            if self.max_customers <= 0:
+                return
+            self.customers[customer_code] = (item, time.time() + self.ttl)
+            while len(self.customers) > self.max_customers:
+                self.customers.popitem(last=False)
+
+    def _load_services(self):
+        statuses = self.store.get_service_statuses()
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            self.services = {sku: (status, expires_at) for sku, status in statuses.items()}
+
+    def _apply(self, items):
+        # Customers not in the cache are read on their next lookup
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            for item in items:
+                if item.get("partition_key") == "service":
+                    self.services[item["id"]] = (item.get("status") or None, expires_at)
+                elif item.get("partition_key") == "customer" and item["id"] in self.customers:
+                    self.customers[item["id"]] = (item, expires_at)
+        self.counters.add(changes=len(items))
+
+    def _refresh(self, continuation, use_change_feed: bool):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                if use_change_feed:
+                    items, continuation = self.store.read_changes(continuation)
+                    self._apply(items)
+                else:
+                    self._load_services()
+                self.refreshed_at = time.time()
+            except Exception as e:
+                # Entries expire after ttl seconds again, until a refresh succeeds
+                logger.warning(f"Could not refresh the configuration cache: {e}")
+
+    def _maintained(self, customers: bool = False):
+        # Whether the refresher keeps the entries up to date: polling only reloads the service statuses
+        if self.refreshed_at is None or (customers and not self.change_feed):
+            return False
+        return time.time() - self.refreshed_at < self.ttl
+
+    def stats(self):
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            "hits": self.counters["hits"],
+            "misses": self.counters["misses"],
+            "hit_rate": self.counters["hits"] / lookups if lookups else 0.0,
+            "changes": self.counters["changes"],
+            "customers": len(self.customers),
+        }
+
+
+def create_configuration_store(store: ConfigurationStore):
+    """Wrap the store in a cache, CONFIGURATION_CACHE_TTL_SECONDS=0 disables it."""
+    ttl = float(os.getenv("CONFIGURATION_CACHE_TTL_SECONDS", "60"))
+    if ttl <= 0:
+        return store
+    refresh = os.getenv("CONFIGURATION_CACHE_REFRESH", "change_feed")
+    if refresh not in ["change_feed", "poll", "none"]:
+        raise ValueError(f"Invalid configuration cache refresh: {refresh}")
+    return CachedConfigurationStore(
+        store,
+        ttl=ttl,
+        max_customers=int(os.getenv("CONFIGURATION_CACHE_MAX_CUSTOMERS", "1000")),
+        refresh=refresh,
+        refresh_interval=float(os.getenv("CONFIGURATION_CACHE_REFRESH_SECONDS", "5")),
+    ).start()
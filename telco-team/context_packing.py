@@ -0,0 +1,160 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from counters import Counters
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Consecutive pages of a document overlap by up to 500 characters (see the SplitSkill of the search index)
+MAX_OVERLAP = 600
+MIN_OVERLAP = 40
+
+
+class Tokenizer:
+    """Counts tokens with the tiktoken encoding of the model, or estimates them when it cannot be loaded.
+
+    The encoding is loaded on first use: tiktoken downloads it then, which fails on a host without network access.
+    """
+
+    def __init__(self, encoding: str = "o200k_base"):
+        self.encoding_name = encoding
+        self.encoding = None
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def _encoding(self):
+        if not self.loaded:
+            with self.lock:
+                if not self.loaded:
+                    self.encoding = self._load()
+                    self.loaded = True
+        return self.encoding
+
+    def _load(self):
+        if tiktoken is None:
+            logger.warning("tiktoken is not installed, token counts are estimated")
+            return None
+        try:
+            return tiktoken.get_encoding(self.encoding_name)
+        except Exception as e:
+            logger.warning(f"Could not load the {self.encoding_name} encoding, token counts are estimated: {e}")
+            return None
+
+    def count(self, text: str):
+        encoding = self._encoding()
+        if encoding is None:
+            # About 4 characters per token for english text
+            return (len(text) + 3) // 4
+        return len(encoding.encode(text))
+
+    def truncate(self, text: str, max_tokens: int):
+        encoding = self._encoding()
+        if encoding is None:
+            return text[:max_tokens * 4]
+        return encoding.decode(encoding.encode(text)[:max_tokens])
+
+
+def _page(chunk_id: str):
+    # Chunk id has format {parent_id}_pages_{page_number}
+    page = chunk_id.rsplit("_", 1)[-1]
+    return int(page) if page.isdigit() else 0
+
+
+def strip_overlap(text: str, packed: list[str]):
+    """Remove from text the parts already in the packed passages of the same document: a duplicated passage is
+    dropped, the head (or tail) it shares with the tail (or head) of a packed passage is cut."""
+    for other in packed:
+        if text in other:
+            return ""
+        for k in range(min(len(text), len(other), MAX_OVERLAP), MIN_OVERLAP - 1, -1):
+            if other.endswith(text[:k]):
+                text = text[k:]
+                break
+        for k in range(min(len(text), len(other), MAX_OVERLAP), MIN_OVERLAP - 1, -1):
+            if text.endswith(other[:k]):
+                text = text[:-k]
+                break
+    return text.strip()
+
+
+def format_sources(documents: list[dict]):
+    """The tool result without packing: every chunk in full, with its title and page."""
+    return "\n".join([f'# Source "{document["title"]}" - Page {document["chunk_id"].split("_")[-1]}\n{document["chunk"]}' for document in documents])
+
+
+class ContextPacker:
+    """Packs the knowledge base results in a token budget.
+
+    Results are taken in ranking order: the text a result shares with the results already packed from the same
+    document is removed, then it is packed whole if it fits, truncated if at least min_passage_tokens remain. The
+    packed passages are grouped by document, in page order, under a single citation listing their pages.
+    """
+
+    def __init__(self, tokenizer: Tokenizer, max_tokens: int = 2000, min_passage_tokens: int = 100, log_every: int = 100):
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.min_passage_tokens = min_passage_tokens
+        self.counters = Counters("Context packing", self.stats, log_every)
+
+    def pack(self, documents: list[dict]):
+        # parent_id -> title and [(page, text)] of its packed passages, in ranking order of the documents
+        packed = OrderedDict()
+        budget = self.max_tokens
+        for document in documents:
+            parent_id = document.get("parent_id") or document["chunk_id"].rsplit("_pages_", 1)[0]
+            title, passages = packed.setdefault(parent_id, (document["title"], []))
+            text = strip_overlap(document["chunk"], [p for _, p in passages])
+            if text == "":
+                continue
+            # Citation and separators of the passage
+            tokens = self.tokenizer.count(text) + 8
+            if tokens > budget:
+                if budget < self.min_passage_tokens:
+                    break
+                text = self.tokenizer.truncate(text, budget - 8) + " ..."
+                tokens = budget
+            passages.append((_page(document["chunk_id"]), text))
+            budget -= tokens
+
+        sections = []
+        for title, passages in packed.values():
+            if len(passages) == 0:
+                continue
+            passages.sort(key=lambda p: p[0])
+            pages = ", ".join([str(page) for page, _ in passages])
+            sections.append(f'# Source "{title}" - Page{"s" if len(passages) > 1 else ""} {pages}\n' + "\n".join([text for _, text in passages]))
+        result = "\n".join(sections)
+
+        tokens_in, tokens_out = self.tokenizer.count(format_sources(documents)), self.tokenizer.count(result)
+        logger.debug(f"Packed knowledge base results: {tokens_in} -> {tokens_out} tokens")
+        self.counters.record(calls=1, tokens_in=tokens_in, tokens_out=tokens_out)
+        return result
+
+    def stats(self):
+        calls, saved = self.counters["calls"], self.counters["tokens_in"] - self.counters["tokens_out"]
+        return {
+            "calls": calls,
+            "tokens_in": self.counters["tokens_in"],
+            "tokens_out": self.counters["tokens_out"],
+            "tokens_saved": saved,
+            "tokens_saved_per_call": saved / calls if calls else 0.0,
+        }
+
+
+def create_context_packer():
+    """Create the context packer of the knowledge base results, KB_CONTEXT_MAX_TOKENS=0 disables packing."""
+    max_tokens = int(os.getenv("KB_CONTEXT_MAX_TOKENS", "2000"))
+    if max_tokens <= 0:
+        return None
+    return ContextPacker(
+        Tokenizer(os.getenv("KB_CONTEXT_ENCODING", "o200k_base")),
+        max_tokens=max_tokens,
+        min_passage_tokens=int(os.getenv("KB_CONTEXT_MIN_PASSAGE_TOKENS", "100")),
+    )
@@ -0,0 +1,40 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Counters:
+    """The counters of a component of the team, with its stats logged every log_every events.
+
+    Tools of parallel asks run in the threads of the team host, the counters are updated under a lock.
+    """
+
+    def __init__(self, name: str, stats, log_every: int = 100):
+        self.name = name
+        self.stats = stats
+        self.log_every = log_every
+        self.values = {}
+        self.events = 0
+        self.lock = threading.Lock()
+
+    def add(self, **amounts):
+        """Add to the counters."""
+        with self.lock:
+            self._add(amounts)
+
+    def record(self, **amounts):
+        """Add to the counters for an event (a lookup, a call...), logging the stats every log_every events."""
+        with self.lock:
+            self._add(amounts)
+            self.events += 1
+            events = self.events
+        if self.log_every > 0 and events % self.log_every == 0:
+            logger.info(f"{self.name}: {self.stats()}")
+
+    def _add(self, amounts: dict):
+        for name, amount in amounts.items():
+            self.values[name] = self.values.get(name, 0) + amount
+
+    def __getitem__(self, name: str):
+        return self.values.get(name, 0)
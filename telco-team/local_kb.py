@@ -0,0 +1,282 @@
+"""A local knowledge base engine, an alternative to Azure AI Search for offline runs and tests.
+
+Ingests the documents of infra/data like infra/scripts/setup_aisearch.py: each document is split in pages like the
+SplitSkill (2000 characters, 500 overlapping), each page is embedded, and queries are served as hybrid BM25 +
+vector searches merged with Reciprocal Rank Fusion, returning title, chunk_id and chunk like the search index.
+
+    python local_kb.py build --source ../infra/data --path kb_index
+    python local_kb.py query --path kb_index "router offline"
+"""
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Same settings as the SplitSkill of the search index
+MAX_PAGE_LENGTH = 2000
+PAGE_OVERLAP_LENGTH = 500
+# BM25 parameters, the defaults of Azure AI Search
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Text matches considered by hybrid queries, and the constant of Reciprocal Rank Fusion
+TEXT_CANDIDATES = 50
+RRF_K = 60
+SOURCE_EXTENSIONS = [".txt", ".md"]
+
+
+def split_pages(text: str, max_length: int = MAX_PAGE_LENGTH, overlap: int = PAGE_OVERLAP_LENGTH):
+    """Split a document in pages of at most max_length characters, ending on a sentence or word boundary when
+    possible, each page starting with the last overlap characters of the previous one."""
+    text = text.strip()
+    pages = []
+    start = 0
+    while start < len(text):
+        end = min(start + max_length, len(text))
+        if end < len(text):
+            # Prefer the last sentence end in the second half of the page, then the last whitespace
+            window = text[start + max_length // 2:end]
+            boundaries = [m.end() for m in re.finditer(r"[.!?](\s|$)|\n", window)]
+            if not boundaries:
+                boundaries = [m.end() for m in re.finditer(r"\s", window)]
+            if boundaries:
+                end = start + max_length // 2 + boundaries[-1]
+        pages.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        # Overlap starts on a word boundary
+        next_start = max(end - overlap, start + 1)
+        while next_start < end and not text[next_start - 1].isspace():
+            next_start += 1
+        start = next_start if next_start < end else end
+    return [page for page in pages if page]
+
+
+def tokenize(text: str):
+    return re.findall(r"\w+", text.lower())
+
+
+def hash_embedding(dimensions: int = 256):
+    """A deterministic embedding hashing the words and word pairs of a text, for tests and offline runs."""
+    def _embed(texts: list[str]):
+        vectors = np.zeros((len(texts), dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], "little") % dimensions
+                vectors[row, bucket] += 1.0 if digest[4] & 1 else -1.0
+        return vectors
+    _embed.name = f"hash-{dimensions}"
+    return _embed
+
+
+def azure_openai_embedding(deployment: str, dimensions: int = None):
+    """Embed with an Azure OpenAI deployment, like the AzureOpenAIEmbeddingSkill of the search index."""
+    from azure.identity import DefaultAzureCredential, get_bearer_token_provider
+    from openai import AzureOpenAI
+
+    api_key = os.getenv("AZURE_OPENAI_KEY")
+    client = AzureOpenAI(
+        api_key=api_key,
+        api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        azure_ad_token_provider=get_bearer_token_provider(DefaultAzureCredential(), "https://cognitiveservices.azure.com/.default") if not api_key else None,
+    )
+
+    def _embed(texts: list[str]):
+        kwargs = {"dimensions": dimensions} if dimensions else {}
+        response = client.embeddings.create(model=deployment, input=texts, **kwargs)
+        return np.array([item.embedding for item in response.data], dtype=np.float32)
+    _embed.name = f"azure-openai-{deployment}-{dimensions}"
+    return _embed
+
+
+def create_embedding():
+    """Create the embedding function, KB_EMBEDDING selects hash (default) or azure_openai."""
+    kind = os.getenv("KB_EMBEDDING", "hash")
+    if kind == "hash":
+        return hash_embedding(int(os.getenv("KB_EMBEDDING_DIMENSIONS", "256")))
+    if kind == "azure_openai":
+        dimensions = os.getenv("KB_EMBEDDING_DIMENSIONS")
+        return azure_openai_embedding(os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT"), int(dimensions) if dimensions else None)
+    raise ValueError(f"Invalid knowledge base embedding: {kind}")
+
+
+def _normalize(vectors: np.ndarray):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _kmeans(vectors: np.ndarray, clusters: int, iterations: int = 10):
+    # Spherical k-means, centroids of the IVF index
+    rng = np.random.default_rng(0)
+    centroids = vectors[rng.choice(len(vectors), clusters, replace=False)]
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(clusters):
+            members = vectors[assignments == c]
+            if len(members) > 0:
+                centroids[c] = members.mean(axis=0)
+        centroids = _normalize(centroids)
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+def build(source: str, path: str, embed, ann: str = "none", batch_size: int = 64):
+    """Ingest the documents of the source folder into a knowledge base folder."""
+    chunks = []
+    for entry in sorted(os.scandir(source), key=lambda e: e.name):
+        if os.path.splitext(entry.name)[1].lower() not in SOURCE_EXTENSIONS:
+            logger.warning(f"Skipping {entry.name}, only text documents are ingested")
+            continue
+        with open(entry.path, encoding="utf-8") as f:
+            text = f.read()
+        parent_id = hashlib.md5(entry.name.encode("utf-8")).hexdigest()
+        # Chunk id has format {parent_id}_pages_{page_number}, like the index projections
+        chunks += [{"title": entry.name, "parent_id": parent_id, "chunk_id": f"{parent_id}_pages_{i}", "chunk": page}
+                   for i, page in enumerate(split_pages(text))]
+    if len(chunks) == 0:
+        raise ValueError(f"No documents to ingest in {source}")
+
+    vectors = _normalize(np.concatenate([embed([c["chunk"] for c in chunks[i:i + batch_size]]) for i in range(0, len(chunks), batch_size)]))
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "chunks.jsonl"), "w", encoding="utf-8") as f:
+        f.writelines([json.dumps(c) + "\n" for c in chunks])
+    np.save(os.path.join(path, "vectors.npy"), vectors.astype(np.float32))
+
+    if ann == "ivf":
+        centroids, assignments = _kmeans(vectors, max(1, int(math.sqrt(len(chunks)))))
+        np.save(os.path.join(path, "ivf_centroids.npy"), centroids.astype(np.float32))
+        np.save(os.path.join(path, "ivf_assignments.npy"), assignments)
+    elif ann == "hnsw":
+        import hnswlib
+
+        index = hnswlib.Index(space="ip", dim=vectors.shape[1])
+        index.init_index(max_elements=len(chunks), ef_construction=200, M=16)
+        index.add_items(vectors, np.arange(len(chunks)))
+        index.save_index(os.path.join(path, "hnsw.bin"))
+    elif ann != "none":
+        raise ValueError(f"Invalid approximate index: {ann}")
+
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({"embedding": embed.name, "dimensions": int(vectors.shape[1]), "chunks": len(chunks), "ann": ann}, f)
+    logger.info(f"Ingested {len(chunks)} chunks from {source} into {path}")
+
+
+class LocalKnowledgeBase:
+    """Serves hybrid queries over a knowledge base folder written by build().
+
+    The embeddings are memory mapped, so the host processes of a node share them through the page cache. Vector
+    matches are exact unless the folder holds an approximate index (ivf or hnsw).
+    """
+
+    def __init__(self, path: str, embed, nprobe: int = 4):
+        self.path = path
+        self.embed = embed
+        self.nprobe = nprobe
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["embedding"] != embed.name:
+            raise ValueError(f"Knowledge base {path} was built with the {self.meta['embedding']} embedding, not {embed.name}")
+        with open(os.path.join(path, "chunks.jsonl"), encoding="utf-8") as f:
+            self.chunks = [json.loads(line) for line in f]
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        # Changes whenever the knowledge base is rebuilt
+        self.generation = str(os.path.getmtime(os.path.join(path, "meta.json")))
+
+        # BM25 over the title and the chunk, like the searchable fields of the index
+        self.postings = defaultdict(list)
+        self.lengths = []
+        for i, chunk in enumerate(self.chunks):
+            tokens = tokenize(f"{chunk['title']} {chunk['chunk']}")
+            self.lengths.append(len(tokens))
+            for term, count in Counter(tokens).items():
+                self.postings[term].append((i, count))
+        self.average_length = sum(self.lengths) / len(self.lengths)
+
+        self.ivf = None
+        self.hnsw = None
+        if self.meta["ann"] == "ivf":
+            centroids = np.load(os.path.join(path, "ivf_centroids.npy"))
+            assignments = np.load(os.path.join(path, "ivf_assignments.npy"))
+            self.ivf = (centroids, [np.flatnonzero(assignments == c) for c in range(len(centroids))])
+        elif self.meta["ann"] == "hnsw":
+            import hnswlib
+
+            self.hnsw = hnswlib.Index(space="ip", dim=self.meta["dimensions"])
+            self.hnsw.load_index(os.path.join(path, "hnsw.bin"), max_elements=len(self.chunks))
+
+    def search(self, query: str, top: int = 5, k_nearest_neighbors: int = 1):
+        """Hybrid search, returns the top chunks as {"title", "chunk_id", "chunk", "parent_id", "@search.score"} dictionaries."""
+        text_ranking = self._text_ranking(query)[:TEXT_CANDIDATES]
+        vector_ranking = self._vector_ranking(query, k_nearest_neighbors)
+        scores = defaultdict(float)
+        for ranking in [text_ranking, vector_ranking]:
+            for rank, i in enumerate(ranking):
+                scores[i] += 1 / (RRF_K + rank + 1)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top]
+        return [{**self.chunks[i], "@search.score": score} for i, score in ranked]
+
+    def _text_ranking(self, query: str):
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term, [])
+            idf = math.log(1 + (len(self.chunks) - len(postings) + 0.5) / (len(postings) + 0.5))
+            for i, count in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[i] / self.average_length)
+                scores[i] += idf * count * (BM25_K1 + 1) / (count + norm)
+        return [i for i, _ in sorted(scores.items(), key=lambda item: item[1], reverse=True)]
+
+    def _vector_ranking(self, query: str, k: int):
+        vector = _normalize(self.embed([query]))[0]
+        if self.hnsw is not None:
+            labels, _ = self.hnsw.knn_query(vector, k=min(k, len(self.chunks)))
+            return [int(i) for i in labels[0]]
+        if self.ivf is not None:
+            centroids, lists = self.ivf
+            probed = np.argsort(-(centroids @ vector))[:self.nprobe]
+            candidates = np.concatenate([lists[c] for c in probed])
+        else:
+            candidates = np.arange(len(self.chunks))
+        similarities = self.vectors[candidates] @ vector
+        return [int(candidates[i]) for i in np.argsort(-similarities)[:k]]
+
+
+def create_local_knowledge_base():
+    """Open the local knowledge base of KB_LOCAL_PATH, building it from KB_SOURCE_DIR when missing."""
+    path = os.getenv("KB_LOCAL_PATH", "kb_index")
+    embed = create_embedding()
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        build(os.getenv("KB_SOURCE_DIR", os.path.join("..", "infra", "data")), path, embed, ann=os.getenv("KB_ANN", "none"))
+    return LocalKnowledgeBase(path, embed, nprobe=int(os.getenv("KB_IVF_NPROBE", "4")))
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Build or query the local knowledge base.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build")
+    build_parser.add_argument("--source", default=os.path.join("..", "infra", "data"))
+    build_parser.add_argument("--path", default="kb_index")
+    build_parser.add_argument("--ann", choices=["none", "ivf", "hnsw"], default="none")
+    query_parser = subparsers.add_parser("query")
+    query_parser.add_argument("--path", default="kb_index")
+    query_parser.add_argument("--top", type=int, default=5)
+    query_parser.add_argument("query")
+    args = parser.parse_args()
+    load_dotenv(override=True)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "build":
+        build(args.source, args.path, create_embedding(), ann=args.ann)
+    else:
+        for document in LocalKnowledgeBase(args.path, create_embedding()).search(args.query, top=args.top):
+            print(f'# {document["title"]} - {document["chunk_id"]} ({document["@search.score"]:.4f})\n{document["chunk"]}\n')
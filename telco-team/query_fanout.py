@@ -0,0 +1,127 @@
+import logging
+import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from counters import Counters
+
+logger = logging.getLogger(__name__)
+
+# Sections of the knowledge base documents covering each service
+SERVICE_TERMS = {
+    "INET_MOBILE": "Mobile Internet",
+    "INET_HOME": "Home Internet",
+    "INET_BUNDLE": "All-in-One Bundle",
+}
+# Words of the service names in customer requests, when the agent does not pass the SKU
+SERVICE_HINTS = {
+    "INET_MOBILE": ["mobile", "phone", "smartphone", "sim", "4g", "5g"],
+    "INET_HOME": ["home", "router", "modem", "fiber", "wifi", "adsl"],
+    "INET_BUNDLE": ["bundle", "all in one"],
+}
+STOP_WORDS = set("""
+a about after again all am an and any are as at be because been before being but by can could customer did do does doing
+don down during for from further had has have having he her here hers him his how i if in into is it its just me more
+most my no nor not now of off on once only or other our out over own please same she should so some still such than that
+the their them then there these they this those through to too under until up very was we were what when where which
+while who why will with would you your
+""".split())
+# Constant of Reciprocal Rank Fusion
+RRF_K = 60
+
+
+def extract_keywords(query: str):
+    """The content words of a query, in order, e.g. "my router is not working since today" -> "router working today"."""
+    words = re.findall(r"\w+", query.lower())
+    return " ".join([w for w in words if w not in STOP_WORDS and len(w) > 1])
+
+
+def detect_services(query: str):
+    words = re.findall(r"\w+", query.lower())
+    text = f" {' '.join(words)} "
+    return [sku for sku, hints in SERVICE_HINTS.items() if any([f" {hint} " in text for hint in hints])]
+
+
+def expand_query(query: str, service_sku: str = None, max_queries: int = 4):
+    """Variants of a knowledge base query: the query itself, its keywords, and its keywords scoped to the service
+    (the given SKU, or the services the query mentions).
+
+    The service scopes the query by the name of its section in the documents, not with a search filter: the
+    index has no service field, and a single document covers every service. The unscoped variants stay in the
+    fused ranking, so a scoped variant boosts the section of the service without hiding the others.
+    """
+    keywords = extract_keywords(query)
+    services = [service_sku] if service_sku in SERVICE_TERMS else detect_services(query)
+    variants = [query, keywords] + [f"{SERVICE_TERMS[sku]} {keywords or query}" for sku in services]
+    # Same variant once, in order
+    variants = list(dict.fromkeys([v.strip() for v in variants if v and v.strip()]))
+    return variants[:max_queries]
+
+
+def reciprocal_rank_fusion(rankings: list[list[dict]], top: int, max_per_parent: int = 2):
+    """Merge rankings of search results, each chunk once (by chunk_id), at most max_per_parent chunks of a document."""
+    scores = defaultdict(float)
+    documents = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking):
+            scores[document["chunk_id"]] += 1 / (RRF_K + rank + 1)
+            documents.setdefault(document["chunk_id"], document)
+
+    fused = []
+    per_parent = defaultdict(int)
+    for chunk_id, _ in sorted(scores.items(), key=lambda item: item[1], reverse=True):
+        document = documents[chunk_id]
+        # Chunk id has format {parent_id}_pages_{page_number}
+        parent_id = document.get("parent_id") or chunk_id.rsplit("_pages_", 1)[0]
+        if max_per_parent > 0 and per_parent[parent_id] >= max_per_parent:
+            continue
+        per_parent[parent_id] += 1
+        fused.append(document)
+        if len(fused) >= top:
+            break
+    return fused
+
+
+class QueryFanOut:
+    """Runs the variants of a knowledge base query concurrently and fuses their results.
+
+    One tool call then covers the rewrites the agent would otherwise try one LLM round-trip at a time.
+    """
+
+    def __init__(self, search, max_queries: int = 4, top: int = 5, max_per_parent: int = 2, workers: int = 8, log_every: int = 100):
+        # search(query) returns a ranked list of {"title", "chunk_id", "chunk", "parent_id"} results
+        self.search = search
+        self.max_queries = max_queries
+        self.top = top
+        self.max_per_parent = max_per_parent
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query-fanout")
+        self.counters = Counters("Query fan-out", self.stats, log_every)
+
+    def run(self, query: str, service_sku: str = None):
+        variants = expand_query(query, service_sku, self.max_queries)
+        futures = [self.executor.submit(self.search, variant) for variant in variants]
+        rankings = []
+        failures = 0
+        for variant, future in zip(variants, futures):
+            try:
+                rankings.append(list(future.result()))
+            except Exception as e:
+                # The other variants still answer
+                failures += 1
+                logger.warning(f"Knowledge base query {variant!r} failed: {e}")
+        if len(rankings) == 0:
+            self.counters.record(calls=1, queries=len(variants), failures=failures)
+            raise Exception(f"All the knowledge base queries for {query!r} failed")
+        fused = reciprocal_rank_fusion(rankings, self.top, self.max_per_parent)
+        self.counters.record(calls=1, queries=len(variants), failures=failures, results=len(fused))
+        return fused
+
+    def stats(self):
+        calls = self.counters["calls"]
+        return {
+            "calls": calls,
+            "queries": self.counters["queries"],
+            "queries_per_call": self.counters["queries"] / calls if calls else 0.0,
+            "failures": self.counters["failures"],
+            "results_per_call": self.counters["results"] / calls if calls else 0.0,
+        }
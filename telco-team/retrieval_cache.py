@@ -0,0 +1,202 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from counters import Counters
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str):
+    """Normalize a query so the same question asked differently ("Router offline?", "router  offline") shares an entry."""
+    query = unicodedata.normalize("NFKC", query).lower()
+    query = re.sub(r"[^\w\s]", " ", query)
+    return " ".join(query.split())
+
+
+class InProcessRetrievalCache:
+    """An LRU of retrieval results with a TTL, bounded by number of entries and size in bytes, for one process."""
+
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 16 * 1024 * 1024, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, size, expires_at = entry
+            if expires_at < time.time():
+                self._pop(key)
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: dict):
+        size = len(json.dumps(value))
+        with self.lock:
+            self._pop(key)
+            if self.max_entries <= 0 or size > self.max_bytes:
+                return
+            self.entries[key] = (value, size, time.time() + self.ttl)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, (_, evicted_size, _) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _pop(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+
+class SQLiteRetrievalCache:
+    """Same as InProcessRetrievalCache, in a SQLite database shared by the team host workers of a node."""
+
+    def __init__(self, path: str, max_entries: int = 1000, max_bytes: int = 16 * 1024 * 1024, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS retrievals (key TEXT PRIMARY KEY, value TEXT, size INTEGER, expires_at REAL, used_at REAL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS retrievals_used ON retrievals (used_at)")
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "UPDATE retrievals SET used_at = ? WHERE key = ? AND expires_at >= ? RETURNING value", (now, key, now)
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, key: str, value: dict):
+        data = json.dumps(value)
+        if self.max_entries <= 0 or len(data) > self.max_bytes:
+            return
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.execute("INSERT OR REPLACE INTO retrievals VALUES (?, ?, ?, ?, ?)", (key, data, len(data), now + self.ttl, now))
+                self.connection.execute("DELETE FROM retrievals WHERE expires_at < ?", (now,))
+                # Evict the least recently used entries beyond the bounds
+                count, size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM retrievals").fetchone()
+                if count > self.max_entries or size > self.max_bytes:
+                    rows = self.connection.execute("SELECT key, size FROM retrievals ORDER BY used_at").fetchall()
+                    evicted = []
+                    for evicted_key, evicted_size in rows:
+                        if count <= self.max_entries and size <= self.max_bytes:
+                            break
+                        evicted.append((evicted_key,))
+                        count -= 1
+                        size -= evicted_size
+                    self.connection.executemany("DELETE FROM retrievals WHERE key = ?", evicted)
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM retrievals")
+
+
+class RetrievalCache:
+    """Caches the knowledge base retrievals by normalized query, and the filters applied to the search.
+
+    Entries are keyed on the index generation too: when the indexer completes a run (see watch_indexer), the
+    generation changes and the entries of the previous one are no longer served. Hits report the latency of
+    the search they replaced.
+    """
+
+    def __init__(self, backend, log_every: int = 100):
+        self.backend = backend
+        self.generation = ""
+        self.counters = Counters("Retrieval cache", self.stats, log_every)
+
+    def search(self, query: str, run, filters: dict = None):
+        """Return the cached result of query with filters, or run() and cache its (JSON serializable) result."""
+        start = time.perf_counter()
+        key = json.dumps([self.generation, normalize_query(query), filters or {}], sort_keys=True)
+        entry = self.backend.get(key)
+        if entry is not None:
+            self.counters.record(hits=1, saved_latency=max(0.0, entry["latency"] - (time.perf_counter() - start)))
+            return entry["result"]
+
+        result = run()
+        latency = time.perf_counter() - start
+        self.backend.put(key, {"result": result, "latency": latency})
+        self.counters.record(misses=1)
+        return result
+
+    def invalidate(self, generation: str):
+        """Start a new index generation, the cached retrievals of the previous one are dropped."""
+        if generation == self.generation:
+            return
+        if self.generation != "":
+            logger.info(f"Index changed ({generation}), clearing the retrieval cache")
+            self.backend.clear()
+            self.counters.add(invalidations=1)
+        self.generation = generation
+
+    def watch_indexer(self, indexer_client, indexer_name: str, interval: float):
+        """Poll the indexer status in a background thread, invalidating the cache after each completed run."""
+        def _watch():
+            while True:
+                try:
+                    last_result = indexer_client.get_indexer_status(indexer_name).last_result
+                    if last_result is not None and last_result.end_time is not None:
+                        self.invalidate(last_result.end_time.isoformat())
+                except Exception as e:
+                    logger.warning(f"Could not get the status of indexer {indexer_name}: {e}")
+                time.sleep(interval)
+
+        threading.Thread(target=_watch, name="retrieval-cache-indexer", daemon=True).start()
+
+    def stats(self):
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            "hits": self.counters["hits"],
+            "misses": self.counters["misses"],
+            "hit_rate": self.counters["hits"] / lookups if lookups else 0.0,
+            "saved_latency_seconds": round(self.counters["saved_latency"], 3),
+            "invalidations": self.counters["invalidations"],
+        }
+
+
+def create_retrieval_cache():
+    """Create the retrieval cache, RETRIEVAL_CACHE selects memory (default), sqlite or none."""
+    kind = os.getenv("RETRIEVAL_CACHE", "memory")
+    if kind == "none":
+        return None
+    bounds = {
+        "max_entries": int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", "1000")),
+        "max_bytes": int(os.getenv("RETRIEVAL_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+        "ttl": float(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", "3600")),
+    }
+    if kind == "sqlite":
+        return RetrievalCache(SQLiteRetrievalCache(os.getenv("RETRIEVAL_CACHE_SQLITE_PATH", "retrieval_cache.db"), **bounds))
+    if kind != "memory":
+        raise ValueError(f"Invalid retrieval cache: {kind}")
+    return RetrievalCache(InProcessRetrievalCache(**bounds))
@@ -0,0 +1,95 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from vanilla_aiagents.askable import Askable
+from vanilla_aiagents.conversation import Conversation, ConversationMetrics
+
+logger = logging.getLogger(__name__)
+
+# Variables of the session protocol, values are strings so they also travel over gRPC
+SESSION_ID = "_session_id"
+SESSION_VERSION = "_session_version"
+SESSION_WINDOW = "_session_window"
+# Result returned when a delta request does not match the cached conversation, the caller must send it in full
+SESSION_MISS = "session-miss"
+
+
+class SessionTeam(Askable):
+    """Keeps the recent conversations of a team in memory, so callers only send the new messages of each turn.
+
+    A request carrying _session_id and _session_version holds only the new messages: they are appended to
+    the cached conversation if its version matches, otherwise SESSION_MISS is returned and the caller sends
+    the whole conversation again. A request without _session_version holds the whole conversation and
+    replaces the cached one. Responses hold the new messages only, and the new _session_version.
+    """
+
+    def __init__(self, askable: Askable, max_entries: int = 1000, ttl: float = 1800):
+        super().__init__(f"{askable.id}-session", askable.description)
+        self.askable = askable
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def ask(self, conversation: Conversation, stream=False):
+        variables = dict(conversation.variables)
+        session_id = variables.pop(SESSION_ID, None)
+        version = variables.pop(SESSION_VERSION, None)
+        window = int(variables.pop(SESSION_WINDOW, 0) or 0)
+
+        history = []
+        if version is not None:
+            history = self._get(session_id, version)
+            if history is None:
+                logger.info(f"Session {session_id} version {version} not cached, asking for the whole conversation")
+                if stream:
+                    # Keep the stream well formed, the host stops reading it at the matching end mark
+                    conversation.update(["start", self.id])
+                    conversation.update(["end", self.id])
+                return SESSION_MISS
+
+        delta = conversation.messages
+        messages = history + delta
+        if window > 0:
+            messages = messages[-window:]
+        team_conversation = Conversation(
+            messages=list(messages),
+            variables=variables,
+            metrics=ConversationMetrics(total_tokens=0, prompt_tokens=0, completion_tokens=0),
+            log=[],
+        )
+        # Updates of the team go straight to the stream of the host
+        team_conversation.stream_queue = conversation.stream_queue
+        result = self.askable.ask(team_conversation, stream=stream)
+
+        new_messages = team_conversation.messages[len(messages):]
+        new_version = uuid.uuid4().hex
+        if session_id is not None:
+            self._put(session_id, new_version, messages + new_messages)
+
+        conversation.messages = delta + new_messages
+        conversation.variables = {**team_conversation.variables, SESSION_VERSION: new_version}
+        conversation.metrics = team_conversation.metrics
+        return result
+
+    def _get(self, session_id: str, version: str):
+        with self.lock:
+            entry = self.sessions.get(session_id)
+            if entry is None or entry[0] != version or entry[2] < time.monotonic():
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.sessions.move_to_end(session_id)
+            return list(entry[1])
+
+    def _put(self, session_id: str, version: str, messages: list[dict]):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+            self.sessions[session_id] = (version, messages, time.monotonic() + self.ttl)
+            while len(self.sessions) > self.max_entries:
+                self.sessions.popitem(last=False)
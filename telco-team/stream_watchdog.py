@@ -0,0 +1,65 @@
+import logging
+import time
+
+from vanilla_aiagents.team import Team
+
+logger = logging.getLogger(__name__)
+
+
+class StreamAbandonedError(Exception):
+    """Raised in the team thread when nobody reads its stream updates anymore."""
+
+
+class _WatchedQueue:
+    # Wraps the stream queue of a conversation: the host reads it as fast as the updates come, unless the
+    # caller went away. More than max_pending unread updates for stall_timeout seconds means it is gone.
+    def __init__(self, queue, max_pending: int, stall_timeout: float):
+        self.queue = queue
+        self.max_pending = max_pending
+        self.stall_timeout = stall_timeout
+        self.stalled_since = None
+
+    def put_nowait(self, item):
+        if self.queue.qsize() > self.max_pending:
+            now = time.monotonic()
+            if self.stalled_since is None:
+                self.stalled_since = now
+            elif now - self.stalled_since > self.stall_timeout:
+                raise StreamAbandonedError(f"{self.queue.qsize()} updates unread for {self.stall_timeout}s")
+        else:
+            self.stalled_since = None
+        self.queue.put_nowait(item)
+
+    def get(self, *args, **kwargs):
+        return self.queue.get(*args, **kwargs)
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def empty(self):
+        return self.queue.empty()
+
+
+class WatchedTeam(Team):
+    """A Team that stops a streamed ask when its caller disconnected, instead of running every agent for nobody.
+
+    The gRPC host keeps running an ask after its caller went away, the updates are just no longer read: the team
+    stops at the next update once more than max_pending of them stayed unread for stall_timeout seconds. The REST
+    host keeps reading the updates of an abandoned call, the watchdog never fires there.
+    """
+
+    def __init__(self, *args, max_pending: int = 32, stall_timeout: float = 2, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_pending = max_pending
+        self.stall_timeout = stall_timeout
+        self.abandoned = 0
+
+    def ask(self, conversation, stream=False):
+        if stream and not isinstance(conversation.stream_queue, _WatchedQueue):
+            conversation.stream_queue = _WatchedQueue(conversation.stream_queue, self.max_pending, self.stall_timeout)
+        try:
+            return super().ask(conversation, stream=stream)
+        except StreamAbandonedError as e:
+            self.abandoned += 1
+            logger.warning(f"[Team {self.id}] stream abandoned by the caller, stopping: {e}")
+            return "abandoned"
@@ -3,18 +3,41 @@ from vanilla_aiagents.conversation import LastNMessagesStrategy
 from config import llm
 from typing import Annotated
 from azure.search.documents import SearchClient
+from azure.search.documents.indexes import SearchIndexerClient
 from azure.search.documents.models import VectorizableTextQuery
 from azure.identity import DefaultAzureCredential
 from azure.core.credentials import AzureKeyCredential
 import os
 
-key = os.getenv("AZURE_SEARCH_ADMIN_KEY")
-credential = DefaultAzureCredential() if key is None or key == "" else AzureKeyCredential(key)
-search_client = SearchClient(
-    endpoint=os.getenv("AZURE_SEARCH_ENDPOINT"),
-    index_name=os.getenv("AZURE_SEARCH_INDEX"),
-    credential=credential
-)
+# KNOWLEDGE_BASE selects Azure AI Search (azure_search, default) or the local engine of local_kb.py (local)
+local_knowledge_base = None
+search_client = None
+if os.getenv("KNOWLEDGE_BASE", "azure_search") == "local":
+    from local_kb import create_local_knowledge_base
+    local_knowledge_base = create_local_knowledge_base()
+else:
+    key = os.getenv("AZURE_SEARCH_ADMIN_KEY")
+    credential = DefaultAzureCredential() if key is None or key == "" else AzureKeyCredential(key)
+    search_client = SearchClient(
+        endpoint=os.getenv("AZURE_SEARCH_ENDPOINT"),
+        index_name=os.getenv("AZURE_SEARCH_INDEX"),
+        credential=credential
+    )
+
+# Customers ask the same few questions all day, their retrievals are cached until the indexer runs again
+from retrieval_cache import create_retrieval_cache
+retrieval_cache = create_retrieval_cache()
+indexer_poll_interval = float(os.getenv("RETRIEVAL_CACHE_INDEXER_POLL_SECONDS", "300"))
+if retrieval_cache is not None and local_knowledge_base is not None:
+    # The local knowledge base only changes when it is rebuilt, i.e. on restart
+    retrieval_cache.invalidate(local_knowledge_base.generation)
+elif retrieval_cache is not None and indexer_poll_interval > 0:
+    retrieval_cache.watch_indexer(
+        SearchIndexerClient(endpoint=os.getenv("AZURE_SEARCH_ENDPOINT"), credential=credential),
+        # The indexer is named after the index (see infra/scripts/setup_aisearch.py)
+        os.getenv("RETRIEVAL_CACHE_INDEXER", os.getenv("AZURE_SEARCH_INDEX")),
+        indexer_poll_interval
+    )
 
 technical_support_agent = Agent(  
     id="TechnicalSupport",
@@ -46,14 +69,15 @@ technical_support_agent = Agent(
     reading_strategy=LastNMessagesStrategy(10)
 )
 
-from configuration_store import ConfigurationStore
+from configuration_store import ConfigurationStore, create_configuration_store
 from azure.identity import DefaultAzureCredential
-configuration_store = ConfigurationStore(
+# Statuses change rarely, tool calls are answered from a cache kept up to date by the change feed
+configuration_store = create_configuration_store(ConfigurationStore(
     url=os.getenv("COSMOSDB_ENDPOINT"),
     key=DefaultAzureCredential(),
     database_name=os.getenv("COSMOSDB_DATABASE"),
     container_name="configuration"
-)
+))
 
 @technical_support_agent.register_tool(description="Get the service status, values can be INET_MOBILE, INET_BUNDLE, INET_HOME")
 def get_service_status(
@@ -101,17 +125,47 @@ def open_internal_ticket(
         return f"Error: Failed to file internal ticket {e}"
 
 @technical_support_agent.register_tool(description="Query the knowledge base")
-def query_knowledge_base(query: Annotated[str, "The query to search in the knowledge base"]) -> Annotated[str, "Relevant documentation from the knowledge base"]:
+def query_knowledge_base(
+    query: Annotated[str, "The query to search in the knowledge base"],
+    service_sku: Annotated[str, "The SKU of the service the query is about when known, values can be INET_MOBILE, INET_BUNDLE, INET_HOME"] = ""
+    ) -> Annotated[str, "Relevant documentation from the knowledge base"]:
+    if retrieval_cache is None:
+        return _search_knowledge_base(query, service_sku)
+    # The SKU only changes the results of a fanned out query
+    filters = {"service_sku": service_sku} if query_fanout is not None and service_sku in SERVICE_TERMS else None
+    return retrieval_cache.search(query, lambda: _search_knowledge_base(query, service_sku), filters)
+
+def _search_documents(query: str):
+    if local_knowledge_base is not None:
+        return local_knowledge_base.search(query, top=5, k_nearest_neighbors=1)
     vector_query = VectorizableTextQuery(text=query, k_nearest_neighbors=1, fields="text_vector", exhaustive=True)
-    search_results = search_client.search(
+    return list(search_client.search(
         search_text=query,  
         vector_queries= [vector_query],
-        select=["title", "chunk_id", "chunk"],
+        select=["title", "chunk_id", "chunk", "parent_id"],
         top=5
-    )
-    
-    # Chunk id has format {parent_id}_pages_{page_number}
-    
-    sources_formatted = "\n".join([f'# Source "{document["title"]}" - Page {document["chunk_id"].split("_")[-1]}\n{document["chunk"]}' for document in search_results])
+    ))
+
+# With KB_QUERY_MODE=fanout, each tool call runs several variants of the query concurrently and fuses their results,
+# instead of the agent rewriting the query after a miss
+from query_fanout import SERVICE_TERMS, QueryFanOut
+query_fanout = QueryFanOut(
+    _search_documents,
+    max_queries=int(os.getenv("KB_FANOUT_MAX_QUERIES", "4")),
+    top=int(os.getenv("KB_FANOUT_TOP", "5")),
+    max_per_parent=int(os.getenv("KB_FANOUT_MAX_CHUNKS_PER_DOCUMENT", "2")),
+) if os.getenv("KB_QUERY_MODE", "single") == "fanout" else None
+
+# Tool results are packed in a token budget: duplicated text of the same document is removed and the best passages kept
+from context_packing import create_context_packer, format_sources
+context_packer = create_context_packer()
+
+def _search_knowledge_base(query: str, service_sku: str = ""):
+    if query_fanout is not None:
+        search_results = query_fanout.run(query, service_sku or None)
+    else:
+        search_results = _search_documents(query)
     
-    return sources_formatted
\ No newline at end of file
+    if context_packer is not None:
+        return context_packer.pack(search_results)
+    return format_sources(search_results)
@@ -1,11 +1,14 @@
+import os
 from typing import Dict, List, Tuple
-from vanilla_aiagents.team import Team
 from user_proxy_agent import user_proxy_agent
 from sales_agent import sales_agent
 from activation_agent import activation_agent
 from planner_agent import planner_agent
 from support_agent import technical_support_agent
 from config import llm
+from session_team import SessionTeam
+from stream_watchdog import WatchedTeam
+from vanilla_aiagents.team import Team
 
 system_message_manager="""
     You are the overall manager of the group chat. 
@@ -15,10 +18,27 @@ system_message_manager="""
     If you need human or user input, you can ask Customer for more information.
     NEVER call Customer immediately after Executor
     """
-team = Team(
+team_settings = dict(
     id="telco-team",
     description="A group chat with multiple agents",
     members=[user_proxy_agent, planner_agent, sales_agent, activation_agent, technical_support_agent],
     llm=llm, 
     stop_callback=lambda msgs: "terminate" in msgs[-1].get("content", "").lower(),
 )
+# Streamed asks stop early when their updates stay unread. Only the gRPC host stops reading a call the API
+# cancelled (the REST host keeps draining it), so the watchdog is on where it is enabled for that host
+if os.getenv("TEAM_STREAM_WATCHDOG", "false") == "true":
+    team = WatchedTeam(
+        **team_settings,
+        max_pending=int(os.getenv("TEAM_STREAM_MAX_PENDING", "32")),
+        stall_timeout=float(os.getenv("TEAM_STREAM_STALL_SECONDS", "2")),
+    )
+else:
+    team = Team(**team_settings)
+
+# Same team, keeping the recent conversations so the API can send only the new messages of each turn
+session_team = SessionTeam(
+    team,
+    max_entries=int(os.getenv("TEAM_SESSION_CACHE_MAX_ENTRIES", "1000")),
+    ttl=float(os.getenv("TEAM_SESSION_CACHE_TTL_SECONDS", "1800")),
+)
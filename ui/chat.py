@@ -5,6 +5,8 @@ from dotenv import load_dotenv
 import chainlit as cl
 from chainlit.element import ElementBased
 import requests
+import websockets
+import asyncio
 import os
 from uuid import uuid4
 import logging
@@ -50,9 +52,11 @@ class APIClient:
         response = requests.post(f"{self.base_url}/conversation/{conversation_id}", data=compressed_payload, headers=headers)
         return response.json()
     
-    def post_message_stream(self, conversation_id, message):
+    def post_message_stream(self, conversation_id, message, idempotency_key=None):
         payload = message if isinstance(message, dict) else {"message": message}
         headers = {'Content-Encoding': 'gzip', 'Content-Type': 'application/json'}
+        if idempotency_key is not None:
+            headers['Idempotency-Key'] = idempotency_key
         compressed_payload = gzip.compress(json.dumps(payload).encode('utf-8'))
         response = requests.post(f"{self.base_url}/conversation/{conversation_id}/stream", data=compressed_payload, headers=headers, stream=True)
         response.raise_for_status()
@@ -68,9 +72,74 @@ class APIClient:
         
         return result
     
-    def get_messages(self, conversation_id):
-        response = requests.get(f"{self.base_url}/conversation/{conversation_id}")
-        return response.json()
+    def get_messages(self, conversation_id, since=0, etag=None):
+        """Get the messages from index since on, returns (messages, etag, message count). messages is None when etag is still current."""
+        headers = {'If-None-Match': etag} if etag is not None else {}
+        response = requests.get(f"{self.base_url}/conversation/{conversation_id}", params={"since": since}, headers=headers)
+        count = int(response.headers.get("X-Message-Count", since))
+        if response.status_code == 304:
+            return None, etag, count
+        response.raise_for_status()
+        return response.json(), response.headers.get("ETag"), count
+    
+    def socket_url(self, conversation_id):
+        return f"{self.base_url.replace('http', 'ws', 1)}/conversation/{conversation_id}/ws?channel=chat"
+
+class ConversationSocket:
+    """A WebSocket kept open for the whole chat session, carrying every turn of the conversation.
+    
+    Messages pushed by the API (e.g. added by another client) are passed to on_message.
+    """
+    def __init__(self, url, on_message):
+        self.url = url
+        self.on_message = on_message
+        self.websocket = None
+        self.reader = None
+        self.updates = asyncio.Queue()
+        # Turns whose updates were not read up to their result
+        self.unfinished = 0
+    
+    async def connect(self):
+        self.websocket = await websockets.connect(self.url)
+        self.reader = asyncio.ensure_future(self._read())
+    
+    async def _read(self):
+        try:
+            async for data in self.websocket:
+                for line in data.splitlines():
+                    mark, content = json.loads(line)
+                    if mark == "message":
+                        await self.on_message(content)
+                    else:
+                        self.updates.put_nowait([mark, content])
+        finally:
+            self.updates.put_nowait(["error", {"status": 503, "detail": "Connection to the API closed"}])
+    
+    async def ask(self, message, idempotency_key=None):
+        if self.websocket is None or self.reader.done():
+            await self.connect()
+        # Skip what is left of the previous turns
+        while self.unfinished > 0:
+            mark, _ = await self.updates.get()
+            if mark in ["result", "error"]:
+                self.unfinished -= 1
+        
+        payload = message if isinstance(message, dict) else {"message": message}
+        await self.websocket.send(json.dumps({**payload, "id": idempotency_key}))
+        self.unfinished += 1
+        while True:
+            mark, content = await self.updates.get()
+            if mark in ["result", "error"]:
+                self.unfinished -= 1
+            if mark == "error":
+                raise Exception(f"Turn failed: {content}")
+            yield [mark, content]
+            if mark == "result":
+                return
+    
+    async def close(self):
+        if self.websocket is not None:
+            await self.websocket.close()
     
 client = APIClient()
 INTRO_MESSAGE = "Hi!"
@@ -83,13 +152,23 @@ async def setup_agents():
         logging.info(f"Starting new conversation with id: {conversation_id}")
         cl.user_session.set('conversation_id', conversation_id)
         cl.user_session.set('last_seen_message_index', 0)
+        cl.user_session.set('socket', ConversationSocket(client.socket_url(conversation_id), lambda m: display_messages([m])))
         
         messages = await send_message(conversation_id, INTRO_MESSAGE)        
         await display_messages(messages)
     else:
         logging.info(f"Resuming conversation with id: {conversation_id}")
-        messages = client.get_messages(conversation_id) or []
-        await display_messages(messages)
+        # Only fetch the messages not seen yet, nothing at all when the conversation did not change
+        messages, etag, count = client.get_messages(conversation_id, since=cl.user_session.get('last_seen_message_index') or 0, etag=cl.user_session.get('conversation_etag'))
+        cl.user_session.set('last_seen_message_index', count)
+        cl.user_session.set('conversation_etag', etag)
+        await display_messages(messages or [])
+
+@cl.on_chat_end
+async def close_socket():
+    socket = cl.user_session.get('socket')
+    if socket is not None:
+        await socket.close()
 
 def get_conversation_id():
     conversation_id = cl.user_session.get('conversation_id')
@@ -116,11 +195,11 @@ async def run_conversation(message: cl.Message):
     new_messages = await send_message(conversation_id, {
         "message": message.content,
         "media": images if len(images) > 0 else None
-    })    
+    }, idempotency_key=message.id)    
     
     await display_messages(new_messages)
 
-async def send_message(conversation_id, message, speak=False):
+async def send_message(conversation_id, message, speak=False, idempotency_key=None):
     logging.info(f"conversation_id: {conversation_id}, message: {message}")
     # new_messages = client.post_message(conversation_id, message)
     
@@ -132,7 +211,12 @@ async def send_message(conversation_id, message, speak=False):
     msg = None
     tool = None
     name = None
-    for mark, content in client.post_message_stream(conversation_id, message):
+    # One socket per chat session instead of a request per message
+    socket = cl.user_session.get('socket')
+    if socket is None:
+        socket = ConversationSocket(client.socket_url(conversation_id), lambda m: display_messages([m]))
+        cl.user_session.set('socket', socket)
+    async for mark, content in socket.ask(message, idempotency_key=idempotency_key):
         logger.debug(f"Received mark: {mark}, content: {content}")
         if mark == "start":
             name = content
@@ -143,7 +227,7 @@ async def send_message(conversation_id, message, speak=False):
             if text is not None:
                 collected_messages.append(text)
                 await msg.stream_token(text)
-                if text in tts_sentence_end:
+                if text and text[-1] in tts_sentence_end:
                     speech = " ".join(collected_messages).strip()
                     # Sub-optimal solution, Chainlit has issues playing multiple audio files
                     # await speak_message(msg, speech)
@@ -156,7 +240,7 @@ async def send_message(conversation_id, message, speak=False):
             await tool.stream_token(json.dumps(content), is_input=False)
             await tool.send()
             tool = None        
-        if mark == "end":
+        if mark == "end" and msg is not None:
             await msg.update()
             await msg.send()
         if mark == "response":
@@ -1,4 +1,6 @@
 from contextlib import asynccontextmanager
+import asyncio
+import json
 import os
 import uuid
 from urllib.parse import urlencode
@@ -29,6 +31,8 @@ async def lifespan(app: FastAPI):
     yield
     
     # Cleanup logic
+    for socket, _ in list(api_sockets.values()):
+        await socket.close()
     await api_client_session.close()
     
 app = FastAPI(lifespan=lifespan)
@@ -43,14 +47,53 @@ async def validation_exception_handler(request, exc):
     )
 
 base_url = os.getenv("API_BASE_URL")
-async def ask_agents(input_message, conversation_id):
+# One WebSocket to the API per call, so each utterance does not set up a new request
+api_sockets = {}
+async def ask_agents(input_message, conversation_id, idempotency_key=None, call_connection_id=None):
     logger.info(f"Asking agents: {input_message}")
-    async with api_client_session.post(f"{base_url}/conversation/{conversation_id}", json={"message": input_message}) as response:
+    if call_connection_id is not None:
+        try:
+            return await ask_agents_socket(input_message, conversation_id, call_connection_id, idempotency_key)
+        except (aiohttp.ClientError, ConnectionError) as e:
+            logger.warning(f"WebSocket to the API failed, falling back to HTTP: {e}")
+            await close_api_socket(call_connection_id)
+    headers = {"X-Channel": "voice"}
+    if idempotency_key is not None:
+        headers["Idempotency-Key"] = idempotency_key
+    async with api_client_session.post(f"{base_url}/conversation/{conversation_id}", json={"message": input_message}, headers=headers) as response:
         logger.debug(f"Ask response: {response.status}")
         response.raise_for_status()
         new_messages = await response.json()
         return new_messages
 
+async def ask_agents_socket(input_message, conversation_id, call_connection_id, idempotency_key=None):
+    if call_connection_id not in api_sockets or api_sockets[call_connection_id][0].closed:
+        socket = await api_client_session.ws_connect(f"{base_url}/conversation/{conversation_id}/ws?channel=voice")
+        api_sockets[call_connection_id] = (socket, asyncio.Lock())
+    socket, lock = api_sockets[call_connection_id]
+    
+    # The answers of the turn are the responses of the agents, the turn ends with its result
+    answers = []
+    async with lock:
+        await socket.send_json({"message": input_message, "id": idempotency_key})
+        while True:
+            message = await socket.receive()
+            if message.type != aiohttp.WSMsgType.TEXT:
+                raise ConnectionError(f"WebSocket to the API closed: {message.type}")
+            for line in message.data.splitlines():
+                mark, content = json.loads(line)
+                if mark == "response" and content[0].get("content"):
+                    answers.append(content[0])
+                elif mark == "error":
+                    raise Exception(f"Agents failed: {content}")
+                elif mark == "result":
+                    return answers
+
+async def close_api_socket(call_connection_id):
+    socket, _ = api_sockets.pop(call_connection_id, (None, None))
+    if socket is not None:
+        await socket.close()
+
 from azure.eventgrid import EventGridEvent, SystemEventNames
 from azure.core.messaging import CloudEvent
 from azure.communication.callautomation import (
@@ -142,6 +185,7 @@ async def play_message(call_connection_id, text_to_play, context):
         operation_context=context)
 
 async def terminate_call(call_connection_id):     
+    await close_api_socket(call_connection_id)
     await call_automation_client.get_call_connection(call_connection_id).hang_up(is_for_everyone=True)  
             
 HELLO_PROMPT = "Hello, how may I help you today?"
@@ -179,7 +223,8 @@ async def handle_callback(req: Request):
                      logger.info("Recognition completed, speech_text: %s", speech_text); 
                      if speech_text is not None and len(speech_text) > 0:                      
                           
-                        answers = await ask_agents(speech_text, conversation_id=caller_id)
+                        # ACS retries the callback with the same event id
+                        answers = await ask_agents(speech_text, conversation_id=caller_id, idempotency_key=event.id, call_connection_id=call_connection_id)
                         # TODO review if and why user resposes are returned in the answers
                         final_answer = "\n".join([answer['content'] for answer in answers if answer['role'] == "assistant"])
                         logger.info("Agent response: %s", final_answer)
@@ -203,6 +248,10 @@ async def handle_callback(req: Request):
                     max_retry_dict.pop(call_connection_id)
                     await play_message(call_connection_id, GOODBYE_PROMPT, GOODBYE_CONTEXT)
                  
+            elif event.type == "Microsoft.Communication.CallDisconnected":
+                # Closing the socket also cancels a turn still running for the caller
+                await close_api_socket(call_connection_id)
+                
             elif event.type == "Microsoft.Communication.PlayCompleted":
                 context = event.data['operationContext']    
                 if context.lower() == GOODBYE_CONTEXT.lower():